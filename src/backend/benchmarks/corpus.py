@@ -0,0 +1,104 @@
+"""
+Benchmark corpora: the bundled assignment datasets, and synthetic corpora of any size made by mutating them.
+
+A synthetic file is a bundled file with some of its identifiers renamed, comment and blank lines inserted
+and a few no-op statements added, the kind of edits used to disguise copied code. Base files are drawn at
+random, so large corpora contain clusters of near-duplicates like a real plagiarism case would.
+"""
+import io
+import os
+import ast
+import random
+import keyword
+import builtins
+import tokenize
+import zipfile
+from controller.v1_report_generation import extract_python_files_from_zip
+
+DATA_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'controller', 'data_folder')
+METRICS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'controller', 'metrics')
+
+_RESERVED = set(keyword.kwlist) | set(keyword.softkwlist) | set(dir(builtins)) | {'self', 'cls'}
+_COMMENTS = ('# TODO', '# helper', '# check edge case', '# main logic', '# read input', '# loop over items', '#')
+
+
+def dataset_names() -> list[str]:
+    return sorted(name[:-len('.zip')] for name in os.listdir(DATA_FOLDER) if name.endswith('.zip'))
+
+
+def load_dataset(name) -> list[tuple[str, str]]:
+    """(filename, content) pairs of a bundled dataset."""
+    with open(os.path.join(DATA_FOLDER, f"{name}.zip"), 'rb') as f:
+        return extract_python_files_from_zip(f.read())
+
+
+def plagiarized_files(name) -> set[str]:
+    """Names of the files a bundled dataset's ground truth marks plagiarized."""
+    import pandas as pd
+
+    df = pd.read_csv(os.path.join(METRICS_DIR, f"{name}_modified_analysis_results.csv"))
+    return set(df.loc[df['Status'] == 1, '0'])
+
+
+def _rename_identifiers(source, rng, fraction):
+    """Rename a fraction of the names the file defines or uses, consistently. Attributes are left alone."""
+    tokens = list(tokenize.generate_tokens(io.StringIO(source).readline))
+    names = {
+        tok.string for i, tok in enumerate(tokens)
+        if tok.type == tokenize.NAME and tok.string not in _RESERVED and not (i and tokens[i - 1].string == '.')
+    }
+    renamed = {name: f"{name}_{rng.randrange(100)}" for name in sorted(names) if rng.random() < fraction}
+    lines = source.splitlines(keepends=True)
+    # Replace from the end so earlier offsets on the same line stay valid
+    for i, tok in reversed(list(enumerate(tokens))):
+        if tok.type == tokenize.NAME and tok.string in renamed and not (i and tokens[i - 1].string == '.'):
+            row, col = tok.start
+            line = lines[row - 1]
+            lines[row - 1] = line[:col] + renamed[tok.string] + line[col + len(tok.string):]
+    return ''.join(lines)
+
+
+def _insert_lines(source, rng, fraction):
+    """Insert comment and blank lines, and no-op assignments between top-level statements."""
+    out = []
+    for line in source.splitlines():
+        indent = line[:len(line) - len(line.lstrip())]
+        if line.strip() and rng.random() < fraction:
+            out.append(indent + rng.choice(_COMMENTS))
+        if not indent and line.strip() and rng.random() < fraction / 2:
+            out.append(f"_unused_{rng.randrange(1000)} = {rng.randrange(100)}")
+        out.append(line)
+        if rng.random() < fraction / 2:
+            out.append('')
+    return '\n'.join(out) + '\n'
+
+
+def mutate(source, rng: random.Random, strength=0.3) -> str:
+    """A disguised copy of source: about strength of its names renamed and lines with inserted comments."""
+    try:
+        mutated = _insert_lines(_rename_identifiers(source, rng, strength), rng, strength)
+        ast.parse(mutated)
+        return mutated
+    except (SyntaxError, tokenize.TokenError, IndentationError, ValueError):
+        # Files the tokenizer or parser rejects are kept as they are, the pipeline must handle them anyway
+        return source
+
+
+def synthetic_corpus(n_files, seed=0, strength=0.3) -> list[tuple[str, str]]:
+    """n_files mutated copies of files drawn from every bundled dataset, the same for the same seed."""
+    rng = random.Random(seed)
+    pool = [file for name in dataset_names() for file in load_dataset(name)]
+    corpus = []
+    for i in range(n_files):
+        base_name, source = rng.choice(pool)
+        corpus.append((f"synthetic/{i:05d}_{os.path.basename(base_name)}", mutate(source, rng, strength)))
+    return corpus
+
+
+def to_zip(files) -> bytes:
+    """Pack (filename, content) pairs into a zip, as an upload would arrive."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, content in files:
+            zf.writestr(name, content)
+    return buffer.getvalue()
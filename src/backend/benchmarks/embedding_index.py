@@ -0,0 +1,115 @@
+"""
+Measure recall and latency of the embedding index (EMBEDDING_INDEX) against brute force, on the bundled datasets.
+
+Run from src/backend:
+    python -m benchmarks.embedding_index [--datasets p02405 p00005] [--nprobe 1 2 4 8 16] [--top-k 5] [--output ann.json]
+
+Every dataset is embedded once and added to a fresh index as one job, in order, the way the worker adds jobs.
+Before each job is added, its files query the index built from the jobs before it: once exhaustively (brute
+force over every stored vector) and once per nprobe. For each nprobe it reports:
+  recall@k:  of the exhaustive top k neighbours, the share the index finds
+  latency:   milliseconds per queried file, against the exhaustive search
+Adding and maintaining (compacting and clustering) the index are timed per job as well.
+"""
+import json
+import time
+import argparse
+import tempfile
+import numpy as np
+from benchmarks.corpus import dataset_names, load_dataset
+from embedding_index import EmbeddingIndex
+
+DEFAULT_NPROBES = (1, 2, 4, 8, 16)
+
+
+def embed_dataset(dataset) -> tuple[list[str], list[str], np.ndarray]:
+    """File names, content hashes and embeddings of a bundled dataset."""
+    from controller.algorithms.v1_NLP import EmbeddingSimilarity
+    from controller.algorithms.model_loader import EMBEDDING_MODEL
+
+    files = [(name, content) for name, content in load_dataset(dataset) if content.strip()]
+    embedder = EmbeddingSimilarity(EMBEDDING_MODEL)
+    embeddings = embedder.get_embeddings_batch([content for _, content in files]).cpu().numpy().astype(np.float32)
+    return [name for name, _ in files], [embedder.hash_code(content) for _, content in files], embeddings
+
+
+def recall(found, exact) -> float:
+    """Share of the exact neighbours (id >= 0) found, over all queries."""
+    hits = total = 0
+    for found_row, exact_row in zip(found, exact):
+        expected = set(exact_row[exact_row >= 0].tolist())
+        hits += len(expected & set(found_row.tolist()))
+        total += len(expected)
+    return hits / total if total else 1.0
+
+
+def measure(datasets, nprobes, top_k) -> dict:
+    jobs = []
+    with tempfile.TemporaryDirectory() as directory:
+        index = EmbeddingIndex(directory, background_maintenance=False)
+        for dataset in datasets:
+            files, content_hashes, embeddings = embed_dataset(dataset)
+            job = {'dataset': dataset, 'files': len(files), 'indexed': index.stats()['vectors'], 'nprobe': {}}
+            if job['indexed']:
+                start = time.perf_counter()
+                exact, _ = index.search(embeddings, top_k, exhaustive=True)
+                job['exhaustive_ms'] = 1000 * (time.perf_counter() - start) / len(files)
+                for nprobe in nprobes:
+                    start = time.perf_counter()
+                    found, _ = index.search(embeddings, top_k, nprobe)
+                    job['nprobe'][nprobe] = {
+                        'recall': recall(found, exact),
+                        'ms': 1000 * (time.perf_counter() - start) / len(files),
+                    }
+
+            start = time.perf_counter()
+            index.add(dataset, files, content_hashes, embeddings)
+            job['add_seconds'] = time.perf_counter() - start
+            start = time.perf_counter()
+            index.maintain()
+            job['maintain_seconds'] = time.perf_counter() - start
+            job['lists'] = index.stats()['lists']
+            jobs.append(job)
+            print(f"Indexed {dataset}: {len(files)} files, {job['indexed'] + len(files)} in the index")
+
+    # Pooled over the queried files of every job that had an index to query
+    summary = []
+    for nprobe in nprobes:
+        queried = [job for job in jobs if nprobe in job['nprobe']]
+        weights = [job['files'] for job in queried]
+        summary.append({
+            'nprobe': nprobe,
+            'recall': float(np.average([job['nprobe'][nprobe]['recall'] for job in queried], weights=weights)) if queried else None,
+            'ms': float(np.average([job['nprobe'][nprobe]['ms'] for job in queried], weights=weights)) if queried else None,
+            'exhaustive_ms': float(np.average([job['exhaustive_ms'] for job in queried], weights=weights)) if queried else None,
+        })
+    return {'top_k': top_k, 'jobs': jobs, 'summary': summary}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure recall and latency of the embedding index against brute force.")
+    parser.add_argument('--datasets', nargs='+', default=None, help='Bundled datasets, added in this order (default: all)')
+    parser.add_argument('--nprobe', type=int, nargs='+', default=list(DEFAULT_NPROBES), help='Lists searched per file')
+    parser.add_argument('--top-k', type=int, default=5, help='Neighbours per file')
+    parser.add_argument('--output', default=None, help='Also write the results to this json file')
+    args = parser.parse_args()
+
+    from controller.algorithms import model_loader
+    model_loader.warm_up()
+
+    result = measure(args.datasets or dataset_names(), args.nprobe, args.top_k)
+    print(f"\n{'job':>8} {'files':>6} {'indexed':>8} {'lists':>6} {'add s':>7} {'maintain s':>10}")
+    for job in result['jobs']:
+        print(f"{job['dataset']:>8} {job['files']:>6} {job['indexed']:>8} {job['lists']:>6} "
+              f"{job['add_seconds']:>7.3f} {job['maintain_seconds']:>10.3f}")
+    print(f"\n{'nprobe':>6} {'recall@' + str(args.top_k):>9} {'ms/file':>8} {'brute ms/file':>13}")
+    for row in result['summary']:
+        if row['recall'] is not None:
+            print(f"{row['nprobe']:>6} {row['recall']:>9.4f} {row['ms']:>8.3f} {row['exhaustive_ms']:>13.3f}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
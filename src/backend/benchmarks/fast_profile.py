@@ -0,0 +1,110 @@
+"""
+Compare the fast profile's TF-IDF embed_sim and the head model's output on it with the full profile's, on the
+bundled datasets with their ground truth. The head model was trained on CodeBERT's embed_sim; this measures how
+far its fast profile scores are from calibrated. Needs the CodeBERT weights.
+
+Run from src/backend:
+    python -m benchmarks.fast_profile [--datasets p02405 p00005] [--output fast_profile.json]
+
+Every dataset is scored with both profiles. Per dataset it reports the mean, p10 and p99 of embed_sim over all
+pairs for CodeBERT and for the TF-IDF cosine, and for the head model's plagiarism scores of both profiles:
+  mean:  the mean plagiarism score
+  flagged:  the share of files scoring at least 0.5
+  auc:  the ROC AUC of the scores against the ground truth
+  spearman:  the rank correlation of the fast scores with the full ones
+It also fits the affine map of the TF-IDF cosine that puts the pooled p10 and p99 onto CodeBERT's, a starting
+point should the fast profile ever be calibrated; the map is not applied.
+"""
+import os
+import json
+import argparse
+import numpy as np
+from benchmarks.corpus import dataset_names, load_dataset, plagiarized_files
+
+QUANTILES = (10, 99)
+
+
+def channel_stats(values) -> dict:
+    low, high = np.percentile(values, QUANTILES)
+    return {'mean': float(values.mean()), 'p10': float(low), 'p99': float(high)}
+
+
+def head_stats(scores, labels, reference=None) -> dict:
+    from scipy.stats import spearmanr
+    from sklearn.metrics import roc_auc_score
+
+    stats = {
+        'mean': float(scores.mean()),
+        'flagged': float(np.mean(scores >= 0.5)),
+        'auc': float(roc_auc_score(labels, scores)) if 0 < labels.sum() < len(labels) else None,
+    }
+    if reference is not None:
+        stats['spearman'] = float(spearmanr(scores, reference).statistic)
+    return stats
+
+
+def measure_dataset(dataset) -> dict:
+    from controller.algorithms.v1_NLP import feed_head_model
+
+    nlp = feed_head_model()
+    files = load_dataset(dataset)
+    full = nlp.compute_artifacts(files, profile='full')
+    fast = nlp.compute_artifacts(files, profile='fast')
+    plagiarized = plagiarized_files(dataset)
+    labels = np.array([os.path.basename(name) in plagiarized for name in full.files])
+    rows, cols = np.triu_indices(len(full), k=1)
+
+    def head(matrices):
+        return np.array([result['plagiarism_score'] for result in nlp.combinedPredict(files, matrices)])
+
+    full_scores = head(full.matrices)
+    return {
+        'dataset': dataset,
+        'codebert': channel_stats(full.matrices.embed_sim[rows, cols]),
+        'tfidf': channel_stats(fast.matrices.embed_sim[rows, cols]),
+        'head_full': head_stats(full_scores, labels),
+        'head_fast': head_stats(head(fast.matrices), labels, full_scores),
+    }
+
+
+def fit_map(results) -> dict:
+    """Scale and offset that map the pooled TF-IDF p10 and p99 onto CodeBERT's."""
+    codebert = [np.mean([r['codebert'][q] for r in results]) for q in ('p10', 'p99')]
+    tfidf = [np.mean([r['tfidf'][q] for r in results]) for q in ('p10', 'p99')]
+    scale = (codebert[1] - codebert[0]) / (tfidf[1] - tfidf[0])
+    return {'scale': float(scale), 'offset': float(codebert[0] - scale * tfidf[0])}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the fast profile's embedding channel and head model output with the full profile's.")
+    parser.add_argument('--datasets', nargs='+', default=None, help='Bundled datasets (default: all)')
+    parser.add_argument('--output', default=None, help='Also write the results to this json file')
+    args = parser.parse_args()
+
+    from controller.algorithms import model_loader
+    model_loader.warm_up()
+
+    results = []
+    for dataset in args.datasets or dataset_names():
+        results.append(measure_dataset(dataset))
+        print(f"Measured {dataset}")
+    fitted = fit_map(results)
+
+    print(f"\n{'dataset':>8} {'codebert':>20} {'tfidf':>20}")
+    for r in results:
+        channels = [f"{r[c]['mean']:.3f} [{r[c]['p10']:.3f}, {r[c]['p99']:.3f}]" for c in ('codebert', 'tfidf')]
+        print(f"{r['dataset']:>8} " + ' '.join(f"{c:>20}" for c in channels))
+    print(f"\n{'dataset':>8} {'full mean':>9} {'flagged':>7} {'auc':>6} {'fast mean':>9} {'flagged':>7} {'auc':>6} {'spearman':>8}")
+    for r in results:
+        full, fast = r['head_full'], r['head_fast']
+        auc = lambda stats: f"{stats['auc']:.3f}" if stats['auc'] is not None else '-'
+        print(f"{r['dataset']:>8} {full['mean']:>9.3f} {full['flagged']:>7.3f} {auc(full):>6} "
+              f"{fast['mean']:>9.3f} {fast['flagged']:>7.3f} {auc(fast):>6} {fast['spearman']:>8.3f}")
+    print(f"\nAffine map of TF-IDF onto CodeBERT's scale (not applied): scale {fitted['scale']:.4f}, offset {fitted['offset']:.4f}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'datasets': results, 'fitted': fitted}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
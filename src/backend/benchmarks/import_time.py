@@ -0,0 +1,67 @@
+"""
+Measure how long the backend's entry points take to import, each in a fresh interpreter,
+and which heavy ML modules get pulled in along the way.
+
+Run from src/backend:
+    python -m benchmarks.import_time [--repeat 3] [--budget 1.5]
+
+Exits non-zero if an entry point imports a heavy module or takes longer than the budget.
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Modules that should only load once the channel that needs them runs
+HEAVY_MODULES = ('torch', 'transformers', 'sklearn')
+
+ENTRY_POINTS = (
+    'worker',
+    'controller.v1_report_generation',
+    'controller.algorithms.tokenization',
+    'controller.algorithms.syntax_tree',
+)
+
+PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'heavy': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(module: str) -> dict:
+    # worker creates its AWS clients at import time, which needs a region
+    env = dict(os.environ, AWS_REGION=os.environ.get('AWS_REGION', 'us-east-1'))
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE.format(module=module, heavy=HEAVY_MODULES)],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time benchmark for the backend entry points.")
+    parser.add_argument('--repeat', type=int, default=3, help='Fresh interpreters per entry point, the best run counts (default: 3)')
+    parser.add_argument('--budget', type=float, default=None, help='Fail if any entry point takes longer than this many seconds')
+    args = parser.parse_args()
+
+    failed = False
+    for module in ENTRY_POINTS:
+        runs = [measure(module) for _ in range(args.repeat)]
+        best = min(run['seconds'] for run in runs)
+        heavy = runs[0]['heavy']
+        over_budget = args.budget is not None and best > args.budget
+        failed |= bool(heavy) or over_budget
+        note = f"  loads {', '.join(heavy)}" if heavy else ''
+        note += '  over budget' if over_budget else ''
+        print(f"{module:<40}{best:>8.3f} s{note}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+"""
+Benchmark the similarity pipeline on the bundled datasets and on synthetic corpora, check that the
+optimized scoring paths agree with the reference implementations, and enforce budgets.
+
+Run from src/backend:
+    python -m benchmarks.pipeline [--datasets p02405 p00005] [--sizes 1000 2000 5000 10000]
+                                  [--block-rows 64] [--budgets benchmarks/budgets.json] [--output results.json]
+
+Every case runs report_generation().generate on a zip in a fresh interpreter with the models already
+loaded, so its peak memory is its own. Wall time, the time of each pipeline step, pairs/second and peak
+memory are reported per case. With two or more synthetic sizes, seconds = a * files^b is fitted per step,
+so it shows which channel stops scaling first.
+
+Parity runs on a slice of a bundled dataset and compares each optimized path with what it replaced:
+the token matrix with MOSS_tok's pairwise report, one-pass and blocked AST scores with vector_ast's
+sklearn matrix, the embedding matrix with EmbeddingSimilarity.compute, and incremental jobs, sharded tiles,
+and file-cache hits with a plain one-pass job.
+
+Exits non-zero if a case exceeds its budget or a parity check its tolerance.
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import subprocess
+import contextlib
+from itertools import combinations
+import numpy as np
+from benchmarks.corpus import dataset_names, load_dataset, synthetic_corpus, to_zip
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+DEFAULT_BUDGETS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'budgets.json')
+
+# Embedding pairs compared one by one against the matrix
+EMBED_PARITY_PAIRS = 500
+# Files of the small job run before measuring a case
+WARM_UP_FILES = 5
+# Small enough that the parity slice is split into several blocks and tiles
+PARITY_BLOCK_ROWS = 16
+
+
+def case_files(case):
+    """The files of a case: a bundled dataset name, or 'synthetic-<files>'."""
+    if case.startswith('synthetic-'):
+        return synthetic_corpus(int(case[len('synthetic-'):]))
+    return load_dataset(case)
+
+
+def run_case(case, block_rows=None) -> dict:
+    """Run one case in this process and measure it. Called in a fresh interpreter by measure_case."""
+    from metrics import current_rss
+    from controller.progress import ProgressTracker
+    from controller.algorithms import model_loader
+    from controller.v1_report_generation import report_generation, ZipLimits
+
+    files = case_files(case)
+    data = to_zip(files)
+    limits = ZipLimits(
+        max_members=len(files) + 1,
+        max_total_uncompressed=max(ZipLimits.max_total_uncompressed, 2 * sum(len(content) for _, content in files)),
+    )
+    # Workers load the models and the lazily imported libraries once, keep both out of the job's numbers
+    model_loader.warm_up()
+    report_generation().generate(to_zip(files[:WARM_UP_FILES]), limits=limits)
+    rss_start = current_rss()
+
+    progress = ProgressTracker()
+    start = time.perf_counter()
+    report = report_generation().generate(data, limits=limits, progress=progress, block_rows=block_rows)
+    seconds = time.perf_counter() - start
+
+    n = len(report.matrices)
+    pairs = n * (n - 1) // 2
+    return {
+        'case': case,
+        'files': n,
+        'pairs': pairs,
+        'seconds': seconds,
+        'steps': progress.timings(),
+        'pairs_per_second': pairs / seconds if seconds > 0 else 0.0,
+        'rss_start_mb': rss_start / (1024 * 1024),
+        # ru_maxrss is in kilobytes on Linux
+        'rss_peak_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def measure_case(case, block_rows=None) -> dict:
+    command = [sys.executable, '-m', 'benchmarks.pipeline', '--run-case', case]
+    if block_rows:
+        command += ['--block-rows', str(block_rows)]
+    output = subprocess.run(command, cwd=BACKEND_DIR, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def fit_power_law(sizes, values):
+    """(a, b) of values ~ a * sizes^b, by least squares on the logs. None if there aren't two usable points."""
+    points = [(n, v) for n, v in zip(sizes, values) if n > 0 and v > 0]
+    if len(points) < 2:
+        return None
+    b, log_a = np.polyfit(np.log([n for n, _ in points]), np.log([v for _, v in points]), 1)
+    return float(np.exp(log_a)), float(b)
+
+
+def _max_off_diagonal(a, b) -> float:
+    diff = np.abs(np.asarray(a, dtype=np.float64) - np.asarray(b, dtype=np.float64))
+    np.fill_diagonal(diff, 0.0)
+    return float(diff.max()) if diff.size else 0.0
+
+
+def _matrix_diff(a, b) -> float:
+    return max(_max_off_diagonal(getattr(a, channel), getattr(b, channel)) for channel in ('token_sim', 'ast_sim', 'embed_sim'))
+
+
+def check_parity(files) -> dict[str, float]:
+    """Largest difference between each optimized path and its reference, over every pair of files."""
+    import torch
+    from controller.algorithms.v1_NLP import feed_head_model, EmbeddingSimilarity, EMBEDDING_MODEL
+    from controller.algorithms.v1_tok import MOSS_tok
+    from controller.algorithms.v1_ast import vector_ast
+    from controller.algorithms.file_cache import FileArtifactCache
+    from sharding import plan_tiles, CHANNELS
+
+    nlp = feed_head_model()
+    n = len(files)
+    full = nlp.compute_artifacts(files)
+    matrices = full.matrices
+    results = {}
+
+    report = MOSS_tok().tokenize(dict(files))
+    results['token'] = max(
+        (abs(float(matrices.token_sim[i, j]) - entry['similarity_score'])
+         for (i, j), entry in zip(combinations(range(n), 2), report, strict=True)),
+        default=0.0,
+    )
+
+    reference_ast = vector_ast().score_matrix(dict(files))
+    results['ast'] = _max_off_diagonal(matrices.ast_sim, reference_ast)
+    blocked = nlp.compute_artifacts(files, block_rows=PARITY_BLOCK_ROWS)
+    results['ast_blocked'] = _max_off_diagonal(blocked.matrices.ast_sim, reference_ast)
+
+    rng = random.Random(0)
+    embedding = EmbeddingSimilarity(EMBEDDING_MODEL)
+    vectors = torch.from_numpy(full.embeddings)
+    pairs = list(combinations(range(n), 2))
+    results['embed'] = max(
+        (abs(float(matrices.embed_sim[i, j]) - embedding.compute(vectors[i], vectors[j]))
+         for i, j in rng.sample(pairs, min(EMBED_PARITY_PAIRS, len(pairs)))),
+        default=0.0,
+    )
+
+    prior = nlp.compute_artifacts(files[:n // 2])
+    results['incremental'] = _matrix_diff(nlp.compute_artifacts(files, prior=prior).matrices, matrices)
+
+    tiled = nlp.index_files(files)
+    for row_start, row_stop, col_start, col_stop in plan_tiles(n, PARITY_BLOCK_ROWS):
+        tile = nlp.score_tile(tiled, range(row_start, row_stop), range(col_start, col_stop))
+        for channel in CHANNELS:
+            matrix = getattr(tiled.matrices, channel)
+            matrix[row_start:row_stop, col_start:col_stop] = tile[channel]
+            matrix[col_start:col_stop, row_start:row_stop] = tile[channel].T
+    results['tiles'] = _matrix_diff(tiled.matrices, matrices)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = FileArtifactCache(os.path.join(cache_dir, 'file_cache.sqlite3'), 256 * 1024 * 1024)
+        nlp.compute_artifacts(files, file_cache=cache)
+        results['file_cache'] = _matrix_diff(nlp.compute_artifacts(files, file_cache=cache).matrices, matrices)
+    return results
+
+
+def load_budgets(path) -> dict:
+    if not path or not os.path.exists(path):
+        return {'cases': {}, 'parity': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def case_violations(result, budget) -> list[str]:
+    violations = []
+    if 'seconds' in budget and result['seconds'] > budget['seconds']:
+        violations.append(f"{result['seconds']:.1f}s > {budget['seconds']}s")
+    if 'rss_mb' in budget and result['rss_peak_mb'] > budget['rss_mb']:
+        violations.append(f"{result['rss_peak_mb']:.0f} MB > {budget['rss_mb']} MB")
+    if 'min_pairs_per_second' in budget and result['pairs_per_second'] < budget['min_pairs_per_second']:
+        violations.append(f"{result['pairs_per_second']:.0f} pairs/s < {budget['min_pairs_per_second']}")
+    return violations
+
+
+def print_scaling(results):
+    synthetic = sorted((r for r in results if r['case'].startswith('synthetic-')), key=lambda r: r['files'])
+    if len(synthetic) < 2:
+        return
+    sizes = [r['files'] for r in synthetic]
+    steps = sorted({step for r in synthetic for step in r['steps']})
+    print("\nScaling on synthetic corpora, seconds ~ a * files^b:")
+    for name, values in [('total', [r['seconds'] for r in synthetic])] + [
+        (step, [r['steps'].get(step, 0.0) for r in synthetic]) for step in steps
+    ] + [('memory above start (MB)', [r['rss_peak_mb'] - r['rss_start_mb'] for r in synthetic])]:
+        fit = fit_power_law(sizes, values)
+        if fit is None:
+            continue
+        a, b = fit
+        note = f", {a * 10000 ** b:.1f} at 10000 files" if max(sizes) < 10000 else ''
+        print(f"  {name:<26} b = {b:.2f}{note}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pipeline benchmark: datasets, synthetic scaling, parity and budgets.")
+    parser.add_argument('--datasets', nargs='*', default=None, help='Bundled datasets to run (default: all)')
+    parser.add_argument('--sizes', nargs='*', type=int, default=[1000, 2000], help='Synthetic corpus sizes in files (default: 1000 2000)')
+    parser.add_argument('--block-rows', type=int, default=None, help='Score pairs this many rows at a time, as large jobs do')
+    parser.add_argument('--parity-dataset', default='p02405', help='Dataset the parity checks run on (default: p02405)')
+    parser.add_argument('--parity-files', type=int, default=120, help='Files of the parity dataset used (default: 120)')
+    parser.add_argument('--skip-parity', action='store_true', help='Only measure, skip the parity checks')
+    parser.add_argument('--budgets', default=DEFAULT_BUDGETS, help='JSON file of case budgets and parity tolerances')
+    parser.add_argument('--output', default=None, help='Write every measurement to this JSON file')
+    parser.add_argument('--run-case', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        print(json.dumps(run_case(args.run_case, args.block_rows)))
+        return
+
+    budgets = load_budgets(args.budgets)
+    cases = (dataset_names() if args.datasets is None else args.datasets) + [f"synthetic-{n}" for n in args.sizes]
+    failed = False
+    results = []
+
+    print(f"{'case':<16}{'files':>7}{'pairs':>11}{'seconds':>10}{'pairs/s':>10}{'peak MB':>9}  slowest steps")
+    for case in cases:
+        result = measure_case(case, args.block_rows)
+        results.append(result)
+        slowest = sorted(result['steps'].items(), key=lambda item: -item[1])[:3]
+        # Bundled datasets without their own entry share the 'datasets' budget
+        default = {} if case.startswith('synthetic-') else budgets['cases'].get('datasets', {})
+        violations = case_violations(result, budgets['cases'].get(case, default))
+        failed |= bool(violations)
+        print(f"{case:<16}{result['files']:>7}{result['pairs']:>11}{result['seconds']:>10.2f}"
+              f"{result['pairs_per_second']:>10.0f}{result['rss_peak_mb']:>9.0f}  "
+              + ", ".join(f"{step} {seconds:.2f}" for step, seconds in slowest)
+              + (f"  OVER BUDGET: {'; '.join(violations)}" if violations else ''))
+    print_scaling(results)
+
+    parity = {}
+    if not args.skip_parity:
+        files = sorted(load_dataset(args.parity_dataset))[:args.parity_files]
+        print(f"\nParity on {len(files)} files of {args.parity_dataset}, largest difference from the reference:")
+        # The pipeline prints its progress, which would bury the results
+        with contextlib.redirect_stdout(io.StringIO()):
+            parity = check_parity(files)
+        for check, diff in parity.items():
+            tolerance = budgets['parity'].get(check, 1e-6)
+            failed |= diff > tolerance
+            print(f"  {check:<12} {diff:.3g}" + (f"  ABOVE TOLERANCE {tolerance:g}" if diff > tolerance else ''))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'cases': results, 'parity': parity}, f, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
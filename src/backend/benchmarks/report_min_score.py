@@ -0,0 +1,101 @@
+"""
+Measure what REPORT_MIN_SCORE leaves out of the per-pair results, on the bundled datasets with their
+ground truth.
+
+Run from src/backend:
+    python -m benchmarks.report_min_score [--datasets p02405 p00005] [--scores 0.2 0.3 0.4 0.5] [--output min_score.json]
+
+Each dataset is scored once; the minimum score only filters the report. For each minimum score it reports:
+  omitted:      the share of pairs left out of the per-pair results
+  file recall:  of the files the ground truth marks plagiarized, the share whose best match is still listed
+  result size:  the gzipped size of the serialized result, against the size with every pair listed
+"""
+import os
+import gzip
+import json
+import argparse
+import dataclasses
+import numpy as np
+from benchmarks.corpus import dataset_names, load_dataset, plagiarized_files
+
+DEFAULT_SCORES = (0.2, 0.3, 0.4, 0.5, 0.6)
+
+
+def result_bytes(report) -> int:
+    """Gzipped size of the serialized report, as the worker uploads it."""
+    return len(gzip.compress(''.join(report.iter_json()).encode('utf-8')))
+
+
+def measure_dataset(dataset, scores) -> list[dict]:
+    from controller.algorithms.v1_sim_score import basic_weighting
+
+    files = load_dataset(dataset)
+    report = basic_weighting().score(files)
+    n = len(report.matrices)
+    full_bytes = result_bytes(report)
+
+    # The best match of every file the ground truth marks plagiarized
+    plagiarized = plagiarized_files(dataset)
+    masked = report.similarity_score.copy()
+    np.fill_diagonal(masked, -np.inf)
+    targets = [(i, int(np.argmax(masked[i]))) for i, name in enumerate(report.matrices.files) if os.path.basename(name) in plagiarized]
+
+    results = []
+    for min_score in scores:
+        filtered = dataclasses.replace(report, min_score=min_score)
+        kept = filtered.similarity_score >= min_score
+        results.append({
+            'dataset': dataset,
+            'min_score': min_score,
+            'pairs': n * (n - 1) // 2,
+            'omitted': filtered.omitted_pair_count(),
+            'file_recall': float(np.mean([kept[i, j] for i, j in targets])) if targets else 1.0,
+            'result_bytes': result_bytes(filtered),
+            'full_result_bytes': full_bytes,
+        })
+    return results
+
+
+def summarize(results, scores) -> list[dict]:
+    """Pool the datasets per minimum score, recall averaged over the datasets."""
+    summary = []
+    for min_score in scores:
+        rows = [r for r in results if r['min_score'] == min_score]
+        pairs = sum(r['pairs'] for r in rows)
+        summary.append({
+            'min_score': min_score,
+            'omitted_share': sum(r['omitted'] for r in rows) / max(pairs, 1),
+            'file_recall': float(np.mean([r['file_recall'] for r in rows])),
+            'result_bytes': sum(r['result_bytes'] for r in rows),
+            'full_result_bytes': sum(r['full_result_bytes'] for r in rows),
+        })
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure what REPORT_MIN_SCORE leaves out of the results on the bundled datasets.")
+    parser.add_argument('--datasets', nargs='+', default=None, help='Bundled datasets (default: all)')
+    parser.add_argument('--scores', type=float, nargs='+', default=list(DEFAULT_SCORES), help='Minimum scores')
+    parser.add_argument('--output', default=None, help='Also write the results to this json file')
+    args = parser.parse_args()
+
+    from controller.algorithms import model_loader
+    model_loader.warm_up()
+
+    results = []
+    for dataset in args.datasets or dataset_names():
+        results.extend(measure_dataset(dataset, args.scores))
+        print(f"Measured {dataset}")
+    summary = summarize(results, args.scores)
+
+    print(f"\n{'min score':>9} {'omitted':>8} {'file recall':>11} {'result KB':>10} {'full KB':>8}")
+    for row in summary:
+        print(f"{row['min_score']:>9.2f} {100 * row['omitted_share']:>7.1f}% {row['file_recall']:>11.4f} "
+              f"{row['result_bytes'] / 1024:>10.1f} {row['full_result_bytes'] / 1024:>8.1f}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'datasets': results, 'summary': summary}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Compare the size of the token report in the current format against the compact schema.
+
+Run from src/backend:
+    python -m benchmarks.result_size [--datasets p02260 p02405] [--max-files 60] [--max-matches 20]
+"""
+import os
+import io
+import gzip
+import json
+import time
+import argparse
+from controller.v1_report_generation import extract_python_files_from_zip
+from controller.algorithms.v1_tok import MOSS_tok
+from controller.algorithms.compact_report import encode_token_report, decode_token_report
+
+DATA_FOLDER = os.path.join(os.path.dirname(__file__), '..', 'controller', 'data_folder')
+
+
+def sizes(obj) -> tuple[int, int]:
+    """Return the (raw, gzip) size in bytes of obj serialized as compact JSON."""
+    raw = json.dumps(obj, separators=(',', ':')).encode('utf-8')
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as gz:
+        gz.write(raw)
+    return len(raw), len(buf.getvalue())
+
+
+def check_round_trip(report: list[dict], compact: dict) -> None:
+    decoded = decode_token_report(compact)
+    for original, restored in zip(report, decoded, strict=True):
+        assert original['file1'] == restored['file1'] and original['file2'] == restored['file2']
+        assert original['matches'] == restored['matches']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Result size benchmark for the compact token report schema.")
+    parser.add_argument('--datasets', nargs='*', help='Dataset names in data_folder (default: all)')
+    parser.add_argument('--max-files', type=int, default=60, help='Files taken from each dataset (default: 60)')
+    parser.add_argument('--max-matches', type=int, default=20, help='Match cap for the capped variant (default: 20)')
+    args = parser.parse_args()
+
+    datasets = args.datasets or sorted(name[:-4] for name in os.listdir(DATA_FOLDER) if name.endswith('.zip'))
+    variants = {
+        'current': lambda report: report,
+        'compact': lambda report: encode_token_report(report, delta=False),
+        'compact+delta': lambda report: encode_token_report(report),
+        f'compact+delta, cap {args.max_matches}': lambda report: encode_token_report(report, max_matches=args.max_matches),
+    }
+    totals = {name: [0, 0] for name in variants}
+
+    print(f"{'dataset':<10}{'pairs':>8}  " + "".join(f"{name:>34}" for name in variants))
+    for dataset in datasets:
+        with open(os.path.join(DATA_FOLDER, f"{dataset}.zip"), 'rb') as f:
+            files = extract_python_files_from_zip(f.read())
+        file_dict = dict(sorted(files)[:args.max_files])
+
+        start = time.perf_counter()
+        report = MOSS_tok().tokenize(file_dict)
+        elapsed = time.perf_counter() - start
+        check_round_trip(report, encode_token_report(report))
+
+        row = f"{dataset:<10}{len(report):>8}  "
+        for name, encode in variants.items():
+            raw, compressed = sizes(encode(report))
+            totals[name][0] += raw
+            totals[name][1] += compressed
+            row += f"{raw / 1024:>16.1f} KB{compressed / 1024:>11.1f} KB gz"
+        print(row + f"   ({elapsed:.1f}s)")
+
+    base_raw, base_gz = totals['current']
+    print()
+    for name, (raw, compressed) in totals.items():
+        print(f"{name:<30} {raw / 1024:>10.1f} KB ({raw / base_raw:.1%})  {compressed / 1024:>10.1f} KB gz ({compressed / base_gz:.1%})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+import os
+import io
+import gzip
+import shutil
+import tempfile
+from abc import ABC, abstractmethod
+
+# Compressed results larger than this spill from memory to a temporary file before upload
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+
+
+class BlobStore(ABC):
+    """
+    Key/value store for uploaded archives, job artifacts and offloaded results.
+    Missing keys raise KeyError.
+    """
+
+    @abstractmethod
+    def put(self, key, fileobj, content_type='application/octet-stream', content_encoding=None):
+        pass
+
+    @abstractmethod
+    def get(self, key) -> bytes:
+        pass
+
+    @abstractmethod
+    def size(self, key) -> int:
+        pass
+
+    @abstractmethod
+    def iter_chunks(self, key, chunk_size=DOWNLOAD_CHUNK_BYTES):
+        """Yield the blob's contents a chunk at a time."""
+        pass
+
+    @abstractmethod
+    def get_range(self, key, start, end) -> bytes:
+        """Return bytes start (inclusive) to end (exclusive) of the blob."""
+        pass
+
+    @abstractmethod
+    def delete(self, key) -> None:
+        """Remove a blob; missing keys are ignored."""
+        pass
+
+    @abstractmethod
+    def delete_prefix(self, prefix) -> int:
+        """Remove every blob whose key starts with prefix. Returns how many were removed."""
+        pass
+
+
+class S3BlobStore(BlobStore):
+    """
+    Blob store backed by an S3 bucket.
+    """
+
+    def __init__(self, s3, bucket):
+        self.s3 = s3
+        self.bucket = bucket
+
+    def put(self, key, fileobj, content_type='application/octet-stream', content_encoding=None):
+        extra_args = {'ContentType': content_type}
+        if content_encoding:
+            extra_args['ContentEncoding'] = content_encoding
+        # upload_fileobj switches to a multipart upload for large objects
+        self.s3.upload_fileobj(fileobj, self.bucket, key, ExtraArgs=extra_args)
+
+    def _get_object(self, key):
+        try:
+            return self.s3.get_object(Bucket=self.bucket, Key=key)
+        except self.s3.exceptions.NoSuchKey:
+            raise KeyError(key)
+
+    def get(self, key):
+        return self._get_object(key)['Body'].read()
+
+    def size(self, key):
+        try:
+            return self.s3.head_object(Bucket=self.bucket, Key=key)['ContentLength']
+        except self.s3.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                raise KeyError(key)
+            raise
+
+    def iter_chunks(self, key, chunk_size=DOWNLOAD_CHUNK_BYTES):
+        yield from self._get_object(key)['Body'].iter_chunks(chunk_size=chunk_size)
+
+    def get_range(self, key, start, end):
+        if end <= start:
+            return b''
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=key, Range=f"bytes={start}-{end - 1}")
+        except self.s3.exceptions.NoSuchKey:
+            raise KeyError(key)
+        return response['Body'].read()
+
+    def delete(self, key):
+        self.s3.delete_object(Bucket=self.bucket, Key=key)
+
+    def delete_prefix(self, prefix):
+        deleted = 0
+        for page in self.s3.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=prefix):
+            # A page holds at most 1000 keys, the most delete_objects takes at once
+            keys = [{'Key': item['Key']} for item in page.get('Contents', [])]
+            if keys:
+                self.s3.delete_objects(Bucket=self.bucket, Delete={'Objects': keys, 'Quiet': True})
+                deleted += len(keys)
+        return deleted
+
+
+class LocalBlobStore(BlobStore):
+    """
+    Blob store backed by a local directory, for running the worker without AWS.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(os.path.abspath(self.root) + os.sep):
+            raise ValueError(f"Invalid blob key: {key}")
+        return path
+
+    def put(self, key, fileobj, content_type='application/octet-stream', content_encoding=None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write next to the target and rename so readers never see a partial blob
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            shutil.copyfileobj(fileobj, f)
+        os.replace(tmp_path, path)
+
+    def _open(self, key):
+        try:
+            return open(self._path(key), 'rb')
+        except FileNotFoundError:
+            raise KeyError(key)
+
+    def get(self, key):
+        with self._open(key) as f:
+            return f.read()
+
+    def size(self, key):
+        try:
+            return os.path.getsize(self._path(key))
+        except FileNotFoundError:
+            raise KeyError(key)
+
+    def iter_chunks(self, key, chunk_size=DOWNLOAD_CHUNK_BYTES):
+        with self._open(key) as f:
+            while chunk := f.read(chunk_size):
+                yield chunk
+
+    def get_range(self, key, start, end):
+        with self._open(key) as f:
+            f.seek(start)
+            return f.read(max(0, end - start))
+
+    def delete(self, key):
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def delete_prefix(self, prefix):
+        directory, _ = os.path.split(self._path(prefix + '_'))
+        root = os.path.abspath(self.root)
+        deleted = 0
+        # Bottom up, so directories the prefix emptied can be removed as well
+        for dirpath, _, filenames in os.walk(directory, topdown=False):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                if os.path.relpath(path, root).replace(os.sep, '/').startswith(prefix) and not filename.endswith('.tmp'):
+                    os.unlink(path)
+                    deleted += 1
+            if (os.path.relpath(dirpath, root).replace(os.sep, '/') + '/').startswith(prefix) and not os.listdir(dirpath):
+                os.rmdir(dirpath)
+        return deleted
+
+
+def put_json_chunks(store, key, chunks):
+    """
+    Stream JSON text chunks into the store as a gzip-compressed blob and return its compressed size.
+    The document is never held in memory as a whole.
+    """
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as tmp:
+        with gzip.GzipFile(fileobj=tmp, mode='wb') as gz:
+            text = io.TextIOWrapper(gz, encoding='utf-8')
+            for chunk in chunks:
+                text.write(chunk)
+            text.flush()
+            text.detach()
+        size = tmp.tell()
+        tmp.seek(0)
+        store.put(key, tmp, content_type='application/json', content_encoding='gzip')
+    return size
@@ -0,0 +1,134 @@
+"""
+Run the worker end to end over a directory of zips, without AWS or the Express API.
+
+Every zip becomes a job on a local queue, the archives go into a local blob store, and worker
+processes drain the queue in parallel. Final job updates (with their results) are written to
+<work-dir>/status. Reports end-to-end throughput in jobs per minute.
+
+Run from src/backend:
+    python bulk.py controller/data_folder [--processes 2] [--concurrency 1] [--work-dir DIR]
+
+Worker settings come from the environment, e.g. SHARDING=true SHARD_MIN_PAIRS=100000 splits large
+jobs into tiles scored by all the worker processes, and REPORT_MIN_SCORE=0.3 leaves unrelated pairs out of the results.
+--analysis-profile fast runs every job without CodeBERT, see ANALYSIS_PROFILE.
+"""
+import os
+import sys
+import json
+import gzip
+import time
+import base64
+import argparse
+import tempfile
+import subprocess
+from blob_store import LocalBlobStore
+from job_queue import LocalJobQueue
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def enqueue_archives(zip_dir, store, queue, profile=False, analysis_profile=None) -> list[str]:
+    """Upload every zip in zip_dir to the store and queue a job for it. Returns the job ids."""
+    job_ids = []
+    for name in sorted(os.listdir(zip_dir)):
+        if not name.endswith('.zip'):
+            continue
+        job_id = f"bulk-{name[:-len('.zip')]}"
+        key = f"uploads/bulk/{job_id}.zip"
+        with open(os.path.join(zip_dir, name), 'rb') as f:
+            store.put(key, f, content_type='application/zip')
+        message = {'jobId': job_id, 's3Key': key, 'auth0Id': 'bulk', 'analysisName': name}
+        if profile:
+            message['profile'] = True
+        if analysis_profile:
+            message['analysisProfile'] = analysis_profile
+        queue.send(message)
+        job_ids.append(job_id)
+    return job_ids
+
+
+def result_pairs_and_metrics(payload) -> tuple[int, dict]:
+    """Number of file pairs and the job metrics of a completed job's result, whether inline or offloaded."""
+    if 'resultSummary' in payload:
+        summary = payload['resultSummary']
+        return summary['pairs'], summary.get('metrics', {})
+    if 'resultData' in payload:
+        result = json.loads(gzip.decompress(base64.b64decode(payload['resultData'])))
+        metrics = result.get('metrics', {})
+        # Pairs below REPORT_MIN_SCORE aren't in the per-pair results
+        return len(result['similarity_results']) + metrics.get('pairsOmitted', 0), metrics
+    return 0, {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process a directory of zips with local worker processes.")
+    parser.add_argument('zip_dir', help='Directory of zip archives, e.g. controller/data_folder')
+    parser.add_argument('--processes', type=int, default=2, help='Worker processes (default: 2)')
+    parser.add_argument('--concurrency', type=int, default=1, help='Jobs each worker process runs at once (default: 1)')
+    parser.add_argument('--work-dir', default=None, help='Where the queue, store and results go (default: a new temporary directory)')
+    parser.add_argument('--profile', action='store_true', help='Profile every job, stored under <work-dir>/store/profiles')
+    parser.add_argument('--analysis-profile', choices=('full', 'fast'), default=None,
+                        help='Analysis profile of every job (default: the workers\' ANALYSIS_PROFILE)')
+    args = parser.parse_args()
+
+    work_dir = os.path.abspath(args.work_dir or tempfile.mkdtemp(prefix='bulk-'))
+    store_dir = os.path.join(work_dir, 'store')
+    queue_dir = os.path.join(work_dir, 'queue')
+    status_dir = os.path.join(work_dir, 'status')
+
+    job_ids = enqueue_archives(args.zip_dir, LocalBlobStore(store_dir), LocalJobQueue(queue_dir), args.profile, args.analysis_profile)
+    print(f"Queued {len(job_ids)} jobs in {work_dir}")
+
+    env = dict(
+        os.environ,
+        BLOB_STORE='local', LOCAL_STORE_DIR=store_dir,
+        QUEUE_BACKEND='local', LOCAL_QUEUE_DIR=queue_dir,
+        STATUS_BACKEND='local', LOCAL_STATUS_DIR=status_dir,
+        WORKER_CONCURRENCY=str(args.concurrency),
+        # The worker processes share one machine, so only one could serve the metrics port
+        METRICS_PORT='0',
+    )
+    start = time.perf_counter()
+    workers = [
+        subprocess.Popen([sys.executable, 'worker.py', '--exit-when-idle'], cwd=BACKEND_DIR, env=env)
+        for _ in range(args.processes)
+    ]
+    for worker in workers:
+        worker.wait()
+    elapsed = time.perf_counter() - start
+
+    completed, failed, pairs, omitted = 0, 0, 0, 0
+    stage_seconds, rss_peak = {}, 0
+    for job_id in job_ids:
+        path = os.path.join(status_dir, f"{job_id}.json")
+        if not os.path.exists(path):
+            failed += 1
+            continue
+        with open(path) as f:
+            payload = json.load(f)
+        if payload['status'] == 'completed':
+            completed += 1
+            job_pairs, metrics = result_pairs_and_metrics(payload)
+            pairs += job_pairs
+            omitted += metrics.get('pairsOmitted', 0)
+            for stage, seconds in metrics.get('stages', {}).items():
+                stage_seconds[stage] = stage_seconds.get(stage, 0.0) + seconds
+            rss_peak = max(rss_peak, metrics.get('rssPeakBytes', 0))
+        else:
+            failed += 1
+
+    print(f"{completed} completed, {failed} failed in {elapsed:.1f}s "
+          f"with {args.processes} processes x {args.concurrency} jobs")
+    print(f"{60 * completed / elapsed:.1f} jobs/minute, {pairs / elapsed:.0f} pairs/second")
+    if omitted:
+        print(f"{omitted} of {pairs} pairs left out of the results by REPORT_MIN_SCORE")
+    if stage_seconds:
+        stages = sorted(stage_seconds.items(), key=lambda item: -item[1])
+        print("Job seconds by stage: " + ", ".join(f"{stage} {seconds:.1f}" for stage, seconds in stages))
+        print(f"Peak worker memory: {rss_peak / (1024 * 1024):.0f} MB")
+    print(f"Results: {status_dir}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+# Version of the compact token report schema, bump on any layout change
+COMPACT_VERSION = 1
+
+
+def encode_spans(spans: list[dict], delta: bool) -> list[int]:
+    """
+    Flatten spans into [sl, sc, el, ec, sl, sc, ...].
+    With delta encoding each start line is stored relative to the previous span's start line
+    and each end line relative to its own start line, which keeps the numbers small.
+    """
+    flat = []
+    prev_line = 0
+    for span in spans:
+        sl, sc, el, ec = span['sl'], span['sc'], span['el'], span['ec']
+        if delta:
+            flat.extend((sl - prev_line, sc, el - sl, ec))
+            prev_line = sl
+        else:
+            flat.extend((sl, sc, el, ec))
+    return flat
+
+
+def decode_spans(flat: list[int], delta: bool) -> list[dict]:
+    spans = []
+    prev_line = 0
+    for i in range(0, len(flat), 4):
+        sl, sc, el, ec = flat[i:i + 4]
+        if delta:
+            sl += prev_line
+            el += sl
+            prev_line = sl
+        spans.append({'sl': sl, 'sc': sc, 'el': el, 'ec': ec})
+    return spans
+
+
+def encode_token_report(report: list[dict], max_matches: int = None, delta: bool = True) -> dict:
+    """
+    Encode a Tokenizer.report_similarity result into the compact schema:
+
+        {'v': COMPACT_VERSION, 'delta': bool, 'files': [name, ...],
+         'pairs': [[file1, file2, score, total_matches, lengths, ss, ts], ...]}
+
+    file1/file2 index into 'files'. Match k of a pair covers lengths[k] spans; ss and ts hold the spans of
+    all matches back to back as flat integer arrays (see encode_spans). If max_matches is given only the
+    longest max_matches matches of each pair are kept, total_matches still counts all of them.
+    """
+    files = []
+    file_index = {}
+
+    def intern(name):
+        if name not in file_index:
+            file_index[name] = len(files)
+            files.append(name)
+        return file_index[name]
+
+    pairs = []
+    for entry in report:
+        matches = entry.get('matches', [])
+        kept = matches
+        if max_matches is not None and len(matches) > max_matches:
+            # Keep the longest matches, in their original order
+            longest = sorted(range(len(matches)), key=lambda k: -len(matches[k]['ss']))[:max_matches]
+            kept = [matches[k] for k in sorted(longest)]
+        ss, ts = [], []
+        for match in kept:
+            ss.extend(match['ss'])
+            ts.extend(match['ts'])
+        pairs.append([
+            intern(entry['file1']),
+            intern(entry['file2']),
+            entry['similarity_score'],
+            len(matches),
+            [len(match['ss']) for match in kept],
+            encode_spans(ss, delta),
+            encode_spans(ts, delta),
+        ])
+    return {'v': COMPACT_VERSION, 'delta': delta, 'files': files, 'pairs': pairs}
+
+
+def decode_token_report(compact: dict) -> list[dict]:
+    """
+    Decode the compact schema back into the report_similarity format.
+    Matches dropped by max_matches are not restored; 'total_matches' gives the original count.
+    """
+    if compact.get('v') != COMPACT_VERSION:
+        raise ValueError(f"Unsupported compact report version: {compact.get('v')}")
+    files = compact['files']
+    delta = compact['delta']
+    report = []
+    for file1, file2, score, total_matches, lengths, ss, ts in compact['pairs']:
+        source_spans = decode_spans(ss, delta)
+        target_spans = decode_spans(ts, delta)
+        matches = []
+        start = 0
+        for length in lengths:
+            matches.append({
+                'ss': source_spans[start:start + length],
+                'ts': target_spans[start:start + length],
+            })
+            start += length
+        report.append({
+            'file1': files[file1],
+            'file2': files[file2],
+            'similarity_score': score,
+            'matches': matches,
+            'total_matches': total_matches,
+        })
+    return report
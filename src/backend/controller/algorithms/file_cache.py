@@ -0,0 +1,131 @@
+import io
+import json
+import time
+import zlib
+import sqlite3
+import threading
+import numpy as np
+from controller.algorithms.tokenization import Fingerprint
+from controller.algorithms.compact_report import encode_spans, decode_spans
+
+# Bump when the packed layout of any channel changes
+FILE_CACHE_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    channel TEXT NOT NULL,
+    key TEXT NOT NULL,
+    data BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (channel, key)
+);
+CREATE INDEX IF NOT EXISTS artifacts_last_used ON artifacts (last_used);
+"""
+
+
+class FileArtifactCache:
+    """
+    Per-file channel features shared across jobs, in a single SQLite file.
+
+    Entries are keyed by channel, the file's content hash and the channel's parameters (e.g. k and w for
+    fingerprints, the model for embeddings), so any change to a parameter simply misses. Values are packed,
+    compressed arrays (see pack_array and pack_tokens). Once the cache grows past max_bytes the least
+    recently used entries are dropped. SQLite's locking lets several worker processes share the file.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+
+    @staticmethod
+    def _key(content_hash, params):
+        return f"{content_hash}:{FILE_CACHE_VERSION}:{params}"
+
+    def get_many(self, channel, params, content_hashes) -> dict[str, bytes]:
+        """Return the cached values of the given files, keyed by content hash. Misses are left out."""
+        keys = {self._key(h, params): h for h in set(content_hashes)}
+        found = {}
+        with self._lock:
+            key_list = list(keys)
+            # Stay well below SQLite's limit on bound parameters
+            for start in range(0, len(key_list), 500):
+                chunk = key_list[start:start + 500]
+                rows = self._db.execute(
+                    f"SELECT key, data FROM artifacts WHERE channel = ? AND key IN ({','.join('?' * len(chunk))})",
+                    [channel, *chunk]
+                ).fetchall()
+                found.update((keys[key], data) for key, data in rows)
+            if found:
+                now = time.time()
+                self._db.executemany(
+                    "UPDATE artifacts SET last_used = ? WHERE channel = ? AND key = ?",
+                    [(now, channel, self._key(h, params)) for h in found]
+                )
+                self._db.commit()
+        return found
+
+    def put_many(self, channel, params, values: dict[str, bytes]) -> None:
+        """Store values keyed by content hash, then evict down to max_bytes."""
+        if not values:
+            return
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO artifacts (channel, key, data, size, last_used) VALUES (?, ?, ?, ?, ?)",
+                [(channel, self._key(h, params), data, len(data), now) for h, data in values.items()]
+            )
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM artifacts").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Walk from the least recently used entry until enough has been dropped
+        excess = total - self.max_bytes
+        cutoff = None
+        for last_used, size in self._db.execute("SELECT last_used, size FROM artifacts ORDER BY last_used"):
+            excess -= size
+            if excess <= 0:
+                cutoff = last_used
+                break
+        if cutoff is not None:
+            self._db.execute("DELETE FROM artifacts WHERE last_used <= ?", (cutoff,))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def pack_array(array: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    np.save(buffer, np.ascontiguousarray(array), allow_pickle=False)
+    return zlib.compress(buffer.getvalue(), 1)
+
+
+def unpack_array(data: bytes) -> np.ndarray:
+    return np.load(io.BytesIO(zlib.decompress(data)), allow_pickle=False)
+
+
+def pack_tokens(hashes: list[Fingerprint], fingerprints: dict[int, Fingerprint], comments: set[str]) -> bytes:
+    """Pack a file's k-gram hashes, winnowed fingerprint positions and comments."""
+    packed = {
+        'hashes': [fp.hash_val for fp in hashes],
+        'spans': encode_spans([fp.span for fp in hashes], delta=True),
+        # Positions in winnowing order, score_pair depends on it
+        'fingerprints': list(fingerprints.keys()),
+        'comments': sorted(comments),
+    }
+    return zlib.compress(json.dumps(packed, separators=(',', ':')).encode('utf-8'), 1)
+
+
+def unpack_tokens(data: bytes) -> tuple[list[Fingerprint], dict[int, Fingerprint], set[str]]:
+    packed = json.loads(zlib.decompress(data))
+    spans = decode_spans(packed['spans'], delta=True)
+    hashes = [Fingerprint(hash_val=h, position=i, span=span) for i, (h, span) in enumerate(zip(packed['hashes'], spans))]
+    fingerprints = {position: hashes[position] for position in packed['fingerprints']}
+    return hashes, fingerprints, set(packed['comments'])
@@ -0,0 +1,103 @@
+import gzip
+import hashlib
+import pickle
+from dataclasses import dataclass
+from typing import Optional
+import numpy as np
+from controller.algorithms.tokenization import Fingerprint
+from controller.algorithms.similarity_matrix import SimilarityMatrices
+
+# Bump when the stored per-file features change shape or meaning
+ARTIFACTS_VERSION = 1
+
+
+def content_hash(file_contents: str) -> str:
+    """Hash of a file's contents, used to tell whether a re-uploaded file has changed."""
+    return hashlib.sha256(file_contents.encode('utf-8')).hexdigest()
+
+
+@dataclass
+class JobArtifacts:
+    """
+    Per-file features of a finished job together with its pair scores.
+
+    Row i of every per-file field refers to matrices.files[i]. Keeping these around lets a later job
+    add files and only compute the new x (old + new) pairs.
+
+    Jobs of the fast profile have no embeddings (zero columns) and keep each file's hashed token n-gram
+    counts instead, which their embedding channel is scored from. Only artifacts of the same profile combine.
+    """
+    matrices: SimilarityMatrices
+    content_hashes: list[str]
+    token_hashes: list[list[Fingerprint]]
+    token_fingerprints: list[dict[int, Fingerprint]]
+    comments: list[set[str]]
+    ast_vectors: np.ndarray
+    embeddings: np.ndarray
+    version: int = ARTIFACTS_VERSION
+    profile: str = 'full'
+    ngram_counts: Optional[list[tuple[np.ndarray, np.ndarray]]] = None
+
+    @property
+    def files(self) -> list[str]:
+        return self.matrices.files
+
+    def __len__(self) -> int:
+        return len(self.matrices)
+
+    def select(self, rows: list[int]) -> "JobArtifacts":
+        """Return the artifacts restricted to the given rows, keeping the pair scores between them."""
+        rows = np.asarray(rows, dtype=np.intp)
+        block = np.ix_(rows, rows)
+        m = self.matrices
+        return JobArtifacts(
+            matrices=SimilarityMatrices(
+                files=[m.files[i] for i in rows],
+                token_sim=m.token_sim[block],
+                ast_sim=m.ast_sim[block],
+                embed_sim=m.embed_sim[block],
+            ),
+            content_hashes=[self.content_hashes[i] for i in rows],
+            token_hashes=[self.token_hashes[i] for i in rows],
+            token_fingerprints=[self.token_fingerprints[i] for i in rows],
+            comments=[self.comments[i] for i in rows],
+            ast_vectors=self.ast_vectors[rows],
+            embeddings=self.embeddings[rows],
+            profile=self.profile,
+            ngram_counts=[self.ngram_counts[i] for i in rows] if self.ngram_counts is not None else None,
+        )
+
+    def concat(self, other: "JobArtifacts") -> "JobArtifacts":
+        """
+        Append another set of artifacts. Pair scores within each side are kept,
+        pairs across the two sides are left at zero until they are scored.
+        """
+        if self.profile != other.profile:
+            raise ValueError(f"Cannot combine artifacts of the {self.profile} and {other.profile} profiles")
+        n, k = len(self), len(other)
+        matrices = SimilarityMatrices.empty(self.files + other.files)
+        for channel in ('token_sim', 'ast_sim', 'embed_sim'):
+            combined = getattr(matrices, channel)
+            combined[:n, :n] = getattr(self.matrices, channel)
+            combined[n:, n:] = getattr(other.matrices, channel)
+        return JobArtifacts(
+            matrices=matrices,
+            content_hashes=self.content_hashes + other.content_hashes,
+            token_hashes=self.token_hashes + other.token_hashes,
+            token_fingerprints=self.token_fingerprints + other.token_fingerprints,
+            comments=self.comments + other.comments,
+            ast_vectors=np.concatenate([self.ast_vectors, other.ast_vectors]) if n else other.ast_vectors,
+            embeddings=np.concatenate([self.embeddings, other.embeddings]) if n else other.embeddings,
+            profile=self.profile,
+            ngram_counts=self.ngram_counts + other.ngram_counts if self.ngram_counts is not None else None,
+        )
+
+    def to_bytes(self) -> bytes:
+        return gzip.compress(pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "JobArtifacts":
+        artifacts = pickle.loads(gzip.decompress(data))
+        if not isinstance(artifacts, cls) or artifacts.version != ARTIFACTS_VERSION:
+            raise ValueError("Stored job artifacts are from an incompatible pipeline version")
+        return artifacts
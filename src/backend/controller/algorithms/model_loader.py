@@ -0,0 +1,65 @@
+import os
+import functools
+import threading
+
+# torch, transformers and the model weights take seconds to load, so nothing here is loaded until a job
+# (or warm_up) first asks for it. Everything is loaded once per process and shared between jobs.
+
+EMBEDDING_MODEL = "microsoft/codebert-base"
+HEAD_CHECKPOINT = os.path.join(os.path.dirname(__file__), "../checkpoints/checkpoint_epoch_10.pth")
+
+# Set once warm_up has loaded every model
+models_ready = threading.Event()
+
+_load_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=None)
+def get_device():
+    import torch
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    print(f"Using device: {device}")
+    return device
+
+
+@functools.lru_cache(maxsize=None)
+def _load_embedding_model(model_name):
+    from transformers import RobertaTokenizer, RobertaModel, AutoTokenizer, AutoModel
+    if "roberta" in model_name.lower():
+        tokenizer = RobertaTokenizer.from_pretrained(model_name)
+        model = RobertaModel.from_pretrained(model_name)
+    else:
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModel.from_pretrained(model_name)
+    return tokenizer, model.to(get_device())
+
+
+@functools.lru_cache(maxsize=None)
+def _load_head_model(checkpoint_path):
+    import torch
+    from controller.algorithms.v1_model import PlagiarismDetectionModel
+    model = PlagiarismDetectionModel()
+    checkpoint = torch.load(checkpoint_path)
+    model.load_state_dict(checkpoint['model_state_dict'])
+    model.eval()
+    return model
+
+
+def load_embedding_model(model_name=EMBEDDING_MODEL):
+    """Return the (tokenizer, model) pair for the embedding channel, loading it on first use."""
+    # The lock keeps concurrent jobs from loading the same weights twice
+    with _load_lock:
+        return _load_embedding_model(model_name)
+
+
+def load_head_model(checkpoint_path=HEAD_CHECKPOINT):
+    """Return the plagiarism head model in eval mode, loading the checkpoint on first use."""
+    with _load_lock:
+        return _load_head_model(checkpoint_path)
+
+
+def warm_up():
+    """Load every model the pipeline uses, then set models_ready."""
+    load_embedding_model()
+    load_head_model()
+    models_ready.set()
@@ -0,0 +1,159 @@
+import json
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Optional
+import numpy as np
+
+if TYPE_CHECKING:
+    from controller.algorithms.job_artifacts import JobArtifacts
+
+# Weights used to combine the channel scores into the final similarity score
+SCORE_WEIGHTS = {'token_sim': 0.4, 'ast_sim': 0.1, 'embed_sim': 0.5}
+
+
+@dataclass
+class SimilarityMatrices:
+    """
+    Pairwise channel scores for a batch of files.
+
+    Every channel is a symmetric N x N float32 matrix where row/column i refers to files[i].
+    """
+    files: list[str]
+    token_sim: np.ndarray
+    ast_sim: np.ndarray
+    embed_sim: np.ndarray
+
+    @classmethod
+    def empty(cls, files: list[str]) -> "SimilarityMatrices":
+        n = len(files)
+        return cls(
+            files=list(files),
+            token_sim=np.zeros((n, n), dtype=np.float32),
+            ast_sim=np.zeros((n, n), dtype=np.float32),
+            embed_sim=np.zeros((n, n), dtype=np.float32),
+        )
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def pair_indices(self) -> tuple[np.ndarray, np.ndarray]:
+        """Return the (i, j) index arrays of all unique pairs with i < j, in row-major order."""
+        return np.triu_indices(len(self.files), k=1)
+
+    def weighted(self, weights: dict[str, float] = SCORE_WEIGHTS) -> np.ndarray:
+        """Combine the channel matrices into a single weighted similarity matrix."""
+        score = np.zeros((len(self.files), len(self.files)), dtype=np.float32)
+        for channel, weight in weights.items():
+            score += np.float32(weight) * getattr(self, channel)
+        return score
+
+    def off_diagonal(self, channel: str) -> np.ndarray:
+        """Return an N x (N-1) matrix holding each file's scores against every other file."""
+        matrix = getattr(self, channel)
+        n = len(self.files)
+        mask = ~np.eye(n, dtype=bool)
+        return matrix[mask].reshape(n, n - 1)
+
+
+@dataclass
+class SimilarityReport:
+    """
+    Result of a similarity job. Scores stay in matrix form until the report is serialized.
+    The per-file artifacts are kept alongside so the job can be extended later; they are not serialized.
+
+    With min_score, pairs whose weighted score is below it are left out of the per-pair results, to keep the
+    results of large jobs small. Every pair is still scored and the head model still sees every pair.
+
+    reference_matches holds each file's best matches among earlier jobs' files, when the worker keeps a
+    reference index (see reference_index.py), and embedding_matches their nearest earlier files by embedding,
+    when it keeps an embedding index (see embedding_index.py). Both are only serialized when set.
+
+    profile is the analysis profile the embedding channel was scored with; only 'fast' is serialized, as
+    its embed_sim is a TF-IDF cosine similarity rather than a CodeBERT one, on a scale the head model was not
+    trained on.
+    """
+    matrices: SimilarityMatrices
+    similarity_score: np.ndarray
+    plagiarism_results: list[dict] = field(default_factory=list)
+    artifacts: Optional["JobArtifacts"] = None
+    min_score: Optional[float] = None
+    reference_matches: Optional[dict[str, list[dict]]] = None
+    embedding_matches: Optional[dict[str, list[dict]]] = None
+    profile: str = 'full'
+
+    def iter_similarity_results(self):
+        """Expand the upper triangle of the matrices into the per-pair dicts sent to the API, one at a time."""
+        m = self.matrices
+        files = m.files
+        n = len(files)
+        # Row by row, so only one row of scores at a time is converted to Python floats
+        for i in range(n - 1):
+            token = m.token_sim[i, i + 1:].tolist()
+            ast = m.ast_sim[i, i + 1:].tolist()
+            embed = m.embed_sim[i, i + 1:].tolist()
+            score = self.similarity_score[i, i + 1:].tolist()
+            for j, t, a, e, s in zip(range(i + 1, n), token, ast, embed, score):
+                if self.min_score is not None and s < self.min_score:
+                    continue
+                yield {
+                    "file1": files[i],
+                    "file2": files[j],
+                    "token_sim": t,
+                    "ast_sim": a,
+                    "embed_sim": e,
+                    "raw_scores": [t, a, e],
+                    "similarity_score": s,
+                }
+
+    def similarity_results(self) -> list[dict]:
+        return list(self.iter_similarity_results())
+
+    def pair_count(self) -> int:
+        n = len(self.matrices)
+        return n * (n - 1) // 2
+
+    def omitted_pair_count(self) -> int:
+        """Pairs left out of the per-pair results for scoring below min_score."""
+        if self.min_score is None:
+            return 0
+        rows, cols = self.matrices.pair_indices()
+        return int(np.count_nonzero(self.similarity_score[rows, cols] < self.min_score))
+
+    def summary(self) -> dict:
+        """Small overview of the result, sent to the API alongside an offloaded result."""
+        rows, cols = self.matrices.pair_indices()
+        scores = self.similarity_score[rows, cols]
+        return {
+            "files": len(self.matrices),
+            "pairs": self.pair_count(),
+            "omitted_pairs": self.omitted_pair_count(),
+            "profile": self.profile,
+            "max_similarity": float(scores.max()) if len(scores) else 0.0,
+            "mean_similarity": float(scores.mean()) if len(scores) else 0.0,
+        }
+
+    def iter_json(self):
+        """Yield the serialized report in chunks, without holding every per-pair dict at once."""
+        yield '{"similarity_results":['
+        for i, result in enumerate(self.iter_similarity_results()):
+            yield (',' if i else '') + json.dumps(result)
+        yield '],"plagiarism_results":' + json.dumps(self.plagiarism_results)
+        if self.reference_matches is not None:
+            yield ',"reference_matches":' + json.dumps(self.reference_matches)
+        if self.embedding_matches is not None:
+            yield ',"embedding_matches":' + json.dumps(self.embedding_matches)
+        if self.profile != 'full':
+            yield ',"profile":' + json.dumps(self.profile)
+        yield '}'
+
+    def to_dict(self) -> dict:
+        result = {
+            "similarity_results": self.similarity_results(),
+            "plagiarism_results": self.plagiarism_results,
+        }
+        if self.reference_matches is not None:
+            result["reference_matches"] = self.reference_matches
+        if self.embedding_matches is not None:
+            result["embedding_matches"] = self.embedding_matches
+        if self.profile != 'full':
+            result["profile"] = self.profile
+        return result
@@ -1,7 +1,6 @@
 import argparse
 import ast
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 from itertools import combinations
 
 
@@ -34,6 +33,8 @@ class ASTSimilarity:
 
     def _compute_similarity(self, matrix1, matrix2):
         """Compute cosine similarity between two matrices."""
+        from sklearn.metrics.pairwise import cosine_similarity
+
         vec1 = matrix1.flatten().reshape(1, -1)
         vec2 = matrix2.flatten().reshape(1, -1)
         similarity = cosine_similarity(vec1, vec2)[0][0]
@@ -61,6 +62,15 @@ class ASTSimilarity:
                 report.append((file1, file2, similarity_score))
         return report
 
+    def similarity_matrix(self, file_paths: list[str], embeddings: dict[str, np.ndarray]) -> np.ndarray:
+        """Compute the cosine similarity of every file pair at once as an N x N matrix."""
+        from sklearn.metrics.pairwise import cosine_similarity
+
+        if not file_paths:
+            return np.zeros((0, 0), dtype=np.float32)
+        vectors = np.vstack([embeddings[file_path] for file_path in file_paths])
+        return cosine_similarity(vectors).astype(np.float32)
+
 
 def parse_ast_all_files(file_dict: dict[str, str], m=0.0) -> list[tuple[str, str, float]]:
     similarity = ASTSimilarity()
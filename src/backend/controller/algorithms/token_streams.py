@@ -0,0 +1,45 @@
+import json
+from controller.algorithms.tokenization import Fingerprint
+from controller.algorithms.compact_report import encode_spans, decode_spans
+
+# Version of the persisted token stream schema, bump on any layout change
+TOKEN_STREAMS_VERSION = 1
+
+
+def iter_token_streams_json(artifacts, k: int, w: int):
+    """
+    Yield the per-file k-gram hashes and winnowed fingerprints of a job as JSON chunks:
+
+        {'v': TOKEN_STREAMS_VERSION, 'k': k, 'w': w,
+         'streams': [{'file': name, 'hashes': [...], 'spans': [...], 'fingerprints': [...]}, ...]}
+
+    spans holds the source span of every k-gram as a delta-encoded flat array (see compact_report.py) and
+    fingerprints lists the k-gram positions picked by winnowing, in winnowing order. This is all that is
+    needed to rebuild the match spans of any pair on demand, so the batch job only has to compute scores.
+    """
+    yield json.dumps({'v': TOKEN_STREAMS_VERSION, 'k': k, 'w': w})[:-1] + ',"streams":['
+    for i, (name, hashes, fingerprints) in enumerate(zip(artifacts.files, artifacts.token_hashes, artifacts.token_fingerprints)):
+        stream = {
+            'file': name,
+            'hashes': [fp.hash_val for fp in hashes],
+            'spans': encode_spans([fp.span for fp in hashes], delta=True),
+            'fingerprints': list(fingerprints.keys()),
+        }
+        yield (',' if i else '') + json.dumps(stream, separators=(',', ':'))
+    yield ']}'
+
+
+def decode_token_streams(doc: dict) -> dict[str, tuple[list[Fingerprint], dict[int, Fingerprint]]]:
+    """
+    Rebuild the index_files fingerprint structure from a token stream document,
+    ready for Tokenizer.score_pair and Tokenizer.match_spans.
+    """
+    if doc.get('v') != TOKEN_STREAMS_VERSION:
+        raise ValueError(f"Unsupported token stream version: {doc.get('v')}")
+    file_fingerprints_and_hashes = {}
+    for stream in doc['streams']:
+        spans = decode_spans(stream['spans'], delta=True)
+        hashes = [Fingerprint(hash_val=h, position=i, span=span) for i, (h, span) in enumerate(zip(stream['hashes'], spans))]
+        fingerprints = {position: hashes[position] for position in stream['fingerprints']}
+        file_fingerprints_and_hashes[stream['file']] = hashes, fingerprints
+    return file_fingerprints_and_hashes
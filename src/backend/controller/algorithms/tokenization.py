@@ -9,6 +9,8 @@ from dataclasses import dataclass
 import os
 import io
 from typing import Union
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 
 @dataclass
 class Fingerprint:
@@ -163,6 +165,61 @@ class Tokenizer:
         return kgram_hashes, fingerprints
 
 
+    def token_values(self, tokens: list[Token]) -> np.ndarray:
+        """
+        The hash of every token, the values the k-gram hashes are computed from.
+        """
+        return np.fromiter((self._hash_token(token) for token in tokens), dtype=np.int64, count=len(tokens))
+
+
+    def kgram_hash_arrays(self, values: np.ndarray, ks) -> dict[int, np.ndarray]:
+        """
+        The k-gram hashes of _compute_rolling_hashes for several k at once, from one file's token values.
+
+        A (k+1)-gram hash is the k-gram hash shifted by one token, so each k extends the hashes of k-1
+        instead of hashing the tokens again. Values stay below MOD * BASE < 2**47, so int64 never overflows.
+        """
+        BASE = 4194301
+        MOD = 33554393
+
+        n = len(values)
+        hashes = {k: np.zeros(0, dtype=np.int64) for k in ks}
+        h = np.zeros(n, dtype=np.int64)
+        for k in range(1, min(max(ks, default=0), n) + 1):
+            h = (h[:n - k + 1] * BASE + values[k - 1:]) % MOD
+            if k in hashes:
+                hashes[k] = h
+        return hashes
+
+
+    def winnow_hashes(self, kgram_hashes: np.ndarray, w: int) -> tuple[int, np.ndarray]:
+        """
+        Winnowing over an array of k-gram hashes, selecting the same fingerprints as _winnowing.
+
+        Returns the number of fingerprints and their distinct hash values, which is all score_pair needs.
+        """
+        n = len(kgram_hashes)
+        if n == 0:
+            return 0, kgram_hashes
+        if n < w:
+            positions = np.array([np.argmin(kgram_hashes)])
+        else:
+            # argmin picks the leftmost of equal hashes, as min() does over a window
+            windows = sliding_window_view(kgram_hashes, w)
+            positions = np.unique(np.arange(len(windows)) + windows.argmin(axis=1))
+        return len(positions), np.unique(kgram_hashes[positions])
+
+
+    def ngram_counts(self, values: np.ndarray, ns, buckets: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        How often each hashed n-gram of the token values occurs, for every n in ns, with the n-gram hashes of
+        kgram_hash_arrays folded into the given number of buckets. Returns the used buckets and their counts.
+        """
+        hashes = self.kgram_hash_arrays(values, ns)
+        folded = np.concatenate([hashes[n] for n in ns]) % buckets if len(ns) else np.zeros(0, dtype=np.int64)
+        return np.unique(folded, return_counts=True)
+
+
     def index_files(self, file_dict: dict[str, str], k: int, w: int) -> tuple[dict[str, tuple[list[Fingerprint], dict[int, Fingerprint]]], dict[str, set[str]]]:
         """
         Processes each file: tokenizes, fingerprints, and then builds an index of fingerprints.
@@ -213,6 +270,56 @@ class Tokenizer:
         return lcs1[::-1], lcs2[::-1]
 
 
+    def score_pair(self, file1, file2,
+                   file_fingerprints_and_hashes: dict[str, tuple[list[Fingerprint], dict[int, Fingerprint]]],
+                   file_comments: dict[str, set[str]]) -> tuple[float, dict[int, tuple[Fingerprint, Fingerprint]]]:
+        """
+        Compares the fingerprint sets of a single file pair.
+
+        Returns the similarity score and the common fingerprints keyed by hash value.
+        """
+        fingerprints1 = file_fingerprints_and_hashes[file1][1]
+        fingerprints2 = file_fingerprints_and_hashes[file2][1]
+
+        # Find common fingerprints, keeping the last fingerprint seen for each hash value
+        by_hash2 = {fp2.hash_val: fp2 for fp2 in fingerprints2.values()}
+        common_fingerprints = {}
+        for fp1 in fingerprints1.values():
+            if fp1.hash_val in by_hash2:
+                common_fingerprints[fp1.hash_val] = (fp1, by_hash2[fp1.hash_val])
+
+        # Calculate similarity
+        min_fingerprints = min(len(fingerprints1), len(fingerprints2))
+        common_comments = file_comments[file1] & file_comments[file2]
+        denominator = min_fingerprints + len(common_comments)
+
+        if denominator > 0:
+            similarity_score = (len(common_fingerprints) + len(common_comments)) / denominator
+        else:
+            similarity_score = 0
+        return similarity_score, common_fingerprints
+
+
+    def match_spans(self, w: int, file1, file2,
+                    file_fingerprints_and_hashes: dict[str, tuple[list[Fingerprint], dict[int, Fingerprint]]],
+                    common_fingerprints: dict[int, tuple[Fingerprint, Fingerprint]]) -> list[dict]:
+        """
+        Reconstructs the matching source spans around each common fingerprint of a file pair.
+        """
+        hashes1 = file_fingerprints_and_hashes[file1][0]
+        hashes2 = file_fingerprints_and_hashes[file2][0]
+        matches = []
+        for (_, (fp1, fp2)) in common_fingerprints.items():
+            surrounding_hashes1 = [hashes1[i] for i in range(max(0, fp1.position-w), min(len(hashes1), fp1.position+w+1))]
+            surrounding_hashes2 = [hashes2[i] for i in range(max(0, fp2.position-w), min(len(hashes2), fp2.position+w+1))]
+            lcs1, lcs2 = self.hash_lcs(surrounding_hashes1, surrounding_hashes2)
+            matches.append({
+                'ss': [hsh1.span for hsh1 in lcs1],
+                'ts': [hsh2.span for hsh2 in lcs2],
+            })
+        return matches
+
+
     def report_similarity(self, w: int,
                            file_fingerprints_and_hashes: dict[str, tuple[list[Fingerprint], dict[int, Fingerprint]]],
                            file_comments: dict[str, set[str]],
@@ -223,37 +330,12 @@ class Tokenizer:
         """
         report = []
         files = list(file_fingerprints_and_hashes.keys())
-        file_hashes = {k: v[0] for k, v in file_fingerprints_and_hashes.items()}
-        file_fingerprints = {k: v[1] for k, v in file_fingerprints_and_hashes.items()}
         for file1, file2 in combinations(files, 2):
-            # Find common fingerprints
-            common_fingerprints = {}
-            for _, fp1 in file_fingerprints[file1].items():
-                for _, fp2 in file_fingerprints[file2].items():
-                    if fp1.hash_val == fp2.hash_val:
-                        common_fingerprints[fp1.hash_val] = (fp1, fp2)
-
-            # Calculate similarity
-            min_fingerprints = min(len(file_fingerprints[file1]), len(file_fingerprints[file2]))
-            common_comments = file_comments[file1] & file_comments[file2]
-            denominator = min_fingerprints + len(common_comments)
-            
-            if denominator > 0:
-                similarity_score = (len(common_fingerprints) + len(common_comments)) / denominator
-            else:
-                similarity_score = 0
+            similarity_score, common_fingerprints = self.score_pair(file1, file2, file_fingerprints_and_hashes, file_comments)
 
             if similarity_score >= min_common_percent:
                 # Prepare matches
-                matches = []
-                for (_, (fp1, fp2)) in common_fingerprints.items():
-                    surrounding_hashes1 = [file_hashes[file1][i] for i in range(max(0, fp1.position-w), min(len(file_hashes[file1]), fp1.position+w+1))]
-                    surrounding_hashes2 = [file_hashes[file2][i] for i in range(max(0, fp2.position-w), min(len(file_hashes[file2]), fp2.position+w+1))]
-                    lcs1, lcs2 = self.hash_lcs(surrounding_hashes1, surrounding_hashes2)
-                    matches.append({
-                        'ss': [hsh1.span for hsh1 in lcs1],
-                        'ts': [hsh2.span for hsh2 in lcs2],
-                    })
+                matches = self.match_spans(w, file1, file2, file_fingerprints_and_hashes, common_fingerprints)
 
                 # Create report entry
                 report.append({
@@ -266,6 +348,80 @@ class Tokenizer:
         return report
 
 
+class TokenScores:
+    """
+    score_pair's similarity for many pairs at once: distinct shared fingerprint hashes plus shared comments,
+    over the smaller fingerprint count plus shared comments. Both shared counts are sparse products of a
+    file x hash and a file x comment incidence matrix, built once per job, instead of a Python loop per pair.
+    This is how jobs score the token channel; score_pair remains the reference it is tested against.
+    """
+
+    def __init__(self, token_fingerprints: list[dict[int, Fingerprint]], comments: list[set[str]]):
+        self.fingerprints = self._incidence([{fp.hash_val for fp in fingerprints.values()} for fingerprints in token_fingerprints])
+        self.comments = self._incidence(comments)
+        self.counts = np.array([len(fingerprints) for fingerprints in token_fingerprints], dtype=np.int64)
+
+    @staticmethod
+    def _incidence(sets) -> tuple:
+        """A file x element incidence matrix, and its transpose converted once rather than on every product."""
+        from scipy import sparse
+
+        vocabulary = {}
+        indptr, indices = [0], []
+        for items in sets:
+            indices.extend(vocabulary.setdefault(item, len(vocabulary)) for item in items)
+            indptr.append(len(indices))
+        incidence = sparse.csr_matrix(
+            (np.ones(len(indices), dtype=np.float64), indices, indptr), shape=(len(sets), max(len(vocabulary), 1))
+        )
+        return incidence, incidence.T.tocsr()
+
+    def rows(self, rows, cols=None) -> np.ndarray:
+        """
+        Scores of the given files against the given columns (default: every file), as a float32 matrix. Pairs of
+        a file with itself are scored like any other pair; callers zero them.
+        """
+        cols = slice(None) if cols is None else cols
+        common = [
+            (incidence[rows] @ incidence_t[:, cols]).toarray() for incidence, incidence_t in (self.fingerprints, self.comments)
+        ]
+        shared, shared_comments = common
+        denominator = np.minimum.outer(self.counts[rows], self.counts[cols]) + shared_comments
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(denominator > 0, (shared + shared_comments) / denominator, 0.0).astype(np.float32)
+
+
+class HashedTfidf:
+    """
+    TF-IDF vectors of files from their hashed n-gram counts (Tokenizer.ngram_counts), with sublinear term
+    frequencies and smoothed document frequencies over the given files. Rows are L2 normalized, so the
+    cosine similarity of any rows against all files is one sparse product.
+    """
+
+    def __init__(self, ngram_counts: list[tuple[np.ndarray, np.ndarray]], buckets: int):
+        from scipy import sparse
+
+        indptr = np.cumsum([0] + [len(used) for used, _ in ngram_counts])
+        indices = np.concatenate([used for used, _ in ngram_counts]) if ngram_counts else np.zeros(0, dtype=np.int64)
+        counts = np.concatenate([c for _, c in ngram_counts]) if ngram_counts else np.zeros(0, dtype=np.int64)
+        n = len(ngram_counts)
+        tf = sparse.csr_matrix((1 + np.log(counts.astype(np.float32)), indices, indptr), shape=(n, buckets))
+        df = np.bincount(indices, minlength=buckets)
+        idf = (np.log((1 + n) / (1 + df)) + 1).astype(np.float32)
+        vectors = tf @ sparse.diags(idf)
+        norms = np.sqrt(np.asarray(vectors.multiply(vectors).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        self.vectors = sparse.diags((1 / norms).astype(np.float32)) @ vectors
+        # Transposed once, as in TokenScores
+        self.vectors_t = self.vectors.T.tocsr()
+
+    def similarity(self, rows=None, cols=None) -> np.ndarray:
+        """Cosine similarity of the given rows against the given columns (default: all files), as float32."""
+        left = self.vectors if rows is None else self.vectors[rows]
+        right = self.vectors_t if cols is None else self.vectors_t[:, cols]
+        return np.clip((left @ right).toarray(), 0.0, 1.0).astype(np.float32)
+
+
 def tokenize_all_files(file_dict: dict[str, str], k=5, w=4, m=0.0) -> list[dict]:
     tokenizer = Tokenizer()
     file_fingerprints, file_comments = tokenizer.index_files(file_dict, k=k, w=w)
@@ -279,6 +435,8 @@ def main():
     parser.add_argument('--k', type=int, default=5, help='k-gram size for fingerprinting (default: 5)')
     parser.add_argument('--w', type=int, default=4, help='Window size for winnowing (default: 4)')
     parser.add_argument('--m', type=float, default=0.5, help='Minimum percentage of common fingerprints to report similarity (default: 0.5)')
+    parser.add_argument('--compact', action='store_true', help='Write the scores in the compact schema (see compact_report.py)')
+    parser.add_argument('--max-matches', type=int, default=None, help='With --compact, keep only the longest matches of each pair')
     
     args = parser.parse_args()
     file_dict = {}
@@ -286,6 +444,9 @@ def main():
         with open(filename, "r") as f:
             file_dict[filename] = f.read()
     similarity_scores = tokenize_all_files(file_dict, k=args.k, w=args.w, m=args.m)
+    if args.compact:
+        from controller.algorithms.compact_report import encode_token_report
+        similarity_scores = encode_token_report(similarity_scores, max_matches=args.max_matches)
 
     with open("similarity_scores.json", "w") as f:
         print(json.dumps(similarity_scores, separators=(',', ':')), file=f)
@@ -2,71 +2,57 @@
 import controller.algorithms.abstract_NLP
 from controller.algorithms.v1_ast import * 
 from controller.algorithms.v1_tok import * 
-from controller.algorithms.v1_model import *
+from controller.algorithms.similarity_matrix import *
+from controller.algorithms.job_artifacts import *
+from controller.algorithms.model_loader import EMBEDDING_MODEL, get_device, load_embedding_model, load_head_model
+from controller.algorithms.file_cache import FileArtifactCache, pack_array, unpack_array, pack_tokens, unpack_tokens
+from controller.progress import ProgressTracker
+from typing import TYPE_CHECKING
 import hashlib
-import torch 
+import math
 
-from transformers import RobertaTokenizer, RobertaModel, AutoTokenizer, AutoModel
+# torch and transformers are imported where they are used, see model_loader.py
+if TYPE_CHECKING:
+    import torch
+
+# 'full' scores the embedding channel with CodeBERT, 'fast' with hashed TF-IDF over token n-grams (no model pass).
+# The head model was trained on CodeBERT's embed_sim and is not calibrated for the TF-IDF cosine, which sits on
+# another scale (a mean of 0.33 against 0.91 on p02405), so fast plagiarism scores are for triage and not comparable
+# with full ones; benchmarks/fast_profile.py compares the two.
+ANALYSIS_PROFILES = ('full', 'fast')
 
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-print(f"Using device: {device}")
 
 class feed_head_model(abstract_NLP):
 
-    def combinedPredict(self, data, results) -> list[dict[str, float]]:
-        python_files = data
+    def build_batch(self, results: SimilarityMatrices) -> "dict[str, torch.Tensor]":
+        """
+        Build the head model input features from the channel matrices.
+        Row i holds file i's scores against every other file, in file index order.
+        """
+        import torch
+        n = len(results)
+        embed_rows = results.off_diagonal('embed_sim')
+        snippet_mean_sim = embed_rows.sum(axis=1) / (n - 1)
+        batch_mean_sim = np.full(n, embed_rows.mean(), dtype=np.float32)
 
-        # Prepare data for model prediction
-        data = {}
-        batch_mean = 0
-        size = 0
-
-        for file in python_files:
-            data[file[0]] = {'token_sim':[], 'ast_sim':[], 'embed_sim':[], 'snippet_mean_sim': 0}
-
-        # Calculate similarities and means
-        for pair in results:
-            file1 = pair['file1']
-            file2 = pair['file2']
-            
-            data[file1]['token_sim'].append(pair['token_sim'])
-            data[file1]['ast_sim'].append(pair['ast_sim'])
-            data[file1]['embed_sim'].append(pair['embed_sim'])
-            
-            data[file2]['token_sim'].append(pair['token_sim'])
-            data[file2]['ast_sim'].append(pair['ast_sim'])
-            data[file2]['embed_sim'].append(pair['embed_sim'])
-            
-            data[file1]['snippet_mean_sim'] += pair['embed_sim']
-            data[file2]['snippet_mean_sim'] += pair['embed_sim']
-            batch_mean += 2 * pair['embed_sim']
-            size += 2
-
-        # Calculate final means
-        for file in python_files:
-            name = file[0]
-            data[name]['snippet_mean_sim'] = data[name]['snippet_mean_sim'] / (len(python_files) - 1)
-            data[name]['batch_mean_sim'] = batch_mean / size
+        return {
+            'token_sim': torch.from_numpy(results.off_diagonal('token_sim')),
+            'ast_sim': torch.from_numpy(results.off_diagonal('ast_sim')),
+            'embed_sim': torch.from_numpy(embed_rows),
+            'batch_mean_sim': torch.from_numpy(batch_mean_sim),
+            'snippet_mean_sim': torch.from_numpy(snippet_mean_sim)
+        }
+
+    def combinedPredict(self, data, results: SimilarityMatrices) -> list[dict[str, float]]:
+        import torch
 
         # Prepare batch for model
-        batch = {
-            'token_sim': torch.tensor([v['token_sim'] for _, v in data.items()]),
-            'ast_sim': torch.tensor([v['ast_sim'] for _, v in data.items()]),
-            'embed_sim': torch.tensor([v['embed_sim'] for _, v in data.items()]),
-            'batch_mean_sim': torch.tensor([v['batch_mean_sim'] for _, v in data.items()]),
-            'snippet_mean_sim': torch.tensor([v['snippet_mean_sim'] for _, v in data.items()])
-        }
+        batch = self.build_batch(results)
 
-        # Load and run model
-        model = PlagiarismDetectionModel()
-        
-        # Load checkpoint
-        cpk_path = os.path.join(os.path.dirname(__file__), "../checkpoints/checkpoint_epoch_10.pth")
-        checkpoint = torch.load(cpk_path)
-        model.load_state_dict(checkpoint['model_state_dict'])
+        # Model with the checkpoint loaded, shared between jobs
+        model = load_head_model()
         
         # Get predictions
-        model.eval()
         with torch.no_grad():
             predicted_plagiarism = model(
                 batch['token_sim'],
@@ -77,75 +63,280 @@ class feed_head_model(abstract_NLP):
             )
 
         # Update results with model predictions
-        final_results = []
-        for i, file in enumerate(python_files):
-            file_name = file[0]
-            final_results.append({
-                "file": file_name,
-                "plagiarism_score": predicted_plagiarism[i].item()
-        })
-
-        return final_results
+        scores = predicted_plagiarism.view(-1).tolist()
+        return [
+            {"file": file_name, "plagiarism_score": score}
+            for file_name, score in zip(results.files, scores)
+        ]
     
-    def compute_similarities_from_zip(self, data):
+    def index_files(self, python_files, progress: ProgressTracker = None,
+                    file_cache: FileArtifactCache = None, profile: str = 'full') -> JobArtifacts:
+        """
+        Compute the per-file features of every channel: token fingerprints, AST vectors and embeddings.
+        Pair scores are left at zero, see score_pairs.
+        With a file cache, each channel only computes the files it hasn't seen with the same parameters.
+        The fast profile counts hashed token n-grams instead of embedding the files.
+        """
+        progress = progress or ProgressTracker()
+        file_names = [file[0] for file in python_files]
+        contents = [file[1] for file in python_files]
+        hashes = [content_hash(content) for content in contents]
+
+        def cached(channel, params):
+            return file_cache.get_many(channel, params, hashes) if file_cache is not None else {}
+
+        def store(channel, params, values):
+            if file_cache is not None:
+                file_cache.put_many(channel, params, values)
+
+        with progress.timed('ast'):
+            ast_similarity = ASTSimilarity()
+            # AST vectors depend on the node types of the running Python version
+            ast_params = hashlib.sha256(','.join(ast_similarity.nodetypedict).encode('utf-8')).hexdigest()[:16]
+            ast_cached = cached('ast', ast_params)
+            ast_new = {}
+            # Filled in place, the vectors are large enough that stacking copies would dominate the job's memory
+            ast_vectors = np.zeros((len(file_names), len(ast_similarity.nodetypedict) ** 2), dtype=np.float32)
+            for i, (name, content, h) in enumerate(zip(file_names, contents, hashes)):
+                if h in ast_cached:
+                    vector = unpack_array(ast_cached[h])
+                else:
+                    vector = ast_similarity.index_files({name: content})[name].astype(np.float32)
+                    if file_cache is not None:
+                        ast_new[h] = pack_array(vector)
+                ast_vectors[i] = vector.reshape(-1)
+                progress.advance('ast')
+            store('ast', ast_params, ast_new)
+            print('Finished ast indexing')
+
+        with progress.timed('tokenize'):
+            tokenizer = Tokenizer()
+            token_params = f"k={TOKEN_K},w={TOKEN_W}"
+            token_cached = cached('token', token_params)
+            token_index, token_new = [], {}
+            for name, content, h in zip(file_names, contents, hashes):
+                if h in token_cached:
+                    token_index.append(unpack_tokens(token_cached[h]))
+                else:
+                    fingerprints, comments = tokenizer.index_files({name: content}, k=TOKEN_K, w=TOKEN_W)
+                    token_index.append((*fingerprints[name], comments[name]))
+                    if file_cache is not None:
+                        token_new[h] = pack_tokens(*token_index[-1])
+                progress.advance('token')
+            store('token', token_params, token_new)
+            print('Finished tokenization')
+
+        ngram_counts = None
+        if profile == 'fast':
+            with progress.timed('embed'):
+                ngram_params = f"n={','.join(map(str, TFIDF_NGRAMS))},buckets={TFIDF_BUCKETS}"
+                ngram_cached = cached('ngrams', ngram_params)
+                ngram_counts, ngram_new = [], {}
+                for content, h in zip(contents, hashes):
+                    if h in ngram_cached:
+                        used, counts = unpack_array(ngram_cached[h])
+                    else:
+                        tokens, _ = tokenizer._tokenize_file(content)
+                        used, counts = tokenizer.ngram_counts(tokenizer.token_values(tokens), TFIDF_NGRAMS, TFIDF_BUCKETS)
+                        if file_cache is not None:
+                            ngram_new[h] = pack_array(np.stack([used, counts]))
+                    ngram_counts.append((used, counts))
+                    progress.advance('embed')
+                store('ngrams', ngram_params, ngram_new)
+                print("Finished TF-IDF")
+            embedding_vectors = np.zeros((len(hashes), 0), dtype=np.float32)
+        else:
+            with progress.timed('embed'):
+                embed_cached = cached('embed', EMBEDDING_MODEL)
+                embeddings = {h: unpack_array(data) for h, data in embed_cached.items()}
+                missing = list(dict.fromkeys(h for h in hashes if h not in embeddings))
+                progress.advance('embed', len(hashes) - len(missing))
+                if missing:
+                    by_hash = dict(zip(hashes, contents))
+                    computed = EmbeddingSimilarity(EMBEDDING_MODEL).get_embeddings_batch([by_hash[h] for h in missing], progress).cpu().numpy()
+                    embeddings.update(zip(missing, computed.astype(np.float32)))
+                    if file_cache is not None:
+                        store('embed', EMBEDDING_MODEL, {h: pack_array(embeddings[h]) for h in missing})
+                print("Finished NLP")
+            embedding_vectors = np.vstack([embeddings[h] for h in hashes]).astype(np.float32) if hashes else np.zeros((0, 0), dtype=np.float32)
+
+        return JobArtifacts(
+            matrices=SimilarityMatrices.empty(file_names),
+            content_hashes=hashes,
+            token_hashes=[kgram_hashes for kgram_hashes, _, _ in token_index],
+            token_fingerprints=[fingerprints for _, fingerprints, _ in token_index],
+            comments=[comments for _, _, comments in token_index],
+            ast_vectors=ast_vectors if hashes else np.zeros((0, 0), dtype=np.float32),
+            embeddings=embedding_vectors,
+            profile=profile,
+            ngram_counts=ngram_counts,
+        )
+
+    def score_pairs(self, artifacts: JobArtifacts, rows, progress: ProgressTracker = None,
+                    block_rows: int = None) -> SimilarityMatrices:
         """
-        Given a zip file (as bytes), extract Python files and compute pairwise similarity scores.
-        Returns a list of dictionaries containing similarity results for each file pair.
+        Score every pair that involves at least one of the given rows and write it into the artifacts' matrices.
+        All other entries are left untouched, so scoring k new rows costs O(k*N) pairs.
+
+        With block_rows, the AST and embedding channels are scored block_rows rows at a time against AST
+        vectors normalized once in float32, which keeps the temporary memory at block_rows x N instead of
+        several float64 copies of every AST vector.
+
+        The token channel is scored with TokenScores, in sparse products rather than score_pair per pair, also
+        block_rows rows at a time if given.
+
+        Artifacts of the fast profile get the TF-IDF cosine similarity as their embedding channel.
         """
+        import torch
+        from sklearn.metrics.pairwise import cosine_similarity
+
+        progress = progress or ProgressTracker()
+        matrices = artifacts.matrices
+        rows = np.asarray(list(rows), dtype=np.intp)
+        n = len(matrices)
+        if len(rows) == 0 or n < 2:
+            return matrices
+
+        with progress.timed('similarity'):
+            tfidf = HashedTfidf(artifacts.ngram_counts, TFIDF_BUCKETS) if artifacts.profile == 'fast' else None
+            if block_rows is None or block_rows >= len(rows):
+                blocks = [(rows, cosine_similarity(artifacts.ast_vectors[rows], artifacts.ast_vectors).astype(np.float32))]
+            else:
+                # Divide each block's dot products by the norms rather than normalizing a copy of every vector
+                vectors = artifacts.ast_vectors
+                norms = row_norms(vectors)
+                blocks = (
+                    (block, (vectors[block] @ vectors.T) / np.outer(norms[block], norms))
+                    for block in (rows[start:start + block_rows] for start in range(0, len(rows), block_rows))
+                )
+            for block, ast_block in blocks:
+                matrices.ast_sim[block, :] = ast_block
+                matrices.ast_sim[:, block] = ast_block.T
+                if tfidf is not None:
+                    embed_block = tfidf.similarity(block)
+                else:
+                    embed_block = EmbeddingSimilarity.compute_matrix(
+                        torch.from_numpy(artifacts.embeddings[block]), torch.from_numpy(artifacts.embeddings)
+                    )
+                matrices.embed_sim[block, :] = embed_block
+                matrices.embed_sim[:, block] = embed_block.T
+            progress.advance('ast')
+            progress.advance('embed')
+
+        with progress.timed('token_scoring'):
+            token_scores = TokenScores(artifacts.token_fingerprints, artifacts.comments)
+            sorted_rows = np.sort(rows)
+            step = block_rows or len(rows)
+            for block in (rows[start:start + step] for start in range(0, len(rows), step)):
+                token_block = token_scores.rows(block)
+                token_block[np.arange(len(block)), block] = 0
+                matrices.token_sim[block, :] = token_block
+                matrices.token_sim[:, block] = token_block.T
+                # Pairs between two new rows count once, for the lower row
+                pairs = int(np.sum(n - 1 - np.searchsorted(sorted_rows, block)))
+                progress.advance('token', pairs, pairs=pairs)
+        return matrices
+
+    def score_tile(self, artifacts: JobArtifacts, rows: range, cols: range) -> dict[str, np.ndarray]:
+        """
+        Score the pairs between two ranges of files, one tile of a sharded job's pair matrices.
+        Returns a len(rows) x len(cols) float32 matrix per channel. The token score of a file with itself is
+        0, as in score_pairs, so every tile can be written back as is.
+        """
+        import torch
+
+        vectors = artifacts.ast_vectors
+        row_vectors, col_vectors = vectors[rows.start:rows.stop], vectors[cols.start:cols.stop]
+        ast_tile = (row_vectors @ col_vectors.T) / np.outer(row_norms(row_vectors), row_norms(col_vectors))
+        if artifacts.profile == 'fast':
+            embed_tile = HashedTfidf(artifacts.ngram_counts, TFIDF_BUCKETS).similarity(
+                np.arange(rows.start, rows.stop), np.arange(cols.start, cols.stop)
+            )
+        else:
+            embed_tile = EmbeddingSimilarity.compute_matrix(
+                torch.from_numpy(artifacts.embeddings[rows.start:rows.stop]),
+                torch.from_numpy(artifacts.embeddings[cols.start:cols.stop])
+            )
+
+        token_tile = TokenScores(artifacts.token_fingerprints, artifacts.comments).rows(
+            np.arange(rows.start, rows.stop), np.arange(cols.start, cols.stop)
+        )
+        # A file paired with itself has no token score
+        same = np.arange(max(rows.start, cols.start), min(rows.stop, cols.stop))
+        token_tile[same - rows.start, same - cols.start] = 0
+        return {
+            'token_sim': token_tile,
+            'ast_sim': ast_tile.astype(np.float32, copy=False),
+            'embed_sim': embed_tile,
+        }
+
+    def compute_artifacts(self, data, prior: JobArtifacts = None, progress: ProgressTracker = None,
+                          file_cache: FileArtifactCache = None, block_rows: int = None,
+                          profile: str = 'full') -> JobArtifacts:
+        """
+        Index the given Python files and score every pair between them.
+
+        When the artifacts of an earlier job are given, unchanged files are reused as-is and only the
+        new x (old + new) pairs are computed. Files whose name matches an earlier file but whose contents
+        changed replace the earlier version. block_rows scores large jobs in blocks, see score_pairs. profile is
+        one of ANALYSIS_PROFILES, and an earlier job can only be extended with the profile it was analysed with.
+        """
+        if profile not in ANALYSIS_PROFILES:
+            raise ValueError(f"Unknown analysis profile {profile!r}, expected one of {', '.join(ANALYSIS_PROFILES)}")
+        if prior is not None and prior.profile != profile:
+            raise ValueError(f"The earlier job was analysed with the {prior.profile} profile, not {profile}")
         python_files = data
+        progress = progress or ProgressTracker()
         print("Start processing")
 
-        # Generate embeddings for all files upfront
-        batch = [file[1] for file in python_files]
-        map_file_name_to_idx = {os.path.basename(file[0]): i for i, file in enumerate(python_files)}
-        batch_mapping = {os.path.basename(file_name): file_content for file_name, file_content in python_files}
-
-        ast_similarities_list = vector_ast().score(batch_mapping)
-        ast_similarities_map = [[0 for _ in range(len(python_files))] for _ in range(len(python_files))]
-        for (file1, file2, similarity_score) in ast_similarities_list:
-            idx1, idx2 = map_file_name_to_idx[file1], map_file_name_to_idx[file2]
-            ast_similarities_map[idx1][idx2] = similarity_score
-            ast_similarities_map[idx2][idx1] = similarity_score
-        print('Finished ast calculation')
-
-
-        token_similarities_list = MOSS_tok().tokenize(batch_mapping)
-        token_similarities_map = [[0 for _ in range(len(python_files))] for _ in range(len(python_files))]
-        for similarity in token_similarities_list:
-            file1, file2 = similarity['file1'], similarity['file2']
-            idx1, idx2 = map_file_name_to_idx[file1], map_file_name_to_idx[file2]
-            token_similarities_map[idx1][idx2] = similarity['similarity_score']
-            token_similarities_map[idx2][idx1] = similarity['similarity_score']
-        print('Finished tokenization')
-
-        nlp_sim = EmbeddingSimilarity()
-        nlp_embeddings = nlp_sim.get_embeddings_batch(batch)
-        print("Finished NLP")
-
-        # Create all unique pairs (i < j)
-        n = len(python_files)
-        file_pairs = []
-        for i in range(n):
-            for j in range(i + 1, n):
-                file_pairs.append((
-                    python_files[i][0], 
-                    python_files[j][0], 
-                    token_similarities_map[i][j],
-                    ast_similarities_map[i][j],
-                    float(nlp_sim.compute(nlp_embeddings[i], nlp_embeddings[j]))
-                ))
-        breakpoint()
-        return file_pairs
+        if prior is None:
+            fresh, keep = python_files, []
+        else:
+            known = dict(zip(prior.files, prior.content_hashes))
+            fresh = [file for file in python_files if known.get(file[0]) != content_hash(file[1])]
+            fresh_names = {file[0] for file in fresh}
+            keep = [i for i, name in enumerate(prior.files) if name not in fresh_names]
+            print(f"Reusing {len(keep)} files, adding {len(fresh)}")
+
+        # new x old pairs plus new x new pairs
+        k, n = len(fresh), len(keep) + len(fresh)
+        pairs = k * len(keep) + k * (k - 1) // 2
+        progress.set_pairs_total(pairs)
+        progress.set_total('token', k + pairs)
+        progress.set_total('ast', k + 1)
+        progress.set_total('embed', k + 1)
+
+        if prior is None:
+            artifacts = self.index_files(fresh, progress, file_cache, profile)
+        else:
+            artifacts = prior.select(keep).concat(self.index_files(fresh, progress, file_cache, profile))
+        new_rows = range(len(keep), n)
+
+        self.score_pairs(artifacts, new_rows, progress, block_rows)
+        for stage in ('token', 'ast', 'embed'):
+            progress.finish(stage)
+        print("Finished scoring")
+        return artifacts
+
+    def compute_similarities_from_zip(self, data, file_cache: FileArtifactCache = None) -> SimilarityMatrices:
+        """
+        Given the extracted Python files, compute pairwise similarity scores for every channel.
+        Returns a SimilarityMatrices holding one N x N matrix per channel, indexed like the input files.
+        """
+        return self.compute_artifacts(data, file_cache=file_cache).matrices
+
+
+def row_norms(vectors: np.ndarray) -> np.ndarray:
+    """Euclidean norm of every row, with all-zero rows at 1 so their similarities stay 0 like in sklearn."""
+    norms = np.sqrt(np.einsum('ij,ij->i', vectors, vectors))
+    norms[norms == 0] = 1
+    return norms
 
 
 class EmbeddingSimilarity:
     def __init__(self, model_name="microsoft/codebert-base", batch_size=8):
-        if "roberta" in model_name.lower():
-            self.tokenizer = RobertaTokenizer.from_pretrained(model_name)
-            self.model = RobertaModel.from_pretrained(model_name)
-        else:
-            self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-            self.model = AutoModel.from_pretrained(model_name).to(device)
+        # Loaded on first use and shared by every instance
+        self.tokenizer, self.model = load_embedding_model(model_name)
         self.embedding_cache = {}
         self.batch_size = batch_size
 
@@ -153,28 +344,52 @@ class EmbeddingSimilarity:
         """Generate a hash for the code snippet."""
         return hashlib.sha256(code.encode('utf-8')).hexdigest()
 
-    def get_embeddings_batch(self, code_snippets):
-        """Generate embeddings for a batch of code snippets."""
-        inputs = self.tokenizer(
-            code_snippets,
-            return_tensors="pt",
-            max_length=512,
-            truncation=True,
-            padding="max_length"
-        )
-        inputs = {key: val.to(device) for key, val in inputs.items()}
+    def get_embeddings_batch(self, code_snippets, progress: ProgressTracker = None):
+        """Generate embeddings for code snippets, running the model batch_size snippets at a time."""
+        import torch
 
-        with torch.no_grad():
-            outputs = self.model(**inputs)
-            batch_embeddings = outputs.last_hidden_state[:, 0, :]
-        return batch_embeddings
+        device = get_device()
+        chunks = []
+        for start in range(0, len(code_snippets), self.batch_size):
+            chunk = code_snippets[start:start + self.batch_size]
+            inputs = self.tokenizer(
+                chunk,
+                return_tensors="pt",
+                max_length=512,
+                truncation=True,
+                padding="max_length"
+            )
+            inputs = {key: val.to(device) for key, val in inputs.items()}
+
+            with torch.no_grad():
+                outputs = self.model(**inputs)
+                chunks.append(outputs.last_hidden_state[:, 0, :])
+            if progress is not None:
+                progress.advance('embed', len(chunk))
+        return torch.cat(chunks)
 
     def compute(self, embedding1, embedding2):
         """Compute cosine similarity between embeddings of two code snippets."""
+        import torch
+
         cosine_sim = torch.nn.functional.cosine_similarity(
             embedding1.unsqueeze(0), embedding2.unsqueeze(0)
         ).item()
         # Normalize cosine similarity
         normalized_embed_sim = max(0.0, min(1.0, (cosine_sim - 0.99) * 100))
         return 1 / (1 + math.exp(-9 * (normalized_embed_sim - 0.5)))
+
+    @staticmethod
+    def compute_matrix(embeddings, others=None):
+        """
+        Compute the normalized similarity between every pair of embeddings as a float32 matrix.
+        With others given, rows are embeddings and columns are others.
+        """
+        import torch
+
+        normed = torch.nn.functional.normalize(embeddings, dim=-1)
+        others = normed if others is None else torch.nn.functional.normalize(others, dim=-1)
+        cosine_sim = normed @ others.T
+        normalized_embed_sim = torch.clamp((cosine_sim - 0.99) * 100, 0.0, 1.0)
+        return torch.sigmoid(9 * (normalized_embed_sim - 0.5)).cpu().numpy().astype(np.float32)
     
\ No newline at end of file
@@ -12,3 +12,7 @@ class vector_ast(ABC):
         similarities = similarity.report_similarity(list(file_dict.keys()), embeddings, m)
         return similarities
 
+    def score_matrix(self, file_dict: dict[str, str]) -> np.ndarray:
+        similarity = ASTSimilarity()
+        embeddings = similarity.index_files(file_dict)
+        return similarity.similarity_matrix(list(file_dict.keys()), embeddings)
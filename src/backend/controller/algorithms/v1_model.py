@@ -1,7 +1,10 @@
 from controller.algorithms.abstract_model import abstract_model
 import torch.nn as nn
 import torch.optim as optim
+from torch.utils.data import TensorDataset, DataLoader, BatchSampler, RandomSampler
+from concurrent.futures import ThreadPoolExecutor
 import os
+import copy
 import random
 import math
 import torch
@@ -20,27 +23,33 @@ class PlagiarismDetectionModel(nn.Module):
         self.dropout = nn.Dropout(p=0.3)  # Dropout with a rate of 30%
 
 
-    def forward(self, token_sim, ast_sim, embed_sim, batch_mean_sim, snippet_mean_sim):
+    def features(self, token_sim, ast_sim, embed_sim, batch_mean_sim, snippet_mean_sim):
         # Ensure all input tensors are 2D (batch_size, num_pairs)
         batch_size = token_sim.size(0)
         batch_mean_sim = batch_mean_sim.view(batch_size, 1) 
         snippet_mean_sim = snippet_mean_sim.view(batch_size, 1)  
 
+        # Normalized across the files of the batch, so a batch must be one whole dataset or job
         max_token = normalize(torch.max(token_sim, dim=-1).values)
         max_ast = normalize(torch.max(ast_sim, dim=-1).values)
         max_embed = normalize(torch.max(embed_sim, dim=-1).values)
 
-        x = torch.cat((
+        return torch.cat((
             max_token.unsqueeze(-1), max_ast.unsqueeze(-1), max_embed.unsqueeze(-1),
             batch_mean_sim, snippet_mean_sim
         ), dim=-1) 
-        
+
+    def classify(self, x):
+        # Logits for a (num_files, 5) tensor of per-file features
         x = torch.relu(self.fc1(x)) 
         x = self.dropout(x)
         x = torch.relu(self.fc2(x))  
         x = self.dropout(x)
         x = torch.relu(self.fc3(x))    
-        outputs = self.fc4(x)  
+        return self.fc4(x)  
+
+    def forward(self, token_sim, ast_sim, embed_sim, batch_mean_sim, snippet_mean_sim):
+        outputs = self.classify(self.features(token_sim, ast_sim, embed_sim, batch_mean_sim, snippet_mean_sim))
         
         predicted_plagiarism = torch.sigmoid(outputs)  # Second column: plagiarism status (sigmoid output for current rendition)
         # predicted_plagiarism = torch.round(predicted_plagiarism*10)/10  # Apply soft thresholding
@@ -61,6 +70,53 @@ def normalize(x):
     return (x - mean) / (std + 1e-8)  # Normalize and avoid division by zero
 
 
+def stack_features(model, batch_pairs):
+    """
+    Per-file features and plagiarism status of every dataset, stacked into one (num_files, 5) tensor and one
+    (num_files, 1) tensor. Features are computed dataset by dataset, as the model normalizes them per dataset.
+    """
+    features, status = [], []
+    with torch.no_grad():
+        for batch, ground_truth_data in batch_pairs:
+            x = model.features(
+                batch['token_sim'], 
+                batch['ast_sim'], 
+                batch['embed_sim'], 
+                batch['batch_mean_sim'], 
+                batch['snippet_mean_sim']
+            )
+            if len(ground_truth_data) != x.size(0):
+                raise ValueError(f"{x.size(0)} files in the batch but {len(ground_truth_data)} ground truth rows")
+            features.append(x)
+            status.append(torch.tensor([entry[2] for entry in ground_truth_data], dtype=x.dtype).view(-1, 1))
+    return torch.cat(features), torch.cat(status)
+
+
+class CheckpointWriter:
+    """Saves checkpoints from a background thread, one at a time, so training doesn't wait on the disk."""
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint-writer")
+        self._pending = None
+
+    def save(self, checkpoint, path):
+        # Copied now, training keeps updating the tensors in place while the copy is written
+        checkpoint = copy.deepcopy(checkpoint)
+        self._pending = self._executor.submit(self._write, checkpoint, path)
+
+    @staticmethod
+    def _write(checkpoint, path):
+        # Written under a temporary name so a checkpoint being loaded is never half written
+        partial = f"{path}.partial"
+        torch.save(checkpoint, partial)
+        os.replace(partial, path)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        if self._pending is not None:
+            self._pending.result()
+
+
 class head_model(abstract_model):
 
     def predict(self,batch_pairs, rec_check=None):
@@ -165,4 +221,79 @@ class head_model(abstract_model):
             print(f"Checkpoint saved at {checkpoint_path}")
             check_count +=1
 
-        return checkpoint_path, check_count
\ No newline at end of file
+        return checkpoint_path, check_count
+
+    def train_batched(self, batch_pairs, rec_check=None, num_epochs=100, batch_size=64, lr=0.01, weight_decay=1e-5,
+                      val_pairs=None, checkpoint_name='checkpoint_best.pth', noise_every=4):
+        """
+        Train on shuffled mini-batches of files from all datasets, stepping the optimizer once per mini-batch.
+
+        The per-file features are computed once up front, so an epoch only runs the classifier layers. A checkpoint
+        is written in the background whenever the loss improves: the loss on val_pairs if given, else the mean
+        training loss of the epoch. Returns the checkpoint's name and its loss.
+        """
+        model = PlagiarismDetectionModel()
+        model = model.to(torch.float64)
+        optimizer = optim.Adam(model.parameters(), lr=lr, weight_decay=weight_decay)
+        class_weights = torch.tensor([1.0, 10.0], dtype=torch.float64)
+        criterion_status = nn.BCEWithLogitsLoss(pos_weight=class_weights[1])  # Binary cross-entropy for plagiarism status
+
+        checkpoint_dir = os.path.join(os.path.dirname(__file__), f"checkpoints")
+        os.makedirs(checkpoint_dir, exist_ok=True)  # Create directory for saving checkpoints
+        checkpoint_path = os.path.join(checkpoint_dir, checkpoint_name)
+
+        if rec_check:
+            checkpoint = torch.load(os.path.join(checkpoint_dir, rec_check))
+            
+            # Load model and optimizer state dict
+            model.load_state_dict(checkpoint['model_state_dict'])
+            optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
+
+        features, status = stack_features(model, batch_pairs)
+        if val_pairs:
+            val_features, val_status = stack_features(model, val_pairs)
+        # Each draw from the sampler is a list of indices, so the dataset returns a whole mini-batch at once
+        loader = DataLoader(
+            TensorDataset(features, status),
+            sampler=BatchSampler(RandomSampler(features), batch_size=batch_size, drop_last=False),
+            batch_size=None,
+        )
+
+        writer = CheckpointWriter()
+        best_loss = math.inf
+        try:
+            for epoch in range(num_epochs):
+                model.train()
+                total_loss = 0
+                for x, ground_truth_status in loader:
+                    optimizer.zero_grad()
+                    status_loss = criterion_status(model.classify(x), ground_truth_status)
+                    status_loss.backward()
+                    optimizer.step()
+                    total_loss += status_loss.item() * x.size(0)
+                total_loss /= features.size(0)
+
+                if noise_every and (epoch + 1) % noise_every == 0:
+                    add_noise_to_weights(model, noise_std=0.01)
+
+                loss = total_loss
+                if val_pairs:
+                    model.eval()
+                    with torch.no_grad():
+                        loss = criterion_status(model.classify(val_features), val_status).item()
+
+                print(f"Epoch [{epoch+1}/{num_epochs}], Train Loss: {total_loss:.4f}" + (f", Val Loss: {loss:.4f}" if val_pairs else ""))
+
+                if loss < best_loss:
+                    best_loss = loss
+                    writer.save({
+                        'model_state_dict': model.state_dict(),
+                        'optimizer_state_dict': optimizer.state_dict(),
+                        'epoch': epoch,
+                        'loss': loss
+                    }, checkpoint_path)
+        finally:
+            writer.close()
+
+        print(f"Best loss {best_loss:.4f}, checkpoint saved at {checkpoint_path}")
+        return checkpoint_name, best_loss
\ No newline at end of file
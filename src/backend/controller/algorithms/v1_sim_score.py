@@ -2,25 +2,31 @@ from controller.algorithms.abstract_similarity_score import abstract_similarity_
 from controller.algorithms.v1_NLP import *
 
 class basic_weighting(abstract_similarity_score):
-    def score(self, data):
+    def score(self, data, prior: JobArtifacts = None, progress: ProgressTracker = None,
+              file_cache: FileArtifactCache = None, block_rows: int = None,
+              profile: str = 'full') -> SimilarityReport:
+        progress = progress or ProgressTracker()
 
-        file_pairs = feed_head_model().compute_similarities_from_zip(data)
+        artifacts = feed_head_model().compute_artifacts(data, prior, progress, file_cache, block_rows, profile)
+        return self.report(data, artifacts, progress)
 
-        results = [
-        {
-            "file1": fname1,
-            "file2": fname2,
-            "token_sim": token_sim,
-            "ast_sim": token_sim,
-            "embed_sim": token_sim,
-            "raw_scores": [token_sim, ast_sim, embed_sim],
-            "similarity_score": 0.5 * embed_sim + 0.1 * ast_sim + 0.4 * token_sim #decides how final score is calculated
-        }
-        for fname1, fname2, token_sim, ast_sim, embed_sim in file_pairs]
+    def report(self, data, artifacts: JobArtifacts, progress: ProgressTracker = None) -> SimilarityReport:
+        """Weight the channel scores and run the head model, once every pair of the artifacts is scored."""
+        progress = progress or ProgressTracker()
+        matrices = artifacts.matrices
 
-        statuses = feed_head_model().combinedPredict(data, results)
+        # decides how final score is calculated, see SCORE_WEIGHTS
+        similarity_score = matrices.weighted(SCORE_WEIGHTS)
 
-        return {
-            "similarity_results": results,
-            "plagiarism_results": statuses
-        }
\ No newline at end of file
+        progress.set_total('head', 1)
+        with progress.timed('head'):
+            statuses = feed_head_model().combinedPredict(data, matrices)
+        progress.finish('head')
+
+        return SimilarityReport(
+            matrices=matrices,
+            similarity_score=similarity_score,
+            plagiarism_results=statuses,
+            artifacts=artifacts,
+            profile=artifacts.profile
+        )
\ No newline at end of file
@@ -1,8 +1,15 @@
 from controller.algorithms.abstract_tokenizer import abstract_tokenizer
 from controller.algorithms.tokenization import *
 
+# Default k-gram size and winnowing window
+TOKEN_K = 5
+TOKEN_W = 4
+# Token n-gram sizes and hash buckets of the fast profile's TF-IDF vectors, see HashedTfidf
+TFIDF_NGRAMS = (1, 2, 3)
+TFIDF_BUCKETS = 2 ** 18
+
 class MOSS_tok (abstract_tokenizer):
-    def tokenize(self, file_dict: dict[str, str], k=5, w=4, m=0.0) -> list[dict]:
+    def tokenize(self, file_dict: dict[str, str], k=TOKEN_K, w=TOKEN_W, m=0.0) -> list[dict]:
         tokenizer = Tokenizer()
         file_fingerprints, file_comments = tokenizer.index_files(file_dict, k=k, w=w)
         similarities = tokenizer.report_similarity(w, file_fingerprints, file_comments, min_common_percent=m)
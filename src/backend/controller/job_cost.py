@@ -0,0 +1,67 @@
+import zipfile
+from dataclasses import dataclass, replace
+from controller.algorithms.syntax_tree import ASTSimilarity
+from controller.v1_report_generation import python_members
+
+# Rough per-unit costs of the pipeline on a CPU worker, measured on the sample datasets
+JOB_BASE_MB = 256
+# Every file keeps a dense float32 vector of AST node type pair counts
+AST_VECTOR_BYTES = len(ASTSimilarity().nodetypedict) ** 2 * 4
+# Scoring all rows at once lets sklearn make float64 copies of every AST vector, about this many times its size
+AST_SCRATCH_FACTOR = 3
+SOURCE_BYTES_PER_TOKEN = 4
+# k-gram hash, span and fingerprint entry kept per token
+TOKEN_MEMORY_BYTES = 400
+# Channel matrices and head model inputs per file pair
+PAIR_MEMORY_BYTES = 64
+# Embedding dominates per-file time, fingerprint comparison per-pair time
+SECONDS_PER_FILE = 0.1
+SECONDS_PER_PAIR = 25e-6
+
+
+@dataclass
+class JobCost:
+    """
+    Estimated size of a job, known before its archive is downloaded or extracted.
+    memory_mb is the peak when pairs are scored in one pass, block_memory_mb when they are scored
+    block_rows rows at a time.
+    """
+    files: int
+    source_bytes: int
+    tokens: int
+    pairs: int
+    memory_mb: float
+    block_memory_mb: float
+    seconds: float
+
+
+def estimate_job_cost(files: int, source_bytes: int, block_rows: int) -> JobCost:
+    files = int(files)
+    tokens = int(source_bytes / SOURCE_BYTES_PER_TOKEN)
+    pairs = files * (files - 1) // 2
+    shared_bytes = files * AST_VECTOR_BYTES + tokens * TOKEN_MEMORY_BYTES + pairs * PAIR_MEMORY_BYTES
+    block_bytes = min(block_rows, files) * (AST_VECTOR_BYTES + files * 4)
+    return JobCost(
+        files=files,
+        source_bytes=int(source_bytes),
+        tokens=tokens,
+        pairs=pairs,
+        memory_mb=JOB_BASE_MB + (shared_bytes + files * AST_VECTOR_BYTES * AST_SCRATCH_FACTOR) / (1024 * 1024),
+        block_memory_mb=JOB_BASE_MB + (shared_bytes + block_bytes) / (1024 * 1024),
+        seconds=files * SECONDS_PER_FILE + pairs * SECONDS_PER_PAIR,
+    )
+
+
+def archive_cost(infos: list[zipfile.ZipInfo], block_rows: int) -> JobCost:
+    """Estimate a job from its zip central directory: the .py members and their declared sizes."""
+    members = python_members(infos)
+    return estimate_job_cost(len(members), sum(info.file_size for info in members), block_rows)
+
+
+def tile_cost(files: int, source_bytes: int, pairs: int, block_rows: int) -> JobCost:
+    """A tile of a sharded job: it loads the whole job's per-file features but scores only its own pairs."""
+    job = estimate_job_cost(files, source_bytes, block_rows)
+    memory_mb = JOB_BASE_MB + (
+        job.files * AST_VECTOR_BYTES + job.tokens * TOKEN_MEMORY_BYTES + pairs * PAIR_MEMORY_BYTES
+    ) / (1024 * 1024)
+    return replace(job, pairs=pairs, memory_mb=memory_mb, block_memory_mb=memory_mb, seconds=pairs * SECONDS_PER_PAIR)
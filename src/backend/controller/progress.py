@@ -0,0 +1,114 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Pipeline stages in the order they start
+STAGES = ('extract', 'token', 'ast', 'embed', 'head')
+
+
+class ProgressTracker:
+    """
+    Collects per-stage progress from the similarity pipeline, and the wall time spent in its named steps.
+
+    Compute code only bumps counters under a lock. If a callback is given, a background thread hands it a
+    snapshot at most once every `interval` seconds (and only when something changed), so a slow consumer
+    never holds up the compute threads.
+
+    A profiler (anything with enter(step) and exit(step)) is told when each timed step starts and ends.
+    """
+
+    def __init__(self, callback=None, interval: float = 2.0, profiler=None):
+        self.callback = callback
+        self.interval = interval
+        self.profiler = profiler
+        self._lock = threading.Lock()
+        self._stages = {stage: {'done': 0, 'total': 0} for stage in STAGES}
+        self._pairs_done = 0
+        self._pairs_total = 0
+        self._version = 0
+        self._timings = {}
+        self._stop = threading.Event()
+        self._thread = None
+        if callback is not None:
+            self._thread = threading.Thread(target=self._run, name="progress-reporter", daemon=True)
+            self._thread.start()
+
+    def set_total(self, stage: str, total: int) -> None:
+        with self._lock:
+            self._stages[stage]['total'] = total
+            self._version += 1
+
+    def set_pairs_total(self, total: int) -> None:
+        with self._lock:
+            self._pairs_total = total
+            self._version += 1
+
+    def advance(self, stage: str, n: int = 1, pairs: int = 0) -> None:
+        with self._lock:
+            self._stages[stage]['done'] += n
+            self._pairs_done += pairs
+            self._version += 1
+
+    def finish(self, stage: str) -> None:
+        with self._lock:
+            entry = self._stages[stage]
+            entry['total'] = max(entry['total'], 1)
+            entry['done'] = entry['total']
+            self._version += 1
+
+    @contextmanager
+    def timed(self, step: str):
+        """Add the wall time of the block to step's total in timings()."""
+        if self.profiler is not None:
+            self.profiler.enter(step)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if self.profiler is not None:
+                self.profiler.exit(step)
+            with self._lock:
+                self._timings[step] = self._timings.get(step, 0.0) + elapsed
+
+    def timings(self) -> dict[str, float]:
+        """Seconds spent in each timed step so far."""
+        with self._lock:
+            return dict(self._timings)
+
+    def snapshot(self) -> dict:
+        """Return the progress as a JSON-serializable dict."""
+        with self._lock:
+            stages = {
+                stage: round(100.0 * min(entry['done'], entry['total']) / entry['total'], 1) if entry['total'] else 0.0
+                for stage, entry in self._stages.items()
+            }
+            return {
+                'stages': stages,
+                'percent': round(sum(stages.values()) / len(stages), 1),
+                'pairsProcessed': self._pairs_done,
+                'pairsTotal': self._pairs_total,
+            }
+
+    def _run(self):
+        sent_version = -1
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                version = self._version
+            if version == sent_version:
+                continue
+            sent_version = version
+            try:
+                self.callback(self.snapshot())
+            except Exception:
+                # Progress is best effort, never let it take the job down
+                pass
+
+    def close(self) -> None:
+        """
+        Stop the background reporter. Pending progress is dropped, the final status supersedes it.
+        Waits for an in-flight callback so it can't land after the final status.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,156 @@
+"""
+Sweep the token channel's k-gram size and winnowing window over a grid of (k, w) values, to tune them for a course.
+
+Every file is tokenized once. Each k's k-gram hashes extend those of k-1 and each w winnows the same hashes, so
+adding grid points doesn't add tokenization. Each setting is scored against the Status column of the datasets'
+ground truth csv: a file's score is its highest token similarity to any other file of its dataset.
+
+Run from src/backend:
+    python -m controller.token_sweep [p00005 p02405 ...] [--k 3 4 5 6 8] [--w 2 4 6 8] [--output sweep.json]
+"""
+import os
+import json
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.metrics import roc_auc_score
+from controller.algorithms.tokenization import Tokenizer
+from controller.algorithms.v1_tok import TOKEN_K, TOKEN_W
+from controller.v1_report_generation import extract_python_files_from_zip
+from controller.training_features import DATA_FOLDER, dataset_names
+
+METRICS_DIR = os.path.join(os.path.dirname(__file__), 'metrics')
+DEFAULT_KS = (3, 4, 5, 6, 8)
+DEFAULT_WS = (2, 4, 6, 8)
+
+
+def load_ground_truth(dataset) -> dict[str, int]:
+    """Plagiarism status by file name from a dataset's ground truth csv."""
+    df = pd.read_csv(os.path.join(METRICS_DIR, f"{dataset}_modified_analysis_results.csv"))
+    return dict(zip(df['0'], df['Status'].astype(int)))
+
+
+def _shared_counts(sets) -> np.ndarray:
+    """Number of elements each pair of sets has in common, as an (n, n) matrix."""
+    vocabulary = {}
+    rows, cols = [], []
+    for i, items in enumerate(sets):
+        for item in items:
+            rows.append(i)
+            cols.append(vocabulary.setdefault(item, len(vocabulary)))
+    incidence = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (rows, cols)), shape=(len(sets), max(len(vocabulary), 1))
+    )
+    return (incidence @ incidence.T).toarray()
+
+
+def token_similarity(counts, hash_sets, common_comments) -> np.ndarray:
+    """
+    The token channel matrix as Tokenizer.score_pair computes it, from each file's fingerprint count and
+    distinct fingerprint hashes, with all pairs' shared hashes counted in one sparse product.
+    """
+    counts = np.asarray(counts)
+    common = _shared_counts([hashes.tolist() for hashes in hash_sets]) + common_comments
+    denominator = np.minimum.outer(counts, counts) + common_comments
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(denominator > 0, common / denominator, 0.0)
+
+
+def best_accuracy(scores, labels) -> tuple[float, float]:
+    """The highest accuracy of flagging files scoring at least some threshold, and that threshold."""
+    order = np.argsort(-scores, kind='stable')
+    scores, labels = scores[order], labels[order]
+    negatives = len(labels) - labels.sum()
+    # Correct predictions when the first i+1 files are flagged, only valid at the last of equal scores
+    correct = np.cumsum(labels) + negatives - np.cumsum(1 - labels)
+    valid = np.r_[scores[1:] != scores[:-1], True]
+    best = int(np.argmax(np.where(valid, correct, -1)))
+    if negatives >= correct[best]:
+        return negatives / len(labels), float('inf')
+    return correct[best] / len(labels), float(scores[best])
+
+
+def sweep(datasets, ks=DEFAULT_KS, ws=DEFAULT_WS) -> dict:
+    tokenizer = Tokenizer()
+    grid = [(k, w) for k in ks for w in ws]
+    seconds = {'tokenize': 0.0, 'kgram_hashes': 0.0}
+    point_seconds = {point: {'winnow': 0.0, 'score': 0.0} for point in grid}
+    fingerprints = {point: 0 for point in grid}
+    scores = {point: [] for point in grid}
+    labels, files = [], 0
+
+    for dataset in datasets:
+        with open(os.path.join(DATA_FOLDER, f"{dataset}.zip"), 'rb') as f:
+            contents = extract_python_files_from_zip(f.read())
+        ground_truth = load_ground_truth(dataset)
+        contents = [(name, content) for name, content in contents if os.path.basename(name) in ground_truth]
+        labels.extend(ground_truth[os.path.basename(name)] for name, _ in contents)
+        files += len(contents)
+
+        start = time.perf_counter()
+        tokenized = [tokenizer._tokenize_file(content) for _, content in contents]
+        values = [tokenizer.token_values(tokens) for tokens, _ in tokenized]
+        seconds['tokenize'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        kgram_hashes = [tokenizer.kgram_hash_arrays(file_values, ks) for file_values in values]
+        seconds['kgram_hashes'] += time.perf_counter() - start
+
+        # Comments don't depend on k and w
+        common_comments = _shared_counts([comments for _, comments in tokenized])
+        for k, w in grid:
+            start = time.perf_counter()
+            winnowed = [tokenizer.winnow_hashes(hashes[k], w) for hashes in kgram_hashes]
+            point_seconds[k, w]['winnow'] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            similarity = token_similarity([count for count, _ in winnowed], [hashes for _, hashes in winnowed], common_comments)
+            np.fill_diagonal(similarity, -np.inf)
+            scores[k, w].append(similarity.max(axis=1) if len(contents) > 1 else np.zeros(len(contents)))
+            point_seconds[k, w]['score'] += time.perf_counter() - start
+            fingerprints[k, w] += sum(count for count, _ in winnowed)
+        print(f"Swept {dataset}: {len(contents)} files")
+
+    labels = np.array(labels)
+    results = []
+    for k, w in grid:
+        point_scores = np.concatenate(scores[k, w]) if scores[k, w] else np.zeros(0)
+        accuracy, threshold = best_accuracy(point_scores, labels)
+        results.append({
+            'k': k,
+            'w': w,
+            'auc': roc_auc_score(labels, point_scores) if 0 < labels.sum() < len(labels) else None,
+            'accuracy': accuracy,
+            'threshold': threshold,
+            'fingerprints_per_file': fingerprints[k, w] / max(files, 1),
+            'winnow_seconds': point_seconds[k, w]['winnow'],
+            'score_seconds': point_seconds[k, w]['score'],
+        })
+    return {'datasets': list(datasets), 'files': files, 'seconds': seconds, 'grid': results}
+
+
+def print_sweep(result):
+    print(f"{result['files']} files from {len(result['datasets'])} datasets, tokenized once in "
+          f"{result['seconds']['tokenize']:.2f}s, k-gram hashes for every k in {result['seconds']['kgram_hashes']:.2f}s")
+    print(f"{'k':>3} {'w':>3} {'auc':>7} {'accuracy':>9} {'threshold':>10} {'fp/file':>8} {'winnow s':>9} {'score s':>8}")
+    for point in sorted(result['grid'], key=lambda point: -(point['auc'] or 0)):
+        default = '  (default)' if (point['k'], point['w']) == (TOKEN_K, TOKEN_W) else ''
+        auc = f"{point['auc']:.4f}" if point['auc'] is not None else '-'
+        print(f"{point['k']:>3} {point['w']:>3} {auc:>7} {point['accuracy']:>9.4f} {point['threshold']:>10.4f} "
+              f"{point['fingerprints_per_file']:>8.1f} {point['winnow_seconds']:>9.3f} {point['score_seconds']:>8.3f}{default}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Score the token channel for a grid of k-gram sizes and winnowing windows.")
+    parser.add_argument('datasets', nargs='*', help='Dataset names in data_folder (default: all)')
+    parser.add_argument('--k', type=int, nargs='+', default=list(DEFAULT_KS), help='k-gram sizes')
+    parser.add_argument('--w', type=int, nargs='+', default=list(DEFAULT_WS), help='Winnowing window sizes')
+    parser.add_argument('--output', default=None, help='Also write the results to this json file')
+    args = parser.parse_args()
+    result = sweep(args.datasets or dataset_names(), sorted(set(args.k)), sorted(set(args.w)))
+    print_sweep(result)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
@@ -0,0 +1,108 @@
+"""
+Channel matrices and head model features of the training datasets, computed once and stored as compressed
+arrays, so training and evaluation runs don't re-run CodeBERT, the AST parser and the tokenizer.
+
+Run from src/backend to compute every dataset ahead of training:
+    python -m controller.training_features [p00005 p02405 ...] [--processes 4] [--force]
+"""
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+DATA_FOLDER = os.path.join(os.path.dirname(__file__), 'data_folder')
+FEATURES_DIR = os.path.join(os.path.dirname(__file__), 'features')
+
+CHANNELS = ('token_sim', 'ast_sim', 'embed_sim')
+# Inputs of the head model, see feed_head_model.build_batch
+BATCH_KEYS = ('token_sim', 'ast_sim', 'embed_sim', 'batch_mean_sim', 'snippet_mean_sim')
+
+
+def dataset_names() -> list[str]:
+    return sorted(name[:-len('.zip')] for name in os.listdir(DATA_FOLDER) if name.endswith('.zip'))
+
+
+def features_path(dataset, version=None) -> str:
+    from controller.v1_report_generation import features_version
+    return os.path.join(FEATURES_DIR, f"{dataset}-{version or features_version()}.npz")
+
+
+def materialize(dataset, force=False) -> str:
+    """
+    Compute and store a dataset's features unless they are stored already. Returns their path.
+
+    Rows are sorted by file name to line up with the ground truth csv. The file stores the file names,
+    the full channel matrices (matrix_<channel>) and the head model inputs (batch_<key>).
+    """
+    from controller.v1_report_generation import extract_python_files_from_zip
+    from controller.algorithms.v1_NLP import feed_head_model
+
+    path = features_path(dataset)
+    if os.path.exists(path) and not force:
+        return path
+
+    with open(os.path.join(DATA_FOLDER, f"{dataset}.zip"), 'rb') as f:
+        files = extract_python_files_from_zip(f.read())
+    nlp = feed_head_model()
+    matrices = nlp.compute_similarities_from_zip(files)
+
+    order = np.argsort([os.path.basename(name) for name in matrices.files], kind='stable')
+    batch = nlp.build_batch(matrices)
+    arrays = {'files': np.array(matrices.files)[order]}
+    for channel in CHANNELS:
+        arrays[f"matrix_{channel}"] = getattr(matrices, channel)[np.ix_(order, order)]
+    for key in BATCH_KEYS:
+        arrays[f"batch_{key}"] = batch[key].numpy()[order]
+
+    os.makedirs(FEATURES_DIR, exist_ok=True)
+    # Written under a temporary name so an interrupted run never leaves a truncated file behind
+    partial = f"{path}.partial.npz"
+    np.savez_compressed(partial, **arrays)
+    os.replace(partial, path)
+    print(f"Stored features of {dataset}: {len(order)} files")
+    return path
+
+
+def _init_process(threads):
+    import torch
+    # Processes split the cores instead of each running torch on all of them
+    torch.set_num_threads(threads)
+
+
+def materialize_all(datasets, processes=None, force=False) -> list[str]:
+    """Materialize several datasets, one process per dataset, up to processes at a time."""
+    missing = [dataset for dataset in datasets if force or not os.path.exists(features_path(dataset))]
+    if not missing:
+        return [features_path(dataset) for dataset in datasets]
+    processes = min(processes or os.cpu_count() or 1, len(missing))
+    if processes == 1:
+        for dataset in missing:
+            materialize(dataset, force)
+    else:
+        threads = max(1, (os.cpu_count() or 1) // processes)
+        with ProcessPoolExecutor(processes, initializer=_init_process, initargs=(threads,)) as pool:
+            list(pool.map(materialize, missing, [force] * len(missing)))
+    return [features_path(dataset) for dataset in datasets]
+
+
+def load_features(dataset) -> dict[str, np.ndarray]:
+    """A dataset's stored features, computed first if they aren't stored for the current pipeline."""
+    with np.load(materialize(dataset)) as npz:
+        return {key: npz[key] for key in npz.files}
+
+
+def load_batch(dataset) -> "dict[str, torch.Tensor]":
+    """The head model inputs of a dataset as float64 tensors, rows sorted by file name."""
+    import torch
+    features = load_features(dataset)
+    return {key: torch.from_numpy(features[f"batch_{key}"]).to(torch.float64) for key in BATCH_KEYS}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compute and store the features of the training datasets.")
+    parser.add_argument('datasets', nargs='*', help='Dataset names in data_folder (default: all)')
+    parser.add_argument('--processes', type=int, default=None, help='Datasets computed at once (default: one per core)')
+    parser.add_argument('--force', action='store_true', help='Recompute features that are already stored')
+    args = parser.parse_args()
+    for path in materialize_all(args.datasets or dataset_names(), args.processes, args.force):
+        print(path)
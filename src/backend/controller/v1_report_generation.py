@@ -1,33 +1,165 @@
 #formerly compute.py
-import os
-import tempfile
+import io
+import json
+import hashlib
 import zipfile
+import functools
+from dataclasses import dataclass
 from controller.algorithms.abstract_report_generation import abstract_report_generation
 from controller.algorithms.v1_sim_score import *
+from controller.algorithms.model_loader import EMBEDDING_MODEL, HEAD_CHECKPOINT
+from controller.progress import ProgressTracker
+from errors.exceptions import BadRequestException
+
+
+@dataclass
+class ZipLimits:
+    """
+    Bounds on what an uploaded archive may expand to, checked against the zip central directory
+    before anything is decompressed.
+    """
+    max_members: int = 2000
+    max_total_uncompressed: int = 100 * 1024 * 1024
+    max_compression_ratio: float = 200.0
+
+
+DEFAULT_ZIP_LIMITS = ZipLimits()
+
 
 class report_generation(abstract_report_generation):
-    def generate(self, data):
-        data = extract_python_files_from_zip(data)
-        results = basic_weighting().score(data)
+    def generate(self, data, prior: JobArtifacts = None, limits: ZipLimits = DEFAULT_ZIP_LIMITS,
+                 progress: ProgressTracker = None, file_cache: FileArtifactCache = None,
+                 block_rows: int = None, profile: str = 'full') -> SimilarityReport:
+        """
+        Run the similarity pipeline over a zip file (as bytes or a seekable file object).
+        The returned report keeps scores in matrix form; call to_dict() to serialize it.
+        If the artifacts of an earlier job are given, the zip's files are added to that job instead.
+        """
+        data = extract_python_files_from_zip(data, limits, progress)
+        return self.generate_from_files(data, prior, progress, file_cache, block_rows, profile)
+
+    def generate_from_files(self, data, prior: JobArtifacts = None, progress: ProgressTracker = None,
+                            file_cache: FileArtifactCache = None, block_rows: int = None,
+                            profile: str = 'full') -> SimilarityReport:
+        """
+        Run the similarity pipeline over already extracted (filename, file_content) pairs.
+        Per-file features found in the file cache are reused instead of computed.
+        With block_rows, pairs are scored that many rows at a time to bound the job's peak memory.
+        The fast profile scores the embedding channel with hashed TF-IDF instead of CodeBERT, see ANALYSIS_PROFILES.
+        """
+        results = basic_weighting().score(data, prior, progress, file_cache, block_rows, profile)
         return results
 
 
-def extract_python_files_from_zip(zip_bytes):
+def archive_content_hash(python_files) -> str:
     """
-    Given the bytes of a zip file, extract all .py files and return a list of tuples:
-      [(filename, file_content), ...]
+    Hash of an archive's Python files that ignores member order, timestamps and compression,
+    so re-zipping the same files gives the same hash.
+    """
+    digest = hashlib.sha256()
+    for name, content in sorted(python_files):
+        digest.update(f"{name}\0{content_hash(content)}\0".encode('utf-8'))
+    return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def pipeline_version(profile: str = 'full') -> str:
     """
-    python_files = []
-    with tempfile.TemporaryDirectory() as tmpdirname:
-        zip_path = os.path.join(tmpdirname, "upload.zip")
-        with open(zip_path, "wb") as f:
-            f.write(zip_bytes)
-        with zipfile.ZipFile(zip_path, 'r') as zf:
-            for info in zf.infolist():
-                if info.filename.endswith(".py") and not info.is_dir():
-                    with zf.open(info) as file:
-                        content = file.read().decode("utf-8")
-                        python_files.append((info.filename, content))
-    return python_files
+    Identifies everything besides the input that a job's result depends on: fingerprinting parameters,
+    artifact layout, score weights, the embedding model, the head model checkpoint and the analysis profile.
+    """
+    with open(HEAD_CHECKPOINT, 'rb') as f:
+        checkpoint_hash = hashlib.sha256(f.read()).hexdigest()
+    settings = {
+        'artifacts': ARTIFACTS_VERSION,
+        'token_k': TOKEN_K,
+        'token_w': TOKEN_W,
+        'weights': SCORE_WEIGHTS,
+        'embedding_model': EMBEDDING_MODEL,
+        'head_checkpoint': checkpoint_hash,
+    }
+    if profile != 'full':
+        settings['profile'] = profile
+        settings['tfidf'] = {'ngrams': TFIDF_NGRAMS, 'buckets': TFIDF_BUCKETS}
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
 
+@functools.lru_cache(maxsize=None)
+def features_version() -> str:
+    """
+    Identifies everything besides the input that the channel matrices depend on: fingerprinting parameters,
+    artifact layout, the embedding model and the AST node types of the running Python. Unlike pipeline_version
+    it leaves out the score weights and the head model checkpoint, so stored features outlive retraining.
+    """
+    settings = {
+        'artifacts': ARTIFACTS_VERSION,
+        'token_k': TOKEN_K,
+        'token_w': TOKEN_W,
+        'embedding_model': EMBEDDING_MODEL,
+        'ast_node_types': ','.join(ASTSimilarity().nodetypedict),
+    }
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()[:16]
 
+
+def python_members(infos: list[zipfile.ZipInfo]) -> list[zipfile.ZipInfo]:
+    """The archive members the pipeline analyses."""
+    return [info for info in infos if info.filename.endswith(".py") and not info.is_dir()]
+
+
+def check_zip_limits(zf: zipfile.ZipFile, limits: ZipLimits) -> list[zipfile.ZipInfo]:
+    """
+    Validate the archive's central directory against the limits and return the .py members.
+    zipfile never returns more than a member's declared size, so the declared sizes bound the real ones.
+    """
+    infos = zf.infolist()
+    if len(infos) > limits.max_members:
+        raise BadRequestException(
+            f"Archive has {len(infos)} members, the limit is {limits.max_members}.",
+            "TOO_MANY_ARCHIVE_MEMBERS"
+        )
+
+    python_infos = python_members(infos)
+    total = 0
+    for info in python_infos:
+        if info.file_size > limits.max_compression_ratio * max(info.compress_size, 1):
+            raise BadRequestException(
+                f"Archive member {info.filename} has a suspicious compression ratio.",
+                "SUSPICIOUS_COMPRESSION_RATIO"
+            )
+        total += info.file_size
+        if total > limits.max_total_uncompressed:
+            raise BadRequestException(
+                f"Archive expands to more than {limits.max_total_uncompressed} bytes.",
+                "ARCHIVE_TOO_LARGE"
+            )
+    return python_infos
+
+
+def iter_python_files_from_zip(zip_data, limits: ZipLimits = DEFAULT_ZIP_LIMITS, progress: ProgressTracker = None):
+    """
+    Lazily yield (filename, file_content) for every .py file in a zip, reading straight from memory.
+    zip_data may be the zip's bytes or any seekable binary file object (e.g. io.BytesIO).
+    """
+    if isinstance(zip_data, (bytes, bytearray, memoryview)):
+        zip_data = io.BytesIO(zip_data)
+    try:
+        with zipfile.ZipFile(zip_data, 'r') as zf:
+            python_infos = check_zip_limits(zf, limits)
+            if progress is not None:
+                progress.set_total('extract', len(python_infos))
+            for info in python_infos:
+                with zf.open(info) as file:
+                    content = file.read().decode("utf-8")
+                if progress is not None:
+                    progress.advance('extract')
+                yield info.filename, content
+    except zipfile.BadZipFile as e:
+        raise BadRequestException(f"Potentially corrupted zip file: {e}", "CORRUPTED_ZIP_FILE")
+
+
+def extract_python_files_from_zip(zip_data, limits: ZipLimits = DEFAULT_ZIP_LIMITS, progress: ProgressTracker = None):
+    """
+    Given the bytes of a zip file (or a seekable file object), extract all .py files and return a list of tuples:
+      [(filename, file_content), ...]
+    """
+    return list(iter_python_files_from_zip(zip_data, limits, progress))
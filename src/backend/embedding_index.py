@@ -0,0 +1,319 @@
+import time
+import logging
+import numpy as np
+from segment_store import SegmentStore
+
+logger = logging.getLogger('embedding_index')
+
+# Bump when the layout of the catalog or the chunks changes
+EMBEDDING_INDEX_VERSION = 2
+# Vectors needed before the first clustering, below that every query is exhaustive
+MIN_TRAIN = 512
+# The clustering is redone once the index holds this many times the vectors it was trained on
+RETRAIN_GROWTH = 2.0
+# Vectors per list the clustering aims for, and the most vectors k-means trains on per list
+VECTORS_PER_LIST = 64
+TRAIN_PER_LIST = 64
+KMEANS_ITERATIONS = 10
+# Chunks kept before they are compacted into one
+MAX_CHUNKS = 16
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    content_hash TEXT NOT NULL UNIQUE,
+    added REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    name TEXT PRIMARY KEY,
+    vectors INTEGER NOT NULL,
+    centroids TEXT,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS centroids (
+    name TEXT PRIMARY KEY,
+    lists INTEGER NOT NULL,
+    trained_on INTEGER NOT NULL,
+    created REAL NOT NULL
+);
+"""
+
+
+def normalize_rows(vectors) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def spherical_kmeans(vectors, lists, iterations=KMEANS_ITERATIONS, seed=0) -> np.ndarray:
+    """Unit-length centroids of lists clusters of unit vectors, clustered by cosine."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), lists, replace=False)]
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        empty = np.flatnonzero(np.bincount(assignment, minlength=lists) == 0)
+        # Empty clusters restart from random vectors
+        sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class EmbeddingIndex(SegmentStore):
+    """
+    File embeddings of past jobs, searchable by cosine similarity without comparing against every stored vector.
+
+    An inverted file (IVF) index: the vectors are clustered with spherical k-means, every vector is filed under
+    its nearest centroid, and a query ranks only the vectors of the nprobe lists whose centroids are nearest to
+    it. Until MIN_TRAIN vectors are stored, queries compare against all of them.
+
+    Each add() writes one chunk, a segment (see SegmentStore) of unit vectors and their corpus file ids, sorted
+    by list. Maintenance compacts the chunks into one once there are more than MAX_CHUNKS, and redoes the
+    clustering for about VECTORS_PER_LIST vectors per list whenever the index has grown RETRAIN_GROWTH times
+    since it was last trained; the centroids are a segment of their own. Chunks holding vectors of removed
+    files are compacted without them. Files are stored once per content hash. Chunks are memory-mapped, so a
+    query only reads the lists it probes.
+    """
+
+    NAME = 'embedding index'
+    VERSION = EMBEDDING_INDEX_VERSION
+    SCHEMA = SCHEMA
+    FILE_COLUMNS = ('job_id', 'name')
+    SEGMENT_TABLES = ('chunks', 'centroids')
+
+    def __init__(self, directory, params='', background_maintenance=True):
+        # Vectors are only comparable from the same embedding model
+        super().__init__(directory, params, background_maintenance)
+        self._loaded = None
+        self._state = None
+
+    def _current_centroids(self):
+        """Name and vectors of the newest centroids, or (None, None) before the first clustering."""
+        with self._lock:
+            row = self._db.execute("SELECT name FROM centroids ORDER BY created DESC, name DESC LIMIT 1").fetchone()
+        if row is None:
+            return None, None
+        return row[0], np.load(self._path(row[0], 'centroids'))
+
+    def add(self, job_id, files, content_hashes, embeddings) -> int:
+        """
+        Add a job's file embeddings, skipping contents the index already holds. Returns the number of files added.
+        """
+        centroids_name, centroids = self._current_centroids()
+        with self._transaction() as db:
+            now = time.time()
+            file_ids, rows = [], []
+            for row, (name, content_hash) in enumerate(zip(files, content_hashes)):
+                cursor = db.execute(
+                    "INSERT OR IGNORE INTO files (job_id, name, content_hash, added) VALUES (?, ?, ?, ?)",
+                    (job_id, name, content_hash, now)
+                )
+                if cursor.rowcount:
+                    file_ids.append(cursor.lastrowid)
+                    rows.append(row)
+            if rows:
+                vectors = normalize_rows(np.asarray(embeddings)[rows])
+                lists = np.argmax(vectors @ centroids.T, axis=1).astype(np.int32) if centroids is not None \
+                    else np.full(len(rows), -1, dtype=np.int32)
+                chunk = self._new_name()
+                self._save(chunk, self._sorted_by_list(
+                    {'vectors': vectors, 'ids': np.array(file_ids, dtype=np.int64), 'lists': lists}
+                ))
+                db.execute(
+                    "INSERT INTO chunks (name, vectors, centroids, created) VALUES (?, ?, ?, ?)",
+                    (chunk, len(rows), centroids_name, now)
+                )
+        if rows:
+            self._request_maintenance()
+        return len(rows)
+
+    def _load(self):
+        """
+        The live chunks as (vectors, corpus ids, list starts), rebuilt only when the catalog changed. Chunks are
+        sorted by list, so list l of a chunk is rows starts[l]:starts[l + 1] of its memory map; starts is None
+        before the first clustering.
+        """
+        with self._lock:
+            chunks = self._db.execute("SELECT name, centroids FROM chunks ORDER BY name").fetchall()
+        centroids_name, centroids = self._current_centroids()
+        key = (tuple(chunks), centroids_name)
+        if self._loaded == key:
+            return self._state
+        parts = []
+        try:
+            for name, chunk_centroids in chunks:
+                vectors = np.load(self._path(name, 'vectors'), mmap_mode='r')
+                ids = np.load(self._path(name, 'ids'))
+                starts = None
+                if centroids is not None:
+                    lists = np.load(self._path(name, 'lists'))
+                    if chunk_centroids != centroids_name:
+                        # Added while the clustering was redone, filed under the new centroids in memory
+                        lists = np.argmax(np.asarray(vectors) @ centroids.T, axis=1)
+                        order = np.argsort(lists, kind='stable')
+                        vectors, ids, lists = np.asarray(vectors)[order], ids[order], lists[order]
+                    starts = np.searchsorted(lists, np.arange(len(centroids) + 1))
+                parts.append((vectors, ids, starts))
+        except FileNotFoundError:
+            # Compacted away since the catalog was read
+            return self._load()
+        self._state = {'chunks': parts, 'centroids': centroids}
+        self._loaded = key
+        return self._state
+
+    @staticmethod
+    def _sorted_by_list(arrays: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+        order = np.argsort(arrays['lists'], kind='stable')
+        return {part: array[order] for part, array in arrays.items()}
+
+    def search(self, embeddings, top_k=5, nprobe=8, exhaustive=False, exclude_ids=None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        The top_k stored files by cosine similarity for each query vector, as (corpus file ids, cosines), both
+        len(embeddings) x top_k and best first, with missing neighbours as id -1. exhaustive compares against
+        every vector; corpus files in exclude_ids are never returned.
+
+        Lists are searched one at a time, for all the queries probing them at once, keeping a running top_k.
+        """
+        state = self._load()
+        queries = normalize_rows(embeddings)
+        ids = np.full((len(queries), top_k), -1, dtype=np.int64)
+        cosines = np.full((len(queries), top_k), -np.inf, dtype=np.float32)
+
+        if exhaustive or state['centroids'] is None:
+            blocks = [(slice(None), vectors, chunk_ids) for vectors, chunk_ids, _ in state['chunks']]
+        else:
+            probes = np.argsort(-(queries @ state['centroids'].T), axis=1)[:, :nprobe]
+            probed = np.unique(probes)
+            blocks = []
+            for l in probed.tolist():
+                selected = np.flatnonzero((probes == l).any(axis=1))
+                for vectors, chunk_ids, starts in state['chunks']:
+                    if starts[l + 1] > starts[l]:
+                        blocks.append((selected, vectors[starts[l]:starts[l + 1]], chunk_ids[starts[l]:starts[l + 1]]))
+
+        for selected, vectors, block_ids in blocks:
+            if exclude_ids is not None and len(exclude_ids):
+                usable = ~np.isin(block_ids, exclude_ids)
+                if not usable.all():
+                    vectors, block_ids = np.asarray(vectors)[usable], block_ids[usable]
+            if not len(block_ids):
+                continue
+            scores = np.hstack([cosines[selected], queries[selected] @ np.asarray(vectors).T])
+            candidates = np.hstack([ids[selected], np.broadcast_to(block_ids, (len(scores), len(block_ids)))])
+            keep = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+            cosines[selected] = np.take_along_axis(scores, keep, axis=1)
+            ids[selected] = np.take_along_axis(candidates, keep, axis=1)
+
+        order = np.argsort(-cosines, axis=1, kind='stable')
+        return np.take_along_axis(ids, order, axis=1), np.take_along_axis(cosines, order, axis=1)
+
+    def query(self, files, embeddings, top_k=5, min_cosine=0.995, nprobe=8, exclude_jobs=()) -> dict[str, list[dict]]:
+        """
+        Each given file's most similar stored files by embedding, at most top_k and only those with a cosine
+        similarity of at least min_cosine. Stored files of exclude_jobs are left out.
+
+        Returns {file: [{'job_id', 'file', 'cosine'}]} for the files with matches, best first.
+        """
+        if not len(files):
+            return {}
+        # Removed files' vectors are searched until maintenance compacts them away
+        excluded = np.concatenate([self._job_file_ids(exclude_jobs), self._removed_ids()])
+        ids, cosines = self.search(embeddings, top_k, nprobe, exclude_ids=excluded)
+        catalog = self._corpus_files(np.unique(ids[ids >= 0]).tolist())
+        matches = {}
+        for i, name in enumerate(files):
+            found = []
+            for file_id, cosine in zip(ids[i].tolist(), cosines[i].tolist()):
+                if file_id < 0 or cosine < min_cosine or file_id not in catalog:
+                    continue
+                job_id, corpus_name = catalog[file_id]
+                found.append({'job_id': job_id, 'file': corpus_name, 'cosine': cosine})
+            if found:
+                matches[name] = found
+        return matches
+
+    def maintain(self, force_train=False) -> bool:
+        """
+        Compact the chunks and redo the clustering when they are due, and compact the chunks holding vectors of
+        removed files without them. Only one process maintains the index at a time, the others skip. Returns
+        whether anything was done.
+        """
+        with self._maintenance_lock() as acquired:
+            if not acquired:
+                return False
+            removed = self._removed_ids()
+            with self._lock:
+                chunks = [name for name, in self._db.execute("SELECT name FROM chunks ORDER BY name")]
+                total, = self._db.execute("SELECT COALESCE(SUM(vectors), 0) FROM chunks").fetchone()
+                trained = self._db.execute("SELECT trained_on FROM centroids ORDER BY created DESC, name DESC LIMIT 1").fetchone()
+            train = force_train or (total >= MIN_TRAIN and (trained is None or total >= RETRAIN_GROWTH * trained[0]))
+            if train or len(chunks) > MAX_CHUNKS:
+                self._compact(chunks, train, removed)
+            elif len(removed):
+                holding = [name for name in chunks if np.isin(np.load(self._path(name, 'ids')), removed).any()]
+                self._compact(holding, False, removed)
+            else:
+                return False
+            return True
+
+    def _compact(self, chunks, train, removed=()):
+        """
+        Rewrite the given chunks as one, without the vectors of the removed file ids, filed under new centroids
+        if train, else the current ones.
+        """
+        if not chunks:
+            with self._transaction() as db:
+                self._forget_removed(db, removed)
+            return
+        vectors = np.concatenate([np.load(self._path(name, 'vectors')) for name in chunks])
+        ids = np.concatenate([np.load(self._path(name, 'ids')) for name in chunks])
+        if len(removed):
+            kept = ~np.isin(ids, removed)
+            vectors, ids = vectors[kept], ids[kept]
+        # Nothing left to cluster
+        train = train and len(vectors) > 0
+        now = time.time()
+        new_centroids = None
+        if train:
+            lists = max(1, min(len(vectors) // VECTORS_PER_LIST, len(vectors)))
+            sample = vectors
+            if len(vectors) > lists * TRAIN_PER_LIST:
+                sample = vectors[np.random.default_rng(0).choice(len(vectors), lists * TRAIN_PER_LIST, replace=False)]
+            new_centroids = self._new_name()
+            self._save(new_centroids, {'centroids': spherical_kmeans(sample, lists)})
+            centroids_name, centroids = new_centroids, np.load(self._path(new_centroids, 'centroids'))
+        else:
+            centroids_name, centroids = self._current_centroids()
+        assignment = np.argmax(vectors @ centroids.T, axis=1).astype(np.int32) if centroids is not None \
+            else np.full(len(vectors), -1, dtype=np.int32)
+        merged = self._new_name() if len(vectors) else None
+        if merged is not None:
+            self._save(merged, self._sorted_by_list({'vectors': vectors, 'ids': ids, 'lists': assignment}))
+
+        with self._transaction() as db:
+            db.execute(f"DELETE FROM chunks WHERE name IN ({','.join('?' * len(chunks))})", chunks)
+            if merged is not None:
+                db.execute(
+                    "INSERT INTO chunks (name, vectors, centroids, created) VALUES (?, ?, ?, ?)",
+                    (merged, len(vectors), centroids_name, now)
+                )
+            if new_centroids is not None:
+                db.execute(
+                    "INSERT INTO centroids (name, lists, trained_on, created) VALUES (?, ?, ?, ?)",
+                    (new_centroids, len(centroids), len(vectors), now)
+                )
+            self._forget_removed(db, removed)
+        self._unlink(chunks, ('vectors', 'ids', 'lists'))
+        trained = f", clustered into {len(centroids)} lists" if new_centroids is not None else ""
+        logger.info(f"Compacted {len(chunks)} embedding index chunks into {merged or 'none'} ({len(vectors)} vectors{trained})")
+
+    def stats(self) -> dict:
+        with self._lock:
+            files, = self._db.execute("SELECT COUNT(*) FROM files").fetchone()
+            chunks, vectors = self._db.execute("SELECT COUNT(*), COALESCE(SUM(vectors), 0) FROM chunks").fetchone()
+            row = self._db.execute("SELECT lists FROM centroids ORDER BY created DESC, name DESC LIMIT 1").fetchone()
+        return {'files': files, 'chunks': chunks, 'vectors': vectors, 'lists': row[0] if row else 0}
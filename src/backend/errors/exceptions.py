@@ -0,0 +1,17 @@
+class BaseAppException(Exception):
+    """
+    Base class for errors raised by the compute server.
+    Mirrors the Express API's HttpRequestException so it can be turned into an ErrorContent.
+    """
+
+    def __init__(self, status: int, message: str, code: str = None, details: dict = None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.code = code
+        self.details = details or {}
+
+
+class BadRequestException(BaseAppException):
+    def __init__(self, message: str, code: str = None, details: dict = None):
+        super().__init__(400, message, code, details)
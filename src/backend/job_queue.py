@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import uuid
+from abc import ABC, abstractmethod
+
+# How often the local queue looks for new messages while long polling
+LOCAL_POLL_INTERVAL = 0.2
+
+
+class JobQueue(ABC):
+    """
+    Queue the worker takes jobs from.
+
+    Messages are dicts with 'MessageId', 'ReceiptHandle' and 'Body' (the JSON job description), as SQS
+    returns them. A received message stays hidden for the visibility timeout and comes back unless it
+    is deleted first.
+    """
+
+    @abstractmethod
+    def send(self, body: dict) -> str:
+        """Enqueue a job and return its message id."""
+        pass
+
+    @abstractmethod
+    def receive(self, max_messages: int, wait_seconds: int, visibility_timeout: int) -> list[dict]:
+        pass
+
+    @abstractmethod
+    def delete(self, receipt_handle: str) -> None:
+        pass
+
+    @abstractmethod
+    def change_visibility(self, receipt_handle: str, timeout: int) -> None:
+        """Keep a received message hidden for timeout more seconds; 0 returns it to the queue."""
+        pass
+
+    @abstractmethod
+    def in_flight(self) -> int:
+        """Number of messages received by any consumer and not yet deleted (approximate for SQS)."""
+        pass
+
+
+class SQSJobQueue(JobQueue):
+    """
+    Job queue backed by an SQS FIFO queue.
+    """
+
+    def __init__(self, sqs, queue_url):
+        self.sqs = sqs
+        self.queue_url = queue_url
+
+    def send(self, body):
+        job_id = body['jobId']
+        # Tasks of a sharded job get their own message group, so workers can take them in parallel
+        task_id = body.get('taskId')
+        response = self.sqs.send_message(
+            QueueUrl=self.queue_url,
+            MessageBody=json.dumps(body),
+            MessageGroupId=task_id or body.get('auth0Id', job_id),
+            MessageDeduplicationId=task_id or job_id
+        )
+        return response['MessageId']
+
+    def receive(self, max_messages, wait_seconds, visibility_timeout):
+        response = self.sqs.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=min(max_messages, 10),
+            WaitTimeSeconds=wait_seconds,
+            VisibilityTimeout=visibility_timeout,
+            AttributeNames=['All'],
+            MessageAttributeNames=['All']
+        )
+        return response.get('Messages', [])
+
+    def delete(self, receipt_handle):
+        self.sqs.delete_message(QueueUrl=self.queue_url, ReceiptHandle=receipt_handle)
+
+    def change_visibility(self, receipt_handle, timeout):
+        self.sqs.change_message_visibility(
+            QueueUrl=self.queue_url,
+            ReceiptHandle=receipt_handle,
+            VisibilityTimeout=timeout
+        )
+
+    def in_flight(self):
+        response = self.sqs.get_queue_attributes(
+            QueueUrl=self.queue_url,
+            AttributeNames=['ApproximateNumberOfMessagesNotVisible']
+        )
+        return int(response['Attributes']['ApproximateNumberOfMessagesNotVisible'])
+
+
+class LocalJobQueue(JobQueue):
+    """
+    Job queue backed by a local directory, for running workers without AWS.
+
+    Waiting messages are files in pending/. Receiving one renames it into inflight/ under a fresh receipt
+    handle, which is atomic, so any number of worker processes can share the directory. The in-flight
+    file's modification time holds its visibility deadline; expired messages move back to pending/.
+    """
+
+    def __init__(self, root):
+        self.pending_dir = os.path.join(root, 'pending')
+        self.inflight_dir = os.path.join(root, 'inflight')
+        os.makedirs(self.pending_dir, exist_ok=True)
+        os.makedirs(self.inflight_dir, exist_ok=True)
+
+    def send(self, body):
+        # Zero-padded timestamps keep the directory listing in send order
+        message_id = f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+        path = os.path.join(self.pending_dir, f"{message_id}.json")
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(body, f)
+        os.replace(f"{path}.tmp", path)
+        return message_id
+
+    def _requeue_expired(self):
+        now = time.time()
+        for name in os.listdir(self.inflight_dir):
+            path = os.path.join(self.inflight_dir, name)
+            try:
+                if os.path.getmtime(path) <= now:
+                    self._requeue(name)
+            except FileNotFoundError:
+                # Deleted or requeued by another process in the meantime
+                pass
+
+    def _requeue(self, inflight_name):
+        message_id = inflight_name.split('.')[0]
+        os.rename(os.path.join(self.inflight_dir, inflight_name), os.path.join(self.pending_dir, f"{message_id}.json"))
+
+    def receive(self, max_messages, wait_seconds, visibility_timeout):
+        deadline = time.monotonic() + wait_seconds
+        while True:
+            self._requeue_expired()
+            messages = []
+            for name in sorted(name for name in os.listdir(self.pending_dir) if name.endswith('.json')):
+                if len(messages) >= max_messages:
+                    break
+                message_id = name[:-len('.json')]
+                receipt_handle = f"{message_id}.{uuid.uuid4().hex[:8]}"
+                inflight_path = os.path.join(self.inflight_dir, f"{receipt_handle}.json")
+                pending_path = os.path.join(self.pending_dir, name)
+                expires = time.time() + visibility_timeout
+                try:
+                    # Set the deadline before the move, so the message is never in flight with an expired one
+                    os.utime(pending_path, (expires, expires))
+                    os.rename(pending_path, inflight_path)
+                except FileNotFoundError:
+                    # Another process took it first
+                    continue
+                with open(inflight_path) as f:
+                    messages.append({'MessageId': message_id, 'ReceiptHandle': receipt_handle, 'Body': f.read()})
+            if messages or time.monotonic() >= deadline:
+                return messages
+            time.sleep(LOCAL_POLL_INTERVAL)
+
+    def delete(self, receipt_handle):
+        try:
+            os.unlink(os.path.join(self.inflight_dir, f"{receipt_handle}.json"))
+        except FileNotFoundError:
+            # The handle expired and the message was handed out again, like a stale SQS receipt handle
+            pass
+
+    def change_visibility(self, receipt_handle, timeout):
+        name = f"{receipt_handle}.json"
+        try:
+            if timeout == 0:
+                self._requeue(name)
+            else:
+                expires = time.time() + timeout
+                os.utime(os.path.join(self.inflight_dir, name), (expires, expires))
+        except FileNotFoundError:
+            pass
+
+    def in_flight(self):
+        return sum(1 for name in os.listdir(self.inflight_dir) if name.endswith('.json'))
@@ -0,0 +1,309 @@
+import os
+import time
+import logging
+import threading
+import contextlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+logger = logging.getLogger('metrics')
+
+# Histogram bucket upper bounds
+SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+PAIRS_PER_SECOND_BUCKETS = (100, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000)
+# Jobs are grouped by file count, so throughput can be compared across job sizes
+SIZE_CLASSES = ((10, '1-10'), (100, '11-100'), (1000, '101-1000'))
+# Seconds between samples of the worker's resident memory while jobs run
+RSS_SAMPLE_INTERVAL = 0.25
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels_text(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.extend(self._render_value(labels, value))
+        return lines
+
+    def _render_value(self, labels, value):
+        return [f"{self.name}{_labels_text(labels)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+    def set_function(self, function, **labels):
+        """Read the value from function() whenever the metrics are rendered."""
+        self.set(function, **labels)
+
+    def set_max(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = max(self._values.get(key, value), value)
+
+    def _render_value(self, labels, value):
+        return super()._render_value(labels, value() if callable(value) else value)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets):
+        super().__init__(name, documentation)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, total, observed = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, observed + 1)
+
+    def _render_value(self, labels, value):
+        counts, total, observed = value
+        lines = [
+            f"{self.name}_bucket{_labels_text(labels + (('le', _format_value(bound)),))} {count}"
+            for bound, count in zip(self.buckets, counts)
+        ]
+        lines.append(f"{self.name}_bucket{_labels_text(labels + (('le', '+Inf'),))} {observed}")
+        lines.append(f"{self.name}_sum{_labels_text(labels)} {_format_value(total)}")
+        lines.append(f"{self.name}_count{_labels_text(labels)} {observed}")
+        return lines
+
+
+class Registry:
+    """
+    The worker's metrics, rendered in the Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation) -> Counter:
+        return self._add(Counter(name, documentation))
+
+    def gauge(self, name, documentation) -> Gauge:
+        return self._add(Gauge(name, documentation))
+
+    def histogram(self, name, documentation, buckets=SECONDS_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, documentation, buckets))
+
+    def render(self) -> str:
+        return '\n'.join(line for metric in self._metrics for line in metric.render()) + '\n'
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram('worker_stage_seconds', 'Wall time of each job stage.')
+QUEUE_WAIT_SECONDS = REGISTRY.histogram('worker_queue_wait_seconds', 'Time from receiving a job to starting it.')
+JOB_SECONDS = REGISTRY.histogram('worker_job_seconds', 'Wall time of a job, by number of files.')
+PAIRS_PER_SECOND = REGISTRY.histogram(
+    'worker_job_pairs_per_second', 'Pairs scored per second of job time, by number of files.', PAIRS_PER_SECOND_BUCKETS
+)
+JOBS = REGISTRY.counter('worker_jobs_total', 'Jobs finished, by status.')
+FILES = REGISTRY.counter('worker_files_total', 'Files analysed.')
+PAIRS = REGISTRY.counter('worker_pairs_total', 'File pairs scored.')
+PAIRS_OMITTED = REGISTRY.counter('worker_pairs_omitted_total', 'File pairs left out of the per-pair results for scoring below REPORT_MIN_SCORE.')
+TOKENS = REGISTRY.counter('worker_tokens_total', 'Tokens fingerprinted.')
+JOBS_RUNNING = REGISTRY.gauge('worker_jobs_running', 'Jobs currently running.')
+JOBS_WAITING = REGISTRY.gauge('worker_jobs_waiting', 'Received jobs waiting for a slot.')
+RSS_PEAK_BYTES = REGISTRY.gauge('worker_rss_peak_bytes', 'Highest resident memory of the worker seen while jobs ran.')
+
+
+def size_class(files) -> str:
+    for limit, name in SIZE_CLASSES:
+        if files <= limit:
+            return name
+    return f"{SIZE_CLASSES[-1][0] + 1}+"
+
+
+def current_rss() -> int:
+    """Resident memory of this process in bytes."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # Not Linux: fall back to the peak so far, which is what we track anyway
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class _RssSampler:
+    """
+    One background thread that samples resident memory while any job is running and raises each
+    running job's peak. Jobs share the process, so a job's peak includes whatever ran alongside it.
+    """
+
+    def __init__(self, interval=RSS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self._jobs = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def track(self, job):
+        with self._lock:
+            self._jobs.add(job)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+                self._thread.start()
+
+    def untrack(self, job):
+        with self._lock:
+            self._jobs.discard(job)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._jobs:
+                    continue
+                jobs = list(self._jobs)
+            rss = current_rss()
+            RSS_PEAK_BYTES.set_max(rss)
+            for job in jobs:
+                job.rss_peak = max(job.rss_peak, rss)
+
+
+_sampler = _RssSampler()
+
+
+class JobMetrics:
+    """
+    Stage timings, counts and memory peak of one job. summary() goes into the job's result, finish()
+    adds the job to the worker-wide metrics. A profiler is told when each timed stage starts and ends.
+    """
+
+    def __init__(self, queue_wait=0.0, profiler=None):
+        self.profiler = profiler
+        self.started = time.monotonic()
+        self.queue_wait = queue_wait
+        self.stages = {}
+        self.files = 0
+        self.pairs = 0
+        self.pairs_omitted = 0
+        self.tokens = 0
+        self.cached = False
+        self.rss_peak = current_rss()
+        self._finished = False
+        _sampler.track(self)
+
+    @contextlib.contextmanager
+    def timed(self, stage):
+        if self.profiler is not None:
+            self.profiler.enter(stage)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_timings({stage: time.perf_counter() - start})
+            if self.profiler is not None:
+                self.profiler.exit(stage)
+
+    def add_timings(self, timings: dict[str, float]):
+        for stage, seconds in timings.items():
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def summary(self) -> dict:
+        elapsed = time.monotonic() - self.started
+        return {
+            'seconds': round(elapsed, 3),
+            'queueWaitSeconds': round(self.queue_wait, 3),
+            'stages': {stage: round(seconds, 3) for stage, seconds in self.stages.items()},
+            'files': self.files,
+            'pairs': self.pairs,
+            'pairsOmitted': self.pairs_omitted,
+            'tokens': self.tokens,
+            'pairsPerSecond': round(self.pairs / elapsed, 1) if elapsed > 0 else 0.0,
+            'rssPeakBytes': self.rss_peak,
+            'cached': self.cached,
+        }
+
+    def finish(self, status):
+        if self._finished:
+            return
+        self._finished = True
+        _sampler.untrack(self)
+        elapsed = time.monotonic() - self.started
+        size = size_class(self.files)
+        JOBS.inc(status=status)
+        QUEUE_WAIT_SECONDS.observe(self.queue_wait)
+        for stage, seconds in self.stages.items():
+            STAGE_SECONDS.observe(seconds, stage=stage)
+        if status != 'completed':
+            return
+        JOB_SECONDS.observe(elapsed, size=size)
+        FILES.inc(self.files)
+        PAIRS.inc(self.pairs)
+        PAIRS_OMITTED.inc(self.pairs_omitted)
+        TOKENS.inc(self.tokens)
+        if self.pairs and elapsed > 0:
+            PAIRS_PER_SECOND.observe(self.pairs / elapsed, size=size)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would drown the job logs
+        pass
+
+
+def start_metrics_server(port):
+    """Serve GET /metrics on the given port from a background thread. Returns the server, or None if the port is taken."""
+    try:
+        server = ThreadingHTTPServer(('', port), _MetricsHandler)
+    except OSError as e:
+        logger.warning(f"Metrics endpoint not started on port {port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"Serving metrics on port {port}")
+    return server
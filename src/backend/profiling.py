@@ -0,0 +1,192 @@
+import io
+import os
+import sys
+import time
+import pstats
+import marshal
+import cProfile
+import threading
+import tracemalloc
+from collections import Counter, defaultdict
+
+# Seconds between stack samples of a sampled job
+SAMPLE_INTERVAL = 0.01
+# Frames kept per traced allocation
+TRACEMALLOC_FRAMES = 10
+# Lines listed per stage in the text summary
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 25
+# Stage name of job time spent outside every named stage
+OUTSIDE_STAGES = 'job'
+# Leaves the snapshots' own bookkeeping out of the allocations
+_NOT_TRACEMALLOC = [tracemalloc.Filter(False, tracemalloc.__file__)]
+# Held by the job being profiled in mode 'full': from Python 3.12 only one cProfile can be active per process
+_full_profiling = threading.Lock()
+
+
+def _frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class JobProfiler:
+    """
+    Profiles one job stage by stage. The job's stage timers call enter() and exit() as the job moves between
+    stages, so every stage gets its own profile.
+
+    mode 'full' runs cProfile per stage and records the allocations each stage leaves behind and its peak with
+    tracemalloc. Both slow Python-heavy stages down severalfold, so this is for jobs that ask for it. Only one
+    job per process is fully profiled at a time; a profiler started while another one is falls back to mode
+    'sample' (requested_mode still says 'full'). tracemalloc sees the whole process, and from Python 3.12 so
+    does cProfile, so jobs running alongside show up in the profile too; before 3.12 cProfile only sees the
+    thread that created the profiler.
+
+    mode 'sample' only records the job thread's stack every SAMPLE_INTERVAL seconds. It is cheap enough to
+    leave on for every job and keep the profile of those that turn out slow.
+
+    Stages are only switched by the thread that created the profiler; enter() and exit() from other threads
+    are ignored.
+    """
+
+    def __init__(self, mode='full'):
+        if mode not in ('full', 'sample'):
+            raise ValueError(f"Unknown profiling mode: {mode}")
+        self.mode = mode
+        self.requested_mode = mode
+        self.thread_id = threading.get_ident()
+        self._stack = [OUTSIDE_STAGES]
+        self._seconds = defaultdict(float)
+        self._segment_start = None
+        # mode 'full'
+        self._profiles = {}
+        self._holds_lock = False
+        self._tracing = False
+        self._memory_start = None
+        self._memory_start_size = 0
+        self._memory_peak = defaultdict(int)
+        self._memory_diff = defaultdict(Counter)
+        # mode 'sample'
+        self._samples = Counter()
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def start(self) -> "JobProfiler":
+        if self.mode == 'full':
+            self._holds_lock = _full_profiling.acquire(blocking=False)
+            if not self._holds_lock:
+                self.mode = 'sample'
+        if self.mode == 'sample':
+            self._sampler = threading.Thread(target=self._sample, name="profile-sampler", daemon=True)
+            self._sampler.start()
+        elif not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self._tracing = True
+        self._begin_segment()
+        return self
+
+    @property
+    def stopped(self) -> bool:
+        return self._segment_start is None
+
+    def stop(self) -> None:
+        if self.stopped:
+            return
+        self._end_segment()
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+        if self._holds_lock:
+            _full_profiling.release()
+            self._holds_lock = False
+
+    def enter(self, stage: str) -> None:
+        if threading.get_ident() != self.thread_id or self.stopped:
+            return
+        self._end_segment()
+        self._stack.append(stage)
+        self._begin_segment()
+
+    def exit(self, stage: str) -> None:
+        if threading.get_ident() != self.thread_id or self.stopped or len(self._stack) == 1:
+            return
+        self._end_segment()
+        self._stack.pop()
+        self._begin_segment()
+
+    def _begin_segment(self):
+        stage = self._stack[-1]
+        self._segment_start = time.perf_counter()
+        if self.mode != 'full':
+            return
+        if self._tracing:
+            self._memory_start = tracemalloc.take_snapshot().filter_traces(_NOT_TRACEMALLOC)
+            self._memory_start_size = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        self._profiles.setdefault(stage, cProfile.Profile()).enable()
+
+    def _end_segment(self):
+        stage = self._stack[-1]
+        self._seconds[stage] += time.perf_counter() - self._segment_start
+        self._segment_start = None
+        if self.mode != 'full':
+            return
+        self._profiles[stage].disable()
+        if self._tracing:
+            peak = tracemalloc.get_traced_memory()[1]
+            self._memory_peak[stage] = max(self._memory_peak[stage], peak - self._memory_start_size)
+            snapshot = tracemalloc.take_snapshot().filter_traces(_NOT_TRACEMALLOC)
+            for stat in snapshot.compare_to(self._memory_start, 'lineno'):
+                if stat.size_diff:
+                    self._memory_diff[stage][str(stat.traceback[0])] += stat.size_diff
+            self._memory_start = None
+
+    def _sample(self):
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                stack.append(self._stack[-1])
+                self._samples[';'.join(reversed(stack))] += 1
+
+    def files(self) -> dict[str, bytes]:
+        """
+        The profile as named files: summary.txt for reading, plus stage.pstats per stage in mode 'full'
+        (load with pstats.Stats) or stacks.folded in mode 'sample' (folded stacks for flame graph tools).
+        """
+        summary = io.StringIO()
+        stages = sorted(self._seconds, key=lambda stage: -self._seconds[stage])
+        summary.write(f"Profile mode: {self.mode}\n")
+        summary.write("Seconds by stage: " + ", ".join(f"{stage} {self._seconds[stage]:.3f}" for stage in stages) + "\n")
+        files = {}
+
+        if self.mode == 'full':
+            for stage in stages:
+                profile = self._profiles[stage]
+                profile.create_stats()
+                files[f"{stage}.pstats"] = marshal.dumps(profile.stats)
+                summary.write(f"\n=== {stage}: {self._seconds[stage]:.3f}s ===\n")
+                pstats.Stats(profile, stream=summary).sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+                if stage in self._memory_peak:
+                    summary.write(f"Peak traced memory above stage start: {self._memory_peak[stage] / (1024 * 1024):.1f} MB\n")
+                    summary.write("Memory left allocated by line:\n")
+                    for line, size in self._memory_diff[stage].most_common(TOP_ALLOCATIONS):
+                        summary.write(f"  {size / 1024:10.1f} KB  {line}\n")
+        else:
+            files['stacks.folded'] = ''.join(f"{stack} {count}\n" for stack, count in self._samples.items()).encode('utf-8')
+            leaves = defaultdict(Counter)
+            for stack, count in self._samples.items():
+                frames = stack.split(';')
+                leaves[frames[0]][frames[-1]] += count
+            for stage in stages:
+                total = sum(leaves[stage].values())
+                summary.write(f"\n=== {stage}: {self._seconds[stage]:.3f}s, {total} samples ===\n")
+                for function, count in leaves[stage].most_common(TOP_FUNCTIONS):
+                    summary.write(f"  {100.0 * count / total:5.1f}%  {function}\n")
+
+        files['summary.txt'] = summary.getvalue().encode('utf-8')
+        return files
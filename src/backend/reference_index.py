@@ -0,0 +1,257 @@
+import time
+import logging
+import numpy as np
+from segment_store import SegmentStore
+
+logger = logging.getLogger('reference_index')
+
+# Bump when the layout of the catalog or the segments changes
+REFERENCE_INDEX_VERSION = 2
+# Fingerprint hashes found in more postings than this are boilerplate every submission shares, and skipped
+MAX_POSTINGS = 1000
+# Segments kept before the smallest are merged, and how many are merged at once
+MAX_SEGMENTS = 8
+MERGE_FACTOR = 4
+# Matching fingerprint positions listed per match
+MAX_POSITIONS = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    content_hash TEXT NOT NULL UNIQUE,
+    fingerprints INTEGER NOT NULL,
+    added REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS segments (
+    name TEXT PRIMARY KEY,
+    postings INTEGER NOT NULL,
+    created REAL NOT NULL
+);
+"""
+
+
+class ReferenceIndex(SegmentStore):
+    """
+    Winnowed fingerprints of every file past jobs analysed, so new submissions can be matched against earlier
+    terms and other jobs, not just the files of their own archive.
+
+    The index is an inverted index from fingerprint hash to (corpus file id, position), kept in immutable
+    segment files: a sorted array of hashes and an array of (file id, position) postings in the same order.
+    Each add() writes one new segment (see SegmentStore). Maintenance merges the smallest segments once there are
+    more than MAX_SEGMENTS, so a query only ever searches a few of them, and rewrites segments holding postings
+    of removed files without them. Files are stored once per content hash, by the first job that had them.
+
+    Queries memory-map the segments and binary search them for the job's own hashes, so their cost grows with
+    the job's fingerprints and only the matching postings are read, never the whole corpus.
+    """
+
+    NAME = 'reference index'
+    VERSION = REFERENCE_INDEX_VERSION
+    SCHEMA = SCHEMA
+    FILE_COLUMNS = ('job_id', 'name', 'fingerprints')
+    SEGMENT_TABLES = ('segments',)
+
+    def __init__(self, directory, params='', background_maintenance=True):
+        # Fingerprints are only comparable with the same k, w and hash function
+        super().__init__(directory, params, background_maintenance)
+        self._segments = {}
+
+    @staticmethod
+    def _postings(file_ids, token_fingerprints) -> tuple[np.ndarray, np.ndarray]:
+        """Hashes and (file id, position) postings of the given files, sorted by hash."""
+        hashes, postings = [], []
+        for file_id, fingerprints in zip(file_ids, token_fingerprints):
+            for position, fp in fingerprints.items():
+                hashes.append(fp.hash_val)
+                postings.append((file_id, position))
+        hashes = np.array(hashes, dtype=np.uint32)
+        postings = np.array(postings, dtype=np.uint32).reshape(-1, 2)
+        order = np.argsort(hashes, kind='stable')
+        return hashes[order], postings[order]
+
+    def _write_segment(self, hashes, postings) -> str:
+        name = self._new_name()
+        self._save(name, {'hashes': hashes, 'postings': postings})
+        return name
+
+    def add(self, job_id, files, content_hashes, token_fingerprints) -> int:
+        """
+        Add a job's files to the corpus, skipping contents the index already holds. Returns the number of files added.
+        """
+        with self._transaction() as db:
+            now = time.time()
+            file_ids, added = [], []
+            for name, content_hash, fingerprints in zip(files, content_hashes, token_fingerprints):
+                cursor = db.execute(
+                    "INSERT OR IGNORE INTO files (job_id, name, content_hash, fingerprints, added) VALUES (?, ?, ?, ?, ?)",
+                    (job_id, name, content_hash, len(fingerprints), now)
+                )
+                if cursor.rowcount:
+                    file_ids.append(cursor.lastrowid)
+                    added.append(fingerprints)
+            hashes, postings = self._postings(file_ids, added)
+            if len(hashes):
+                segment = self._write_segment(hashes, postings)
+                db.execute("INSERT INTO segments (name, postings, created) VALUES (?, ?, ?)", (segment, len(hashes), now))
+        if added:
+            self._request_maintenance()
+        return len(added)
+
+    def _live_segments(self) -> list[tuple[np.ndarray, np.ndarray]]:
+        """Memory maps of the segments the catalog lists, reopened only when the list changed."""
+        with self._lock:
+            names = [name for name, in self._db.execute("SELECT name FROM segments ORDER BY name")]
+        segments = {}
+        for name in names:
+            if name in self._segments:
+                segments[name] = self._segments[name]
+                continue
+            try:
+                segments[name] = tuple(np.load(self._path(name, part), mmap_mode='r') for part in ('hashes', 'postings'))
+            except FileNotFoundError:
+                # Merged away since the catalog was read, its postings are in the merged segment
+                return self._live_segments()
+        self._segments = segments
+        return list(segments.values())
+
+    def query(self, files, token_fingerprints, top_k=5, min_score=0.5, exclude_jobs=()) -> dict[str, list[dict]]:
+        """
+        The corpus files each given file shares the most fingerprints with, at most top_k per file and only those
+        scoring at least min_score. The score is the number of distinct shared hashes over the smaller fingerprint
+        count, the token channel's score without comments. Corpus files of exclude_jobs are left out.
+
+        Returns {file: [{'job_id', 'file', 'score', 'shared', 'positions'}]} for the files with matches, best first.
+        positions lists [position in the file, position in the corpus file] of shared fingerprints, so the
+        spans can be rebuilt from both jobs' token streams.
+        """
+        query_hashes, query_postings = self._postings(range(len(files)), token_fingerprints)
+        if not len(query_hashes):
+            return {}
+        unique, starts, counts = np.unique(query_hashes, return_index=True, return_counts=True)
+
+        # Where each query hash's postings are in every segment. A hash is boilerplate by its postings over
+        # all segments together, so the MAX_POSTINGS cap doesn't depend on how the corpus happens to be merged.
+        ranges = []
+        for hashes, postings in self._live_segments():
+            lo = np.searchsorted(hashes, unique, 'left')
+            ranges.append((postings, lo, np.searchsorted(hashes, unique, 'right') - lo))
+        total = sum((sizes for _, _, sizes in ranges), np.zeros(len(unique), dtype=np.int64))
+        common = total > MAX_POSTINGS
+
+        # Postings of every query hash, as (index into unique, corpus file id, corpus position)
+        found = []
+        for postings, lo, sizes in ranges:
+            hits = np.flatnonzero((sizes > 0) & ~common)
+            if not len(hits):
+                continue
+            sizes = sizes[hits]
+            offsets = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+            rows = np.repeat(lo[hits], sizes) + offsets
+            found.append((np.repeat(hits, sizes), np.asarray(postings[rows])))
+        if not found:
+            return {}
+        hit_index = np.concatenate([hits for hits, _ in found])
+        corpus = np.concatenate([postings for _, postings in found])
+
+        # Join every posting with every occurrence of its hash in the query files
+        repeat = counts[hit_index]
+        join = np.repeat(np.arange(len(hit_index)), repeat)
+        occurrence = starts[hit_index][join] + np.arange(repeat.sum()) - np.repeat(np.cumsum(repeat) - repeat, repeat)
+        query_file, query_position = query_postings[occurrence, 0], query_postings[occurrence, 1]
+        corpus_file, corpus_position = corpus[join, 0], corpus[join, 1]
+
+        # Distinct shared hashes per (query file, corpus file), the pair packed into one int64 key
+        pair_key = (query_file.astype(np.int64) << 32) | corpus_file.astype(np.int64)
+        hash_key = hit_index[join]
+        order = np.lexsort((hash_key, pair_key))
+        pair_key, hash_key = pair_key[order], hash_key[order]
+        # Sorted by pair, so the positions of a pair are one contiguous range
+        query_position, corpus_position = query_position[order], corpus_position[order]
+        distinct = np.r_[True, (pair_key[1:] != pair_key[:-1]) | (hash_key[1:] != hash_key[:-1])]
+        pairs, shared = np.unique(pair_key[distinct], return_counts=True)
+        pair_query, pair_corpus = pairs >> 32, pairs & 0xFFFFFFFF
+
+        corpus_ids = np.unique(pair_corpus)
+        catalog = self._corpus_files(corpus_ids.tolist())
+        corpus_counts = np.array([catalog[i][2] if i in catalog else 0 for i in corpus_ids.tolist()], dtype=np.int64)
+        usable = np.array([i in catalog and catalog[i][0] not in exclude_jobs for i in corpus_ids.tolist()], dtype=bool)
+        at = np.searchsorted(corpus_ids, pair_corpus)
+        query_counts = np.array([len(fingerprints) for fingerprints in token_fingerprints], dtype=np.int64)
+        scores = shared / np.maximum(np.minimum(query_counts[pair_query], corpus_counts[at]), 1)
+
+        candidates = {}
+        for k in np.flatnonzero(usable[at] & (scores >= min_score)).tolist():
+            candidates.setdefault(int(pair_query[k]), []).append((float(scores[k]), int(shared[k]), int(pair_corpus[k])))
+
+        matches = {}
+        for i, found_files in candidates.items():
+            found_files.sort(key=lambda candidate: (-candidate[0], -candidate[1], candidate[2]))
+            matches[files[i]] = []
+            for score, count, file_id in found_files[:top_k]:
+                key = (i << 32) | file_id
+                lo = int(np.searchsorted(pair_key, key, 'left'))
+                selected = slice(lo, min(int(np.searchsorted(pair_key, key, 'right')), lo + MAX_POSITIONS))
+                positions = np.stack([query_position[selected], corpus_position[selected]], axis=1)
+                job_id, name, _ = catalog[file_id]
+                matches[files[i]].append({
+                    'job_id': job_id,
+                    'file': name,
+                    'score': score,
+                    'shared': count,
+                    'positions': positions[np.argsort(positions[:, 0], kind='stable')].tolist(),
+                })
+        return matches
+
+    def maintain(self, max_segments=MAX_SEGMENTS, merge_factor=MERGE_FACTOR) -> int:
+        """
+        Rewrite the segments holding postings of removed files, then merge the smallest segments until at most
+        max_segments are left. Only one process maintains the index at a time, the others skip. Returns the
+        number of segment rewrites done.
+        """
+        with self._maintenance_lock() as acquired:
+            merges = 0
+            removed = self._removed_ids()
+            if acquired and len(removed):
+                with self._lock:
+                    names = [name for name, in self._db.execute("SELECT name FROM segments ORDER BY name")]
+                holding = [
+                    name for name in names
+                    if np.isin(np.load(self._path(name, 'postings'), mmap_mode='r')[:, 0], removed).any()
+                ]
+                self._merge_segments(holding, removed)
+                merges += 1
+            while acquired:
+                with self._lock:
+                    segments = self._db.execute("SELECT name FROM segments ORDER BY postings, name").fetchall()
+                if len(segments) <= max_segments:
+                    break
+                self._merge_segments([name for name, in segments[:max(merge_factor, 2)]])
+                merges += 1
+            return merges
+
+    def _merge_segments(self, names, removed=()):
+        """Rewrite the named segments as one, without the postings of the removed file ids."""
+        parts = [tuple(np.load(self._path(name, part)) for part in ('hashes', 'postings')) for name in names]
+        hashes = np.concatenate([hashes for hashes, _ in parts] + [np.zeros(0, dtype=np.uint32)])
+        postings = np.concatenate([postings for _, postings in parts] + [np.zeros((0, 2), dtype=np.uint32)])
+        if len(removed):
+            kept = ~np.isin(postings[:, 0], removed)
+            hashes, postings = hashes[kept], postings[kept]
+        order = np.argsort(hashes, kind='stable')
+        merged = self._write_segment(hashes[order], postings[order]) if len(hashes) else None
+        with self._transaction() as db:
+            if names:
+                db.execute(f"DELETE FROM segments WHERE name IN ({','.join('?' * len(names))})", names)
+            if merged is not None:
+                db.execute("INSERT INTO segments (name, postings, created) VALUES (?, ?, ?)", (merged, len(hashes), time.time()))
+            self._forget_removed(db, removed)
+        self._unlink(names, ('hashes', 'postings'))
+        logger.info(f"Merged {len(names)} reference index segments into {merged or 'none'} ({len(hashes)} postings)")
+
+    def stats(self) -> dict:
+        with self._lock:
+            files, = self._db.execute("SELECT COUNT(*) FROM files").fetchone()
+            segments, postings = self._db.execute("SELECT COUNT(*), COALESCE(SUM(postings), 0) FROM segments").fetchone()
+        return {'files': files, 'segments': segments, 'postings': postings}
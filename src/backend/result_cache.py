@@ -0,0 +1,123 @@
+import os
+import gzip
+import time
+import pickle
+import hashlib
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger('result_cache')
+
+# Bump when the layout of a cache entry changes
+RESULT_CACHE_VERSION = 1
+
+
+def result_cache_key(archive_hash, pipeline_version):
+    return hashlib.sha256(f"{RESULT_CACHE_VERSION}:{archive_hash}:{pipeline_version}".encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """
+    Finished job reports kept on local disk, keyed by archive contents and pipeline version.
+
+    Entries older than ttl_seconds are dropped, and once the cache grows past max_bytes the least recently
+    used entries go first. Identical jobs running at the same time in this process are computed once:
+    the others wait for the first and then read its entry.
+    """
+
+    def __init__(self, directory, max_bytes, ttl_seconds):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.pkl.gz")
+
+    def get(self, key):
+        """Return the cached report, or None if there is no fresh entry."""
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl_seconds:
+                os.unlink(path)
+                return None
+            with open(path, 'rb') as f:
+                report = pickle.loads(gzip.decompress(f.read()))
+            # The modification time doubles as the last use, for LRU eviction
+            os.utime(path)
+            return report
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"Error reading cached result {key}: {e}")
+            return None
+
+    def put(self, key, report):
+        try:
+            data = gzip.compress(pickle.dumps(report, protocol=pickle.HIGHEST_PROTOCOL), compresslevel=1)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+            self.evict()
+        except Exception as e:
+            # A job never fails because its result couldn't be cached
+            logger.error(f"Error caching result {key}: {e}")
+
+    def evict(self):
+        """Drop expired entries, then the least recently used ones until the cache fits in max_bytes."""
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.pkl.gz'):
+                continue
+            try:
+                stat = entry.stat()
+                if now - stat.st_mtime > self.ttl_seconds:
+                    os.unlink(entry.path)
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            except FileNotFoundError:
+                pass
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def get_or_compute(self, key, compute):
+        """
+        Return (report, hit). On a miss the report is computed and cached; if the same key is already
+        being computed, wait for that instead of computing it again.
+        """
+        with self._lock:
+            done = self._inflight.get(key)
+            owner = done is None
+            if owner:
+                done = self._inflight[key] = threading.Event()
+        if not owner:
+            done.wait()
+            report = self.get(key)
+            if report is not None:
+                return report, True
+            # The first job failed, try again ourselves
+            return compute(), False
+
+        try:
+            report = self.get(key)
+            if report is not None:
+                return report, True
+            report = compute()
+            self.put(key, report)
+            return report, False
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            done.set()
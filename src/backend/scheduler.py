@@ -0,0 +1,205 @@
+import time
+import zipfile
+import logging
+import itertools
+import threading
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Optional
+from controller.job_cost import JobCost, archive_cost, estimate_job_cost
+
+logger = logging.getLogger('scheduler')
+
+# Bytes read from the end of an archive to find its central directory; a larger directory takes a second read
+CENTRAL_DIRECTORY_READ_BYTES = 256 * 1024
+# Used to estimate a job from its archive size when the central directory can't be read
+AVG_COMPRESSED_FILE_BYTES = 600
+COMPRESSION_RATIO = 3
+
+
+class _OutsideTail(Exception):
+    def __init__(self, position):
+        super().__init__(position)
+        self.position = position
+
+
+class _ArchiveTail:
+    """
+    The last bytes of an archive, seekable at their real offsets, so zipfile can list the members
+    without the rest of the file. Reading anything before the tail raises _OutsideTail.
+    """
+
+    def __init__(self, data, offset, size):
+        self.data = data
+        self.offset = offset
+        self.size = size
+        self.position = 0
+
+    def seek(self, offset, whence=0):
+        base = {0: 0, 1: self.position, 2: self.size}[whence]
+        self.position = base + offset
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def read(self, n=-1):
+        if self.position < self.offset:
+            raise _OutsideTail(self.position)
+        start = self.position - self.offset
+        chunk = self.data[start:] if n is None or n < 0 else self.data[start:start + n]
+        self.position += len(chunk)
+        return chunk
+
+
+def read_central_directory(blob_store, key, size) -> list[zipfile.ZipInfo]:
+    """List an archive's members with ranged reads of its end, without downloading or extracting it."""
+    start = max(0, size - CENTRAL_DIRECTORY_READ_BYTES)
+    for _ in range(2):
+        tail = blob_store.get_range(key, start, size)
+        try:
+            with zipfile.ZipFile(_ArchiveTail(tail, start, size)) as zf:
+                return zf.infolist()
+        except _OutsideTail as e:
+            # The directory starts before what we read, fetch it all
+            start = e.position
+    raise zipfile.BadZipFile("Central directory not found")
+
+
+def estimate_archive_cost(blob_store, key, block_rows) -> JobCost:
+    """
+    Estimate a queued job from its archive's central directory, falling back to the archive size.
+    """
+    size = 0
+    try:
+        size = blob_store.size(key)
+        return archive_cost(read_central_directory(blob_store, key, size), block_rows)
+    except Exception as e:
+        # Broken or missing archives are reported by the job itself, it just gets a cruder estimate
+        logger.warning(f"Estimating {key} from its size: {e}")
+        return estimate_job_cost(size / AVG_COMPRESSED_FILE_BYTES, size * COMPRESSION_RATIO, block_rows)
+
+
+@dataclass
+class ScheduledJob:
+    """
+    A received message waiting for, or holding, one of the worker's job slots.
+    """
+    message: dict
+    job_id: str
+    user: str
+    cost: JobCost
+    # 'job', or 'tile' for a block of a sharded job's pairs
+    kind: str = 'job'
+    # Whatever the caller needs to keep with the job, e.g. its visibility heartbeat
+    context: Any = None
+    received: float = field(default_factory=time.monotonic)
+    seq: int = 0
+    small: bool = False
+    # Set when the job is started: whether it is scored in blocks, and the memory it is admitted with
+    blocked: bool = False
+    memory_mb: float = 0.0
+
+
+class JobScheduler:
+    """
+    Decides which received job starts next on a worker with a fixed number of job slots.
+
+    Small jobs (at most small_pairs file pairs) may take any free slot, while large ones are limited to all
+    but fast_lane_slots of them, so a big archive never keeps small ones waiting behind it. Among the jobs
+    that may start, users with fewer running jobs and less work served since they last had nothing queued
+    go first, then arrival order.
+
+    A job starts only while the memory estimates of the running jobs fit in memory_mb. A job that wouldn't
+    fit even on its own is scored in blocks instead, and if that still doesn't fit it starts once nothing
+    else is running. A job that has waited max_wait_seconds goes first and holds back every later job
+    until it can start, so large jobs are never starved by a stream of small ones.
+    """
+
+    def __init__(self, slots, memory_mb, fast_lane_slots=1, small_pairs=5000, max_wait_seconds=600):
+        self.large_slots = max(1, slots - fast_lane_slots)
+        self.memory_mb = memory_mb
+        self.small_pairs = small_pairs
+        self.max_wait_seconds = max_wait_seconds
+        self._waiting: list[ScheduledJob] = []
+        self._running: list[ScheduledJob] = []
+        self._served = defaultdict(float)
+        self._seq = itertools.count()
+        self._condition = threading.Condition()
+
+    def add(self, job: ScheduledJob) -> None:
+        with self._condition:
+            job.seq = next(self._seq)
+            job.small = job.cost.pairs <= self.small_pairs
+            self._waiting.append(job)
+            self._condition.notify_all()
+
+    def waiting(self) -> int:
+        with self._condition:
+            return len(self._waiting)
+
+    def running(self) -> int:
+        with self._condition:
+            return len(self._running)
+
+    def idle(self) -> bool:
+        with self._condition:
+            return not self._waiting and not self._running
+
+    def _admission(self, job):
+        """(blocked, memory_mb) the job would start with."""
+        if job.cost.memory_mb <= self.memory_mb:
+            return False, job.cost.memory_mb
+        return True, job.cost.block_memory_mb
+
+    def _can_start(self, job, in_use, large_running):
+        if not job.small and large_running >= self.large_slots:
+            return False
+        return in_use == 0 or in_use + self._admission(job)[1] <= self.memory_mb
+
+    def _pick(self) -> Optional[ScheduledJob]:
+        if not self._waiting:
+            return None
+        in_use = sum(job.memory_mb for job in self._running)
+        large_running = sum(1 for job in self._running if not job.small)
+
+        now = time.monotonic()
+        overdue = [job for job in self._waiting if now - job.received >= self.max_wait_seconds]
+        if overdue:
+            oldest = min(overdue, key=lambda job: job.seq)
+            return oldest if self._can_start(oldest, in_use, large_running) else None
+
+        running_by_user = Counter(job.user for job in self._running)
+        ranked = sorted(
+            self._waiting,
+            key=lambda job: (not job.small, running_by_user[job.user], self._served[job.user], job.seq)
+        )
+        return next((job for job in ranked if self._can_start(job, in_use, large_running)), None)
+
+    def next(self, cancelled: threading.Event) -> Optional[ScheduledJob]:
+        """Wait until a job may start and return it, or None once cancelled is set."""
+        with self._condition:
+            while not cancelled.is_set():
+                job = self._pick()
+                if job is not None:
+                    self._waiting.remove(job)
+                    job.blocked, job.memory_mb = self._admission(job)
+                    self._running.append(job)
+                    self._served[job.user] += job.cost.seconds
+                    return job
+                # Overdue jobs are only noticed on a timeout, everything else on notify
+                self._condition.wait(timeout=1)
+            return None
+
+    def finish(self, job: ScheduledJob) -> None:
+        with self._condition:
+            self._running.remove(job)
+            if not any(other.user == job.user for other in self._waiting + self._running):
+                self._served.pop(job.user, None)
+            self._condition.notify_all()
+
+    def drain(self) -> list[ScheduledJob]:
+        """Remove and return every job that hasn't started."""
+        with self._condition:
+            jobs, self._waiting = self._waiting, []
+            return jobs
@@ -0,0 +1,205 @@
+import os
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+import contextlib
+import numpy as np
+from abc import ABC, abstractmethod
+
+try:
+    import fcntl
+except ImportError:
+    # Not Unix: maintenance is only kept apart within this process
+    fcntl = None
+
+logger = logging.getLogger('segment_store')
+
+# Segment files the catalog doesn't know (from a process that died mid-write) are deleted after this many seconds
+ORPHAN_SECONDS = 3600
+# Corpus file ids looked up per catalog query, well below SQLite's limit on bound parameters
+CATALOG_BATCH = 500
+
+# Files of deleted jobs whose entries are still in segments, until maintenance rewrites those segments
+REMOVED_SCHEMA = """
+CREATE TABLE IF NOT EXISTS removed (
+    id INTEGER PRIMARY KEY
+);
+"""
+
+
+class SegmentStore(ABC):
+    """
+    Base of the corpus indexes (see reference_index.py and embedding_index.py): immutable segments of numpy
+    arrays in a directory, and a SQLite catalog of the corpus files and the live segments.
+
+    A segment is a set of <name>.<part>.npy files, written under a temporary name and renamed, so readers can
+    memory-map any segment the catalog lists. Changing which segments are live is one catalog transaction;
+    files replaced by it are unlinked afterwards, and files no transaction ever listed are removed once they
+    are ORPHAN_SECONDS old. Several worker processes on one machine can share the directory: the catalog is in
+    WAL mode and maintenance() holds a file lock, so only one process at a time rewrites segments.
+
+    remove_job() takes a deleted job's files out of the catalog, so they stop matching at once; their entries
+    stay in the segments, listed in the removed table, until maintenance rewrites the segments holding them.
+
+    The corpus lives on one machine's local disk (SQLite's locking and flock are not reliable on network file
+    systems), so every worker that adds to or queries an index has to run on that machine.
+
+    Subclasses set NAME, VERSION, SCHEMA (with a files table of at least id, job_id, name and content_hash,
+    whose ids are never reused), FILE_COLUMNS returned by _corpus_files, SEGMENT_TABLES whose name columns
+    list the live segments, and implement maintain(), which runs in a background thread after every add()
+    or remove_job() that changed something.
+    """
+    NAME = 'segment store'
+    VERSION = 1
+    SCHEMA = ''
+    FILE_COLUMNS = ('job_id', 'name')
+    SEGMENT_TABLES = ('segments',)
+
+    def __init__(self, directory, params='', background_maintenance=True):
+        # Segments are only comparable when built with the same params
+        self.directory = os.path.join(directory, f"v{self.VERSION}{'-' + params if params else ''}")
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(self.directory, 'catalog.sqlite3'), timeout=30,
+                                   check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(self.SCHEMA + REMOVED_SCHEMA)
+        # Without it, callers run maintain() themselves
+        self.background_maintenance = background_maintenance
+        self._maintenance_wanted = threading.Event()
+        self._maintainer = None
+
+    def _path(self, name, part):
+        return os.path.join(self.directory, f"{name}.{part}.npy")
+
+    @staticmethod
+    def _new_name():
+        return f"{int(time.time() * 1000):013d}-{uuid.uuid4().hex[:8]}"
+
+    def _save(self, name, arrays: dict[str, np.ndarray]):
+        """Write a segment's parts. It is not read until the catalog lists it."""
+        for part, array in arrays.items():
+            path = self._path(name, part)
+            with open(f"{path}.partial", 'wb') as f:
+                np.save(f, array)
+            os.replace(f"{path}.partial", path)
+
+    def _unlink(self, names, parts):
+        # Queries that already mapped the files keep reading them until they finish
+        for name in names:
+            for part in parts:
+                os.unlink(self._path(name, part))
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """A write transaction on the catalog, rolled back if the block raises."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _corpus_files(self, file_ids) -> dict[int, tuple]:
+        """FILE_COLUMNS of the given corpus files, by id."""
+        found = {}
+        columns = ', '.join(self.FILE_COLUMNS)
+        with self._lock:
+            for start in range(0, len(file_ids), CATALOG_BATCH):
+                batch = file_ids[start:start + CATALOG_BATCH]
+                rows = self._db.execute(
+                    f"SELECT id, {columns} FROM files WHERE id IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                found.update((row[0], tuple(row[1:])) for row in rows)
+        return found
+
+    def remove_job(self, job_id) -> int:
+        """Take a deleted job's files out of the corpus. Returns the number of files removed."""
+        with self._transaction() as db:
+            db.execute("INSERT OR IGNORE INTO removed (id) SELECT id FROM files WHERE job_id = ?", (job_id,))
+            removed = db.execute("DELETE FROM files WHERE job_id = ?", (job_id,)).rowcount
+        if removed:
+            self._request_maintenance()
+        return removed
+
+    def _removed_ids(self) -> np.ndarray:
+        """Ids of removed files that segments may still hold."""
+        with self._lock:
+            rows = self._db.execute("SELECT id FROM removed").fetchall()
+        return np.array([file_id for file_id, in rows], dtype=np.int64)
+
+    @staticmethod
+    def _forget_removed(db, file_ids):
+        """Within a transaction that rewrote every segment holding them, drop file_ids from the removed table."""
+        file_ids = [int(file_id) for file_id in file_ids]
+        for start in range(0, len(file_ids), CATALOG_BATCH):
+            batch = file_ids[start:start + CATALOG_BATCH]
+            db.execute(f"DELETE FROM removed WHERE id IN ({','.join('?' * len(batch))})", batch)
+
+    def _job_file_ids(self, job_ids) -> np.ndarray:
+        """Ids of the corpus files stored for the given jobs."""
+        job_ids = list(job_ids)
+        if not job_ids:
+            return np.zeros(0, dtype=np.int64)
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT id FROM files WHERE job_id IN ({','.join('?' * len(job_ids))})", job_ids
+            ).fetchall()
+        return np.array([file_id for file_id, in rows], dtype=np.int64)
+
+    def _request_maintenance(self):
+        if not self.background_maintenance:
+            return
+        self._maintenance_wanted.set()
+        with self._lock:
+            if self._maintainer is None:
+                self._maintainer = threading.Thread(
+                    target=self._run_maintenance, name=f"{self.NAME.replace(' ', '-')}-maintenance", daemon=True
+                )
+                self._maintainer.start()
+
+    def _run_maintenance(self):
+        while True:
+            self._maintenance_wanted.wait()
+            self._maintenance_wanted.clear()
+            try:
+                self.maintain()
+            except Exception as e:
+                logger.error(f"Error maintaining the {self.NAME}: {e}")
+
+    @abstractmethod
+    def maintain(self):
+        """Rewrite segments to keep queries fast. Another process's maintenance in progress is not waited for."""
+        pass
+
+    @contextlib.contextmanager
+    def _maintenance_lock(self):
+        """
+        Hold the directory's maintenance lock, if no other process does. Yields whether it was acquired;
+        orphaned segment files are removed before it is released.
+        """
+        with open(os.path.join(self.directory, 'maintenance.lock'), 'w') as lock_file:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    yield False
+                    return
+            yield True
+            self._remove_orphans()
+
+    def _remove_orphans(self):
+        live = set()
+        with self._lock:
+            for table in self.SEGMENT_TABLES:
+                live.update(name for name, in self._db.execute(f"SELECT name FROM {table}"))
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(('.npy', '.partial')) or entry.name.split('.')[0] in live:
+                continue
+            if now - entry.stat().st_mtime > ORPHAN_SECONDS:
+                os.unlink(entry.path)
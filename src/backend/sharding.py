@@ -0,0 +1,223 @@
+import io
+import time
+import logging
+import threading
+import numpy as np
+from controller.algorithms.v1_sim_score import basic_weighting, feed_head_model
+from controller.algorithms.job_artifacts import JobArtifacts
+from controller.algorithms.similarity_matrix import SimilarityReport
+from controller.progress import ProgressTracker
+
+logger = logging.getLogger('sharding')
+
+# Seconds between checks for tiles scored by other workers
+POLL_INTERVAL = 1.0
+
+CHANNELS = ('token_sim', 'ast_sim', 'embed_sim')
+
+
+def plan_tiles(n, block_files) -> list[tuple[int, int, int, int]]:
+    """
+    Split the upper triangle of an n x n pair matrix into (row_start, row_stop, col_start, col_stop) tiles
+    of block_files x block_files files.
+    """
+    starts = range(0, n, block_files)
+    return [(r, min(r + block_files, n), c, min(c + block_files, n)) for r in starts for c in starts if c >= r]
+
+
+def tile_pairs(tile) -> int:
+    row_start, row_stop, col_start, col_stop = tile
+    if row_start == col_start:
+        size = row_stop - row_start
+        return size * (size - 1) // 2
+    return (row_stop - row_start) * (col_stop - col_start)
+
+
+def shard_prefix(job_id):
+    return f"shards/{job_id}/"
+
+
+def shard_artifacts_key(job_id):
+    return f"shards/{job_id}/artifacts.pkl.gz"
+
+
+def tile_key(job_id, index):
+    return f"shards/{job_id}/tile-{index}.npz"
+
+
+def claim_key(job_id, index):
+    return f"shards/{job_id}/tile-{index}.claim"
+
+
+def done_key(job_id, index):
+    # Tiles the coordinator scored itself are marked done instead of uploaded
+    return f"shards/{job_id}/tile-{index}.done"
+
+
+def pack_tile(tile: dict[str, np.ndarray]) -> bytes:
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **tile)
+    return buffer.getvalue()
+
+
+def unpack_tile(data: bytes) -> dict[str, np.ndarray]:
+    with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+        return {channel: npz[channel] for channel in CHANNELS}
+
+
+def _claimed_at(store, job_id, index):
+    try:
+        return float(store.get(claim_key(job_id, index)))
+    except KeyError:
+        return None
+
+
+def _claim(store, job_id, index):
+    store.put(claim_key(job_id, index), io.BytesIO(str(time.time()).encode('utf-8')))
+
+
+def _score_tile(artifacts, tile):
+    row_start, row_stop, col_start, col_stop = tile
+    return feed_head_model().score_tile(artifacts, range(row_start, row_stop), range(col_start, col_stop))
+
+
+# Every tile of a job needs the same artifacts, the last job's are kept once per worker process
+_cached_artifacts = {}
+_cache_lock = threading.Lock()
+
+
+def _exists(store, key) -> bool:
+    try:
+        store.size(key)
+        return True
+    except KeyError:
+        return False
+
+
+def _load_artifacts(store, job_id):
+    with _cache_lock:
+        if job_id not in _cached_artifacts:
+            artifacts = JobArtifacts.from_bytes(store.get(shard_artifacts_key(job_id)))
+            _cached_artifacts.clear()
+            _cached_artifacts[job_id] = artifacts
+        return _cached_artifacts[job_id]
+
+
+def release_finished_artifacts(store):
+    """Drop the cached artifacts of a job whose coordinator has finished (its artifacts are deleted)."""
+    with _cache_lock:
+        finished = [job_id for job_id in _cached_artifacts if not _exists(store, shard_artifacts_key(job_id))]
+        for job_id in finished:
+            del _cached_artifacts[job_id]
+
+
+def run_tile_task(body, store, claim_timeout) -> bool:
+    """
+    Score one tile of a sharded job and store it for the coordinator. Returns False if the tile was
+    skipped: already scored, being scored elsewhere, or its job is no longer running.
+    """
+    job_id, index = body['jobId'], body['tile']
+    if _exists(store, tile_key(job_id, index)) or _exists(store, done_key(job_id, index)):
+        return False
+    claimed_at = _claimed_at(store, job_id, index)
+    if claimed_at is not None and time.time() - claimed_at < claim_timeout:
+        return False
+    # The coordinator deletes the artifacts once it has every tile
+    if not _exists(store, shard_artifacts_key(job_id)):
+        logger.info(f"Dropping tile {index} of finished job {job_id}")
+        release_finished_artifacts(store)
+        return False
+
+    _claim(store, job_id, index)
+    artifacts = _load_artifacts(store, job_id)
+    store.put(tile_key(job_id, index), io.BytesIO(pack_tile(_score_tile(artifacts, body['bounds']))))
+    if not _exists(store, shard_artifacts_key(job_id)):
+        # The job finished while this tile was scored, and its keys may already be cleaned up
+        store.delete(tile_key(job_id, index))
+        store.delete(claim_key(job_id, index))
+        release_finished_artifacts(store)
+        logger.info(f"Discarded tile {index} of finished job {job_id}")
+        return False
+    logger.info(f"Scored tile {index} of job {job_id}")
+    return True
+
+
+def run_sharded_job(job_id, files, store, queue, block_files, claim_timeout, progress: ProgressTracker = None,
+                    file_cache=None, user=None, profile='full') -> SimilarityReport:
+    """
+    Run a job as the coordinator of a sharded computation.
+
+    The per-file artifacts are computed here once and stored, the pair matrices are split into tiles, and
+    one task per tile goes on the job queue for any worker to score. The coordinator scores tiles as well,
+    from the last one backwards while the other workers start from the front, so the job finishes even
+    when no other worker is free. Tiles claimed by a worker that stops responding for claim_timeout seconds
+    are scored here instead. Once every tile is merged the head model runs as for any other job.
+    """
+    progress = progress or ProgressTracker()
+    n = len(files)
+    pairs = n * (n - 1) // 2
+    progress.set_pairs_total(pairs)
+    progress.set_total('token', n + pairs)
+    progress.set_total('ast', n + 1)
+    progress.set_total('embed', n + 1)
+
+    nlp = feed_head_model()
+    artifacts = nlp.index_files(files, progress, file_cache, profile)
+    store.put(shard_artifacts_key(job_id), io.BytesIO(artifacts.to_bytes()))
+
+    tiles = plan_tiles(n, block_files)
+    source_bytes = sum(len(content) for _, content in files)
+    for index, tile in enumerate(tiles):
+        queue.send({
+            'type': 'tile',
+            'taskId': f"{job_id}-tile-{index}",
+            'jobId': job_id,
+            'auth0Id': user,
+            'tile': index,
+            'bounds': list(tile),
+            'files': n,
+            'sourceBytes': source_bytes,
+            'pairs': tile_pairs(tile),
+        })
+    logger.info(f"Job {job_id}: {n} files split into {len(tiles)} tiles")
+
+    matrices = artifacts.matrices
+    pending = list(range(len(tiles)))
+    scored_here = 0
+    with progress.timed('tiles'):
+        while pending:
+            waiting = []
+            for index in reversed(pending):
+                try:
+                    tile = unpack_tile(store.get(tile_key(job_id, index)))
+                except KeyError:
+                    claimed_at = _claimed_at(store, job_id, index)
+                    if claimed_at is not None and time.time() - claimed_at < claim_timeout:
+                        waiting.append(index)
+                        continue
+                    _claim(store, job_id, index)
+                    tile = _score_tile(artifacts, tiles[index])
+                    # So queued tasks for this tile are skipped instead of scoring it again
+                    store.put(done_key(job_id, index), io.BytesIO(b''))
+                    scored_here += 1
+
+                row_start, row_stop, col_start, col_stop = tiles[index]
+                for channel in CHANNELS:
+                    matrix = getattr(matrices, channel)
+                    matrix[row_start:row_stop, col_start:col_stop] = tile[channel]
+                    matrix[col_start:col_stop, row_start:row_stop] = tile[channel].T
+                scored = tile_pairs(tiles[index])
+                progress.advance('token', scored, pairs=scored)
+            pending = sorted(waiting)
+            if pending:
+                time.sleep(POLL_INTERVAL)
+
+    for stage in ('token', 'ast', 'embed'):
+        progress.finish(stage)
+    logger.info(f"Job {job_id}: scored {scored_here} of {len(tiles)} tiles on the coordinator")
+
+    # Late tasks find the artifacts gone and are dropped, or remove the tile they were writing
+    store.delete(shard_artifacts_key(job_id))
+    store.delete_prefix(shard_prefix(job_id))
+
+    return basic_weighting().report(files, artifacts, progress)
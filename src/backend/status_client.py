@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import heapq
+import random
+import logging
+import threading
+import requests
+from collections import deque
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger('status_client')
+
+# Statuses whose updates are kept for replay if they can't be delivered
+FINAL_STATUSES = ('completed', 'failed')
+RETRYABLE_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+
+class StatusClient:
+    """
+    Sends job status and result updates to the Express API.
+
+    Updates are queued per job and posted by pool_size background threads over a pooled session, so callers
+    never wait on the network. A job's updates are posted one at a time in the order they were sent, while
+    different jobs' updates go out in parallel. A status update that fails is retried with exponential backoff;
+    its job waits for the retry to come due without holding a sender, so a job whose updates keep failing never
+    delays the others. Progress updates are best effort and dropped once a newer update for their job is queued.
+    Final updates that still can't be delivered are written to spool_dir and replayed on the next start.
+    """
+
+    def __init__(self, base_url, spool_dir, timeout=(3.05, 30), max_retries=5, backoff=1.0, pool_size=4):
+        self.url = f"{base_url}/results/update"
+        self.spool_dir = spool_dir
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        # A job with undelivered updates is in exactly one of: ready, retries, or being posted by a sender
+        self._condition = threading.Condition()
+        self._pending = {}
+        self._ready = deque()
+        self._retries = []
+        self._attempts = {}
+        self._closing = False
+        self._senders = [
+            threading.Thread(target=self._run, name=f"status-sender-{i}", daemon=True) for i in range(pool_size)
+        ]
+        for sender in self._senders:
+            sender.start()
+
+    def send(self, payload):
+        """Queue an update and return immediately."""
+        with self._condition:
+            updates = self._pending.setdefault(payload['jobId'], deque())
+            updates.append(payload)
+            if len(updates) == 1:
+                self._ready.append(payload['jobId'])
+                self._condition.notify()
+
+    def _post(self, payload):
+        """Post an update once. Returns whether the API accepted it, and whether a failure is worth retrying."""
+        try:
+            response = self.session.post(self.url, json=payload, timeout=self.timeout)
+            if response.status_code == 200:
+                return True, False
+            logger.error(f"Error updating job status: {response.status_code} {response.text}")
+            return False, response.status_code in RETRYABLE_STATUS_CODES
+        except requests.RequestException as e:
+            logger.error(f"Error updating job status: {e}")
+            return False, True
+
+    def _next_job(self):
+        """Wait for a job whose oldest update can be posted now. None once closing and nothing is left."""
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                while self._retries and self._retries[0][0] <= now:
+                    self._ready.append(heapq.heappop(self._retries)[1])
+                if self._ready:
+                    return self._ready.popleft()
+                if self._closing and not self._pending:
+                    return None
+                self._condition.wait(self._retries[0][0] - now if self._retries else None)
+
+    def _run(self):
+        while (job_id := self._next_job()) is not None:
+            with self._condition:
+                updates = self._pending[job_id]
+                # A progress update superseded by a newer update for the same job isn't worth sending
+                while len(updates) > 1 and 'progress' in updates[0]:
+                    updates.popleft()
+                payload = updates[0]
+            retry = False
+            try:
+                delivered, retryable = self._post(payload)
+                if not delivered and 'progress' not in payload:
+                    retry = retryable and self._attempts.get(job_id, 0) < self.max_retries
+                    if not retry and payload['status'] in FINAL_STATUSES:
+                        self._spool(payload)
+            except Exception as e:
+                logger.error(f"Error sending job update: {e}")
+            with self._condition:
+                if retry:
+                    attempt = self._attempts.get(job_id, 0)
+                    self._attempts[job_id] = attempt + 1
+                    due = time.monotonic() + self.backoff * 2 ** attempt * (0.5 + random.random())
+                    heapq.heappush(self._retries, (due, job_id))
+                    # Senders waiting for the next retry may now wait less
+                    self._condition.notify_all()
+                    continue
+                self._attempts.pop(job_id, None)
+                updates.popleft()
+                if updates:
+                    self._ready.append(job_id)
+                    self._condition.notify()
+                else:
+                    del self._pending[job_id]
+                    if self._closing and not self._pending:
+                        self._condition.notify_all()
+
+    def _spool(self, payload):
+        """Persist an undeliverable update so it can be replayed later."""
+        try:
+            os.makedirs(self.spool_dir, exist_ok=True)
+            path = os.path.join(self.spool_dir, f"{payload['jobId']}-{payload['status']}.json")
+            with open(path, 'w') as f:
+                json.dump(payload, f)
+            logger.error(f"Could not deliver {payload['status']} update for job {payload['jobId']}, saved to {path}")
+        except Exception as e:
+            logger.error(f"Error saving undelivered update: {e}")
+
+    def replay(self):
+        """Queue every spooled update again, removing it from the spool."""
+        if not os.path.isdir(self.spool_dir):
+            return
+        for name in sorted(os.listdir(self.spool_dir)):
+            path = os.path.join(self.spool_dir, name)
+            try:
+                with open(path) as f:
+                    payload = json.load(f)
+                os.unlink(path)
+            except Exception as e:
+                logger.error(f"Error reading undelivered update {path}: {e}")
+                continue
+            logger.info(f"Replaying {payload['status']} update for job {payload['jobId']}")
+            self.send(payload)
+
+    def close(self):
+        """Deliver (or spool) everything still queued, then stop the senders."""
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+        for sender in self._senders:
+            sender.join()
+        self.session.close()
+
+
+class LocalStatusSink:
+    """
+    Stand-in for StatusClient that writes final job updates to a directory instead of the Express API,
+    for running workers offline. Progress updates are dropped.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def send(self, payload):
+        if payload['status'] not in FINAL_STATUSES:
+            return
+        path = os.path.join(self.directory, f"{payload['jobId']}.json")
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(payload, f)
+        os.replace(f"{path}.tmp", path)
+
+    def replay(self):
+        pass
+
+    def close(self):
+        pass
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Modules import each other from src/backend, as when the worker runs there
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
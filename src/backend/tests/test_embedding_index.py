@@ -0,0 +1,127 @@
+import os
+import time
+import numpy as np
+import pytest
+import embedding_index
+from embedding_index import EmbeddingIndex, normalize_rows
+
+DIMENSIONS = 32
+JOBS = 6
+FILES_PER_JOB = 100
+TOP_K = 5
+
+
+def sample(rng, files):
+    """Embeddings clustered around a few directions, like those of files solving the same tasks."""
+    centers = np.random.default_rng(0).normal(size=(12, DIMENSIONS))
+    return centers[rng.integers(0, len(centers), files)] + 0.3 * rng.normal(size=(files, DIMENSIONS))
+
+
+@pytest.fixture(scope='module')
+def jobs():
+    rng = np.random.default_rng(1)
+    return [(f"job{j}", sample(rng, FILES_PER_JOB)) for j in range(JOBS)]
+
+
+def fill(directory, jobs):
+    index = EmbeddingIndex(directory, background_maintenance=False)
+    for job_id, embeddings in jobs:
+        names = [f"{job_id}/{i}.py" for i in range(len(embeddings))]
+        index.add(job_id, names, names, embeddings)
+    return index
+
+
+def brute_force(jobs, queries, top_k):
+    """The top_k stored vectors by cosine for every query, as (ids, cosines); ids count from 1 in insertion order."""
+    vectors = normalize_rows(np.concatenate([embeddings for _, embeddings in jobs]))
+    cosines = normalize_rows(queries) @ vectors.T
+    order = np.argsort(-cosines, axis=1, kind='stable')[:, :top_k]
+    return order + 1, np.take_along_axis(cosines, order, axis=1)
+
+
+def matched_files(matches):
+    return {name: [(m['job_id'], m['file']) for m in found] for name, found in matches.items()}
+
+
+@pytest.fixture
+def queries():
+    return sample(np.random.default_rng(2), 40)
+
+
+def test_search_before_clustering_is_exact(tmp_path, jobs, queries):
+    index = fill(str(tmp_path), jobs)
+    assert index.stats()['lists'] == 0
+    ids, cosines = index.search(queries, TOP_K)
+    expected_ids, expected_cosines = brute_force(jobs, queries, TOP_K)
+    np.testing.assert_array_equal(ids, expected_ids)
+    np.testing.assert_allclose(cosines, expected_cosines, atol=1e-5)
+
+
+def test_search_after_clustering(tmp_path, monkeypatch, jobs, queries):
+    monkeypatch.setattr(embedding_index, 'MIN_TRAIN', 256)
+    index = fill(str(tmp_path), jobs[:3])
+    assert index.maintain()
+    # Added after the clustering: filed under the current centroids
+    for job_id, embeddings in jobs[3:]:
+        names = [f"{job_id}/{i}.py" for i in range(len(embeddings))]
+        index.add(job_id, names, names, embeddings)
+    stats = index.stats()
+    assert stats['lists'] > 1 and stats['chunks'] == 1 + JOBS - 3
+
+    expected_ids, expected_cosines = brute_force(jobs, queries, TOP_K)
+    for ids, cosines in (index.search(queries, TOP_K, exhaustive=True), index.search(queries, TOP_K, nprobe=stats['lists'])):
+        np.testing.assert_array_equal(ids, expected_ids)
+        np.testing.assert_allclose(cosines, expected_cosines, atol=1e-5)
+
+    found, _ = index.search(queries, TOP_K, nprobe=3)
+    recall = np.mean([len(set(f) & set(e)) / TOP_K for f, e in zip(found.tolist(), expected_ids.tolist())])
+    assert recall >= 0.9
+
+
+def test_query_filters_by_cosine_and_job(tmp_path, jobs):
+    index = fill(str(tmp_path), jobs)
+    # Near copies of job0's first files
+    queries = jobs[0][1][:10] + 0.01 * np.random.default_rng(3).normal(size=(10, DIMENSIONS))
+    names = [f"q{i}.py" for i in range(len(queries))]
+
+    matches = index.query(names, queries, top_k=3, min_cosine=0.99)
+    for i, name in enumerate(names):
+        assert (matches[name][0]['job_id'], matches[name][0]['file']) == ('job0', f"job0/{i}.py")
+    assert all(m['cosine'] >= 0.99 for found in matches.values() for m in found)
+
+    excluded = index.query(names, queries, top_k=3, min_cosine=0.5, exclude_jobs={'job0'})
+    assert excluded and all(m['job_id'] != 'job0' for found in excluded.values() for m in found)
+    # Excluded files don't take up any of the top_k
+    without = fill(str(tmp_path / 'without'), jobs[1:]).query(names, queries, top_k=3, min_cosine=0.5)
+    assert matched_files(excluded) == matched_files(without)
+
+
+def test_maintenance_removes_orphaned_segment_files(tmp_path, jobs):
+    index = fill(str(tmp_path), jobs[:1])
+    orphan = os.path.join(index.directory, 'dead.vectors.npy.partial')
+    recent = os.path.join(index.directory, 'recent.vectors.npy.partial')
+    for path in (orphan, recent):
+        open(path, 'wb').close()
+    os.utime(orphan, (time.time() - 7200, time.time() - 7200))
+    index.maintain()
+    assert not os.path.exists(orphan) and os.path.exists(recent)
+    assert index.stats()['files'] == FILES_PER_JOB
+
+
+def test_removed_jobs_stop_matching(tmp_path, jobs, queries):
+    index = fill(str(tmp_path), jobs)
+    names = [f"q{i}.py" for i in range(len(queries))]
+    without = fill(str(tmp_path / 'without'), jobs[1:]).query(names, queries, top_k=3, min_cosine=0.5)
+
+    assert index.remove_job('job0') == FILES_PER_JOB
+    # Searched until maintenance, but never returned
+    assert matched_files(index.query(names, queries, top_k=3, min_cosine=0.5)) == matched_files(without)
+
+    assert index.maintain()
+    assert index.stats()['vectors'] == (JOBS - 1) * FILES_PER_JOB and index._removed_ids().size == 0
+    assert matched_files(index.query(names, queries, top_k=3, min_cosine=0.5)) == matched_files(without)
+
+    # Not due for clustering: only the chunk holding the removed files is rewritten
+    index.remove_job('job1')
+    assert index.maintain()
+    assert index.stats()['vectors'] == (JOBS - 2) * FILES_PER_JOB and index._removed_ids().size == 0
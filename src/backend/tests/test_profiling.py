@@ -0,0 +1,41 @@
+import threading
+from profiling import JobProfiler
+
+
+def busy(n):
+    return sum(i * i for i in range(n))
+
+
+def test_one_full_profile_at_a_time():
+    first = JobProfiler('full').start()
+    # Another job's profiler, started while the first one runs
+    second = []
+    thread = threading.Thread(target=lambda: second.append(JobProfiler('full').start()))
+    thread.start()
+    thread.join()
+    second = second[0]
+    assert (first.mode, second.mode, second.requested_mode) == ('full', 'sample', 'full')
+
+    first.enter('token')
+    busy(10000)
+    first.exit('token')
+    first.stop()
+    second.stop()
+    assert 'token.pstats' in first.files() and 'stacks.folded' in second.files()
+
+    # Free again once the first job stopped
+    third = JobProfiler('full').start()
+    assert third.mode == 'full'
+    third.stop()
+
+
+def test_stages_switch_only_on_the_creating_thread():
+    profiler = JobProfiler('sample').start()
+    thread = threading.Thread(target=profiler.enter, args=('embed',))
+    thread.start()
+    thread.join()
+    profiler.enter('token')
+    profiler.exit('token')
+    profiler.stop()
+    summary = profiler.files()['summary.txt'].decode()
+    assert 'token' in summary and 'embed' not in summary
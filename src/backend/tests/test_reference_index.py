@@ -0,0 +1,105 @@
+from collections import Counter
+import pytest
+import reference_index
+from benchmarks.corpus import load_dataset
+from controller.algorithms.tokenization import Tokenizer
+from controller.algorithms.v1_tok import TOKEN_K, TOKEN_W
+from reference_index import ReferenceIndex
+
+JOBS = 4
+FILES_PER_JOB = 20
+QUERY_FILES = 20
+# Low enough that the dataset's common fingerprints hit it, but only once summed over segments
+MAX_POSTINGS = 12
+
+
+@pytest.fixture(scope='module')
+def corpus():
+    files = load_dataset('p02405')[:JOBS * FILES_PER_JOB + QUERY_FILES]
+    fingerprints, _ = Tokenizer().index_files(dict(files), k=TOKEN_K, w=TOKEN_W)
+    return [(name, fingerprints[name][1]) for name, _ in files]
+
+
+def brute_force(jobs, query, top_k, min_score, exclude_jobs):
+    """ReferenceIndex.query's result, by comparing every query file with every corpus file."""
+    postings = Counter(fp.hash_val for _, files in jobs for _, fps in files for fp in fps.values())
+    common = {h for h, count in postings.items() if count > MAX_POSTINGS}
+    corpus = [(job_id, name, fps) for job_id, files in jobs if job_id not in exclude_jobs for name, fps in files]
+    matches = {}
+    for name, fps in query:
+        hashes = {fp.hash_val for fp in fps.values()} - common
+        found = []
+        for file_id, (job_id, corpus_name, corpus_fps) in enumerate(corpus):
+            shared = len(hashes & {fp.hash_val for fp in corpus_fps.values()})
+            score = shared / max(min(len(fps), len(corpus_fps)), 1)
+            if shared and score >= min_score:
+                found.append((-score, -shared, file_id, job_id, corpus_name, score))
+        if found:
+            matches[name] = [(job_id, corpus_name, score) for *_, job_id, corpus_name, score in sorted(found)[:top_k]]
+    return matches
+
+
+def matched_files(matches):
+    return {name: [(m['job_id'], m['file'], pytest.approx(m['score'])) for m in found] for name, found in matches.items()}
+
+
+def fill(directory, jobs):
+    index = ReferenceIndex(directory, background_maintenance=False)
+    for job_id, files in jobs:
+        index.add(job_id, [name for name, _ in files], [f"{job_id}/{name}" for name, _ in files], [fps for _, fps in files])
+    return index
+
+
+@pytest.mark.parametrize('merged', [False, True])
+def test_query_matches_brute_force(tmp_path, monkeypatch, corpus, merged):
+    monkeypatch.setattr(reference_index, 'MAX_POSTINGS', MAX_POSTINGS)
+    jobs = [(f"job{j}", corpus[j * FILES_PER_JOB:(j + 1) * FILES_PER_JOB]) for j in range(JOBS)]
+    query = corpus[JOBS * FILES_PER_JOB:]
+    index = fill(str(tmp_path), jobs)
+    assert index.stats()['segments'] == JOBS
+    if merged:
+        assert index.maintain(max_segments=1) > 0
+        assert index.stats()['segments'] == 1
+
+    matches = index.query([name for name, _ in query], [fps for _, fps in query], top_k=3, min_score=0.2, exclude_jobs={'job1'})
+    expected = brute_force(jobs, query, 3, 0.2, {'job1'})
+    assert expected
+    assert matched_files(matches) == expected
+
+    # Every listed position pair is a shared fingerprint
+    by_name = dict(corpus)
+    for name, found in matches.items():
+        for match in found:
+            for position, corpus_position in match['positions']:
+                assert by_name[name][position].hash_val == by_name[match['file']][corpus_position].hash_val
+
+
+def test_contents_are_stored_once(tmp_path, corpus):
+    index = ReferenceIndex(str(tmp_path), background_maintenance=False)
+    names, fingerprints = [name for name, _ in corpus[:5]], [fps for _, fps in corpus[:5]]
+    assert index.add('a', names, names, fingerprints) == 5
+    assert index.add('b', names, names, fingerprints) == 0
+    assert index.query(names, fingerprints, exclude_jobs={'a'}) == {}
+
+
+def test_removed_jobs_stop_matching(tmp_path, monkeypatch, corpus):
+    monkeypatch.setattr(reference_index, 'MAX_POSTINGS', MAX_POSTINGS)
+    jobs = [(f"job{j}", corpus[j * FILES_PER_JOB:(j + 1) * FILES_PER_JOB]) for j in range(JOBS)]
+    query = corpus[JOBS * FILES_PER_JOB:]
+    names, fingerprints = [name for name, _ in query], [fps for _, fps in query]
+    index = fill(str(tmp_path), jobs)
+    postings = index.stats()['postings']
+
+    assert index.remove_job('job1') == FILES_PER_JOB
+    # Gone from the results at once, its postings still count towards MAX_POSTINGS until maintenance
+    assert matched_files(index.query(names, fingerprints, top_k=3, min_score=0.2)) == brute_force(jobs, query, 3, 0.2, {'job1'})
+
+    assert index.maintain() == 1
+    remaining = [job for job in jobs if job[0] != 'job1']
+    assert index.stats()['postings'] < postings
+    assert index._removed_ids().size == 0
+    assert matched_files(index.query(names, fingerprints, top_k=3, min_score=0.2)) == brute_force(remaining, query, 3, 0.2, ())
+
+    # Its contents can be added again, under new ids
+    files = jobs[1][1]
+    assert index.add('job1', [name for name, _ in files], [f"job1/{name}" for name, _ in files], [fps for _, fps in files]) == FILES_PER_JOB
@@ -0,0 +1,103 @@
+import threading
+from controller.job_cost import JobCost
+from scheduler import JobScheduler, ScheduledJob
+
+
+def make_job(job_id, user, pairs=10, memory_mb=100.0, block_memory_mb=None, seconds=1.0):
+    cost = JobCost(files=0, source_bytes=0, tokens=0, pairs=pairs, memory_mb=memory_mb,
+                   block_memory_mb=memory_mb if block_memory_mb is None else block_memory_mb, seconds=seconds)
+    return ScheduledJob(message={}, job_id=job_id, user=user, cost=cost)
+
+
+def start(scheduler):
+    """The job the scheduler starts now, or None if none may start, without waiting."""
+    with scheduler._condition:
+        if scheduler._pick() is None:
+            return None
+    return scheduler.next(threading.Event())
+
+
+def test_users_with_fewer_running_jobs_go_first():
+    scheduler = JobScheduler(slots=4, memory_mb=10_000)
+    for i in range(3):
+        scheduler.add(make_job(f"a{i}", 'alice'))
+    scheduler.add(make_job('b0', 'bob'))
+
+    assert start(scheduler).job_id == 'a0'
+    # alice has a job running, so bob's later job overtakes her queued ones
+    assert start(scheduler).job_id == 'b0'
+    assert start(scheduler).job_id == 'a1'
+
+
+def test_work_served_breaks_ties_between_users():
+    scheduler = JobScheduler(slots=1, memory_mb=10_000, fast_lane_slots=0)
+    scheduler.add(make_job('a0', 'alice', seconds=100))
+    scheduler.add(make_job('a1', 'alice'))
+    first = start(scheduler)
+    scheduler.add(make_job('b0', 'bob'))
+    scheduler.finish(first)
+
+    # alice still has a job queued, so the work she was served still counts against her
+    assert start(scheduler).job_id == 'b0'
+
+
+def test_large_jobs_leave_the_fast_lane_free():
+    scheduler = JobScheduler(slots=2, memory_mb=10_000, fast_lane_slots=1, small_pairs=100)
+    scheduler.add(make_job('large0', 'alice', pairs=1000))
+    scheduler.add(make_job('large1', 'bob', pairs=1000))
+    assert start(scheduler).job_id == 'large0'
+    # The only slot left is the fast lane
+    assert start(scheduler) is None
+
+    scheduler.add(make_job('small', 'carol', pairs=10))
+    assert start(scheduler).job_id == 'small'
+
+
+def test_jobs_start_only_while_their_memory_fits():
+    scheduler = JobScheduler(slots=4, memory_mb=1000)
+    scheduler.add(make_job('a', 'alice', memory_mb=600))
+    scheduler.add(make_job('b', 'bob', memory_mb=600))
+    a = start(scheduler)
+    assert a.job_id == 'a' and not a.blocked
+    assert start(scheduler) is None
+
+    scheduler.finish(a)
+    assert start(scheduler).job_id == 'b'
+
+
+def test_jobs_too_large_for_memory_are_scored_in_blocks():
+    scheduler = JobScheduler(slots=2, memory_mb=1000)
+    scheduler.add(make_job('huge', 'alice', memory_mb=5000, block_memory_mb=800))
+    job = start(scheduler)
+    assert job.blocked and job.memory_mb == 800
+
+    # Even blocked it doesn't fit: it starts once nothing else runs
+    scheduler.add(make_job('small', 'bob', memory_mb=300))
+    scheduler.add(make_job('huger', 'carol', memory_mb=9000, block_memory_mb=2000))
+    assert start(scheduler) is None
+    scheduler.finish(job)
+    assert start(scheduler).job_id == 'small'
+
+
+def test_overdue_jobs_hold_back_later_ones():
+    scheduler = JobScheduler(slots=4, memory_mb=1000, max_wait_seconds=60)
+    scheduler.add(make_job('running', 'alice', memory_mb=600))
+    running = start(scheduler)
+    scheduler.add(make_job('old', 'bob', memory_mb=600))
+    scheduler.add(make_job('new', 'carol', memory_mb=100))
+    scheduler._waiting[0].received -= 120
+
+    # new would fit, but the overdue job goes first
+    assert start(scheduler) is None
+    scheduler.finish(running)
+    assert start(scheduler).job_id == 'old'
+    assert start(scheduler).job_id == 'new'
+
+
+def test_next_returns_none_once_cancelled():
+    scheduler = JobScheduler(slots=1, memory_mb=1000)
+    cancelled = threading.Event()
+    cancelled.set()
+    scheduler.add(make_job('a', 'alice'))
+    assert scheduler.next(cancelled) is None
+    assert [job.job_id for job in scheduler.drain()] == ['a']
@@ -0,0 +1,133 @@
+import io
+import os
+import json
+import time
+import threading
+import numpy as np
+import pytest
+import sharding
+from benchmarks.corpus import load_dataset
+from blob_store import LocalBlobStore
+from job_queue import LocalJobQueue
+from controller.algorithms.v1_sim_score import basic_weighting
+from sharding import run_sharded_job, run_tile_task, claim_key, CHANNELS
+
+FILES = 120
+BLOCK_FILES = 40
+# Long enough that the coordinator has to wait for a claimed tile before taking it over
+CLAIM_TIMEOUT = 2.0
+# Seconds the coordinator takes to claim a tile, so the other worker gets to tiles first
+CLAIM_DELAY = 0.5
+
+
+@pytest.fixture(scope='module')
+def files():
+    return load_dataset('p02405')[:FILES]
+
+
+@pytest.fixture(scope='module')
+def one_pass(files):
+    # The fast profile needs no CodeBERT
+    return basic_weighting().score(files, profile='fast')
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(sharding, 'POLL_INTERVAL', 0.05)
+
+
+class SlowClaims(LocalBlobStore):
+    """The coordinator's view of the store, for a coordinator busy with other jobs."""
+
+    def put(self, key, fileobj, **kwargs):
+        if key.endswith('.claim'):
+            time.sleep(CLAIM_DELAY)
+        super().put(key, fileobj, **kwargs)
+
+
+class Drainer(threading.Thread):
+    """A second worker: takes tile tasks off the queue and scores them until stopped."""
+
+    def __init__(self, store, queue):
+        super().__init__(daemon=True)
+        self.store = store
+        self.queue = queue
+        self.stopping = threading.Event()
+        self.scored = []
+
+    def run(self):
+        while not self.stopping.is_set():
+            for message in self.queue.receive(1, 0.05, 60):
+                body = json.loads(message['Body'])
+                if run_tile_task(body, self.store, CLAIM_TIMEOUT):
+                    self.scored.append(body['tile'])
+                self.queue.delete(message['ReceiptHandle'])
+
+    def stop(self):
+        self.stopping.set()
+        self.join()
+
+
+def shard_files(root, job_id) -> list[str]:
+    directory = os.path.join(root, 'shards', job_id)
+    return [name for _, _, names in os.walk(directory) for name in names]
+
+
+def assert_matches(report, one_pass):
+    for channel in CHANNELS:
+        np.testing.assert_allclose(getattr(report.matrices, channel), getattr(one_pass.matrices, channel), atol=1e-5)
+    np.testing.assert_allclose(report.similarity_score, one_pass.similarity_score, atol=1e-5)
+    assert [r['file'] for r in report.plagiarism_results] == [r['file'] for r in one_pass.plagiarism_results]
+    np.testing.assert_allclose(
+        [r['plagiarism_score'] for r in report.plagiarism_results],
+        [r['plagiarism_score'] for r in one_pass.plagiarism_results], atol=1e-5
+    )
+
+
+def test_tiles_scored_by_another_worker_match_a_one_pass_job(tmp_path, files, one_pass):
+    store, queue = LocalBlobStore(str(tmp_path / 'blobs')), LocalJobQueue(str(tmp_path / 'queue'))
+    drainer = Drainer(store, queue)
+    drainer.start()
+    try:
+        report = run_sharded_job(
+            'job', files, SlowClaims(str(tmp_path / 'blobs')), queue, BLOCK_FILES, CLAIM_TIMEOUT, profile='fast'
+        )
+    finally:
+        drainer.stop()
+
+    assert drainer.scored
+    assert_matches(report, one_pass)
+    # Tiles still being scored when the coordinator finished were discarded
+    assert shard_files(tmp_path / 'blobs', 'job') == []
+
+
+def test_coordinator_takes_over_a_tile_claimed_by_a_dead_worker(tmp_path, files, one_pass):
+    store, queue = LocalBlobStore(str(tmp_path / 'blobs')), LocalJobQueue(str(tmp_path / 'queue'))
+    # A worker claimed tile 0 and stopped responding
+    store.put(claim_key('job', 0), io.BytesIO(str(time.time()).encode('utf-8')))
+    drainer = Drainer(store, queue)
+    drainer.start()
+    started = time.monotonic()
+    try:
+        report = run_sharded_job('job', files, store, queue, BLOCK_FILES, CLAIM_TIMEOUT, profile='fast')
+    finally:
+        drainer.stop()
+
+    assert 0 not in drainer.scored
+    assert time.monotonic() - started >= CLAIM_TIMEOUT
+    assert_matches(report, one_pass)
+
+
+def test_late_tiles_after_the_coordinator_finished_are_dropped(tmp_path, files, one_pass):
+    store, queue = LocalBlobStore(str(tmp_path / 'blobs')), LocalJobQueue(str(tmp_path / 'queue'))
+    # No other worker: the coordinator scores every tile and the tasks are still queued when it finishes
+    report = run_sharded_job('job', files, store, queue, BLOCK_FILES, CLAIM_TIMEOUT, profile='fast')
+    assert_matches(report, one_pass)
+
+    messages = queue.receive(100, 0, 60)
+    assert len(messages) == len(sharding.plan_tiles(FILES, BLOCK_FILES))
+    for message in messages:
+        assert not run_tile_task(json.loads(message['Body']), store, CLAIM_TIMEOUT)
+        queue.delete(message['ReceiptHandle'])
+    assert shard_files(tmp_path / 'blobs', 'job') == []
+    assert sharding._cached_artifacts == {}
@@ -0,0 +1,72 @@
+import os
+import json
+import time
+import threading
+from status_client import StatusClient
+
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.text = ''
+
+
+class Session:
+    """Accepts every update except those of failing jobs, and records the order they arrived in."""
+
+    def __init__(self, failing=(), delay=0.0):
+        self.failing = set(failing)
+        self.delay = delay
+        self.posted = []
+        self.lock = threading.Lock()
+
+    def post(self, url, json, timeout):
+        time.sleep(self.delay)
+        with self.lock:
+            self.posted.append((json['jobId'], json['status'], json.get('n')))
+        return Response(503 if json['jobId'] in self.failing else 200)
+
+    def close(self):
+        pass
+
+
+def client(tmp_path, session, **options):
+    status_client = StatusClient('http://api', str(tmp_path / 'undelivered'), **options)
+    status_client.session = session
+    return status_client
+
+
+def test_a_failing_job_doesnt_hold_up_the_others(tmp_path):
+    session = Session(failing={'stuck'})
+    status_client = client(tmp_path, session, max_retries=3, backoff=0.2, pool_size=2)
+    status_client.send({'jobId': 'stuck', 'status': 'completed'})
+    started = time.monotonic()
+    for n in range(5):
+        status_client.send({'jobId': 'other', 'status': 'processing', 'n': n})
+    status_client.send({'jobId': 'other', 'status': 'completed'})
+
+    while ('other', 'completed', None) not in session.posted:
+        time.sleep(0.01)
+    # Well before the stuck job's retries (about 0.2 + 0.4 + 0.8 s) are done
+    assert time.monotonic() - started < 0.5
+    status_client.close()
+
+    # Delivered in the order sent, and the stuck job's final update spooled after every retry
+    assert [n for job_id, _, n in session.posted if job_id == 'other'] == [0, 1, 2, 3, 4, None]
+    assert sum(job_id == 'stuck' for job_id, _, _ in session.posted) == 4
+    with open(os.path.join(tmp_path, 'undelivered', 'stuck-completed.json')) as f:
+        assert json.load(f) == {'jobId': 'stuck', 'status': 'completed'}
+    assert not status_client._pending and not status_client._attempts
+
+
+def test_superseded_progress_updates_are_dropped(tmp_path):
+    session = Session(delay=0.05)
+    status_client = client(tmp_path, session, pool_size=1)
+    # The first update holds the only sender while the rest queue up behind it
+    status_client.send({'jobId': 'job', 'status': 'processing', 'progress': {}, 'n': 0})
+    time.sleep(0.01)
+    for n in range(1, 5):
+        status_client.send({'jobId': 'job', 'status': 'processing', 'progress': {}, 'n': n})
+    status_client.send({'jobId': 'job', 'status': 'completed'})
+    status_client.close()
+    assert session.posted == [('job', 'processing', 0), ('job', 'completed', None)]
@@ -0,0 +1,66 @@
+import dataclasses
+from itertools import combinations
+import numpy as np
+import pytest
+from benchmarks.corpus import load_dataset
+from controller.algorithms.tokenization import Tokenizer
+from controller.algorithms.v1_NLP import feed_head_model
+from controller.algorithms.v1_sim_score import basic_weighting
+
+FILES = 60
+# About the median weighted score of the slice, so half of the pairs are left out
+MIN_SCORE = 0.58
+
+
+@pytest.fixture(scope='module')
+def files():
+    return load_dataset('p02405')[:FILES]
+
+
+@pytest.fixture(scope='module')
+def full(files):
+    # The fast profile needs no CodeBERT
+    return feed_head_model().compute_artifacts(files, profile='fast')
+
+
+@pytest.fixture(scope='module')
+def reference(full):
+    """Token scores of score_pair, one pair at a time."""
+    tokenizer = Tokenizer()
+    fingerprints = dict(enumerate(zip(full.token_hashes, full.token_fingerprints)))
+    comments = dict(enumerate(full.comments))
+    scores = np.zeros((len(full), len(full)), dtype=np.float32)
+    for i, j in combinations(range(len(full)), 2):
+        scores[i, j] = scores[j, i] = tokenizer.score_pair(i, j, fingerprints, comments)[0]
+    return scores
+
+
+@pytest.mark.parametrize('block_rows', [None, 16])
+def test_score_pairs_match_score_pair(files, reference, block_rows):
+    artifacts = feed_head_model().compute_artifacts(files, profile='fast', block_rows=block_rows)
+    np.testing.assert_allclose(artifacts.matrices.token_sim, reference, atol=1e-6)
+
+
+def test_incremental_job_matches_score_pair(files, reference):
+    nlp = feed_head_model()
+    prior = nlp.compute_artifacts(files[:FILES // 2], profile='fast')
+    artifacts = nlp.compute_artifacts(files, prior=prior, profile='fast')
+    np.testing.assert_allclose(artifacts.matrices.token_sim, reference, atol=1e-6)
+
+
+@pytest.mark.parametrize('rows, cols', [(range(0, 25), range(0, 25)), (range(10, 35), range(20, 60))])
+def test_tiles_match_score_pair(full, reference, rows, cols):
+    tile = feed_head_model().score_tile(full, rows, cols)
+    np.testing.assert_allclose(tile['token_sim'], reference[rows.start:rows.stop, cols.start:cols.stop], atol=1e-6)
+
+
+def test_min_score_only_leaves_pairs_out_of_the_results(files, full):
+    report = basic_weighting().report(files, full)
+    filtered = dataclasses.replace(report, min_score=MIN_SCORE)
+    assert filtered.plagiarism_results == report.plagiarism_results
+
+    kept = [r for r in report.similarity_results() if r['similarity_score'] >= MIN_SCORE]
+    results = filtered.similarity_results()
+    assert results == kept
+    assert 0 < filtered.omitted_pair_count() == filtered.pair_count() - len(results)
+    assert filtered.summary()['omitted_pairs'] == filtered.omitted_pair_count()
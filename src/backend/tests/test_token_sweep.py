@@ -0,0 +1,43 @@
+from itertools import combinations
+import numpy as np
+import pytest
+from benchmarks.corpus import load_dataset
+from controller.algorithms.tokenization import Tokenizer
+from controller.algorithms.v1_tok import TOKEN_K, TOKEN_W
+from controller.token_sweep import token_similarity, best_accuracy, _shared_counts
+
+FILES = 40
+
+
+@pytest.fixture(scope='module')
+def files():
+    return load_dataset('p02405')[:FILES]
+
+
+@pytest.mark.parametrize('k, w', [(TOKEN_K, TOKEN_W), (3, 2), (8, 6)])
+def test_token_similarity_matches_score_pair(files, k, w):
+    tokenizer = Tokenizer()
+    fingerprints, comments = tokenizer.index_files(dict(files), k=k, w=w)
+    names = [name for name, _ in files]
+    expected = np.zeros((len(names), len(names)))
+    for i, j in combinations(range(len(names)), 2):
+        expected[i, j] = expected[j, i] = tokenizer.score_pair(names[i], names[j], fingerprints, comments)[0]
+
+    tokenized = [tokenizer._tokenize_file(content) for _, content in files]
+    winnowed = [
+        tokenizer.winnow_hashes(tokenizer.kgram_hash_arrays(tokenizer.token_values(tokens), [k])[k], w)
+        for tokens, _ in tokenized
+    ]
+    similarity = token_similarity(
+        [count for count, _ in winnowed], [hashes for _, hashes in winnowed],
+        _shared_counts([file_comments for _, file_comments in tokenized])
+    )
+    np.fill_diagonal(similarity, 0)
+    np.testing.assert_allclose(similarity, expected, atol=1e-9)
+
+
+def test_best_accuracy_picks_the_best_threshold():
+    labels = np.array([1, 1, 0, 0, 0])
+    assert best_accuracy(np.array([0.9, 0.8, 0.7, 0.3, 0.1]), labels) == (1.0, 0.8)
+    # Equal scores are flagged together: flagging the tie at 0.8 is no better than flagging nothing
+    assert best_accuracy(np.array([0.8, 0.8, 0.1]), np.array([1, 0, 0])) == (2 / 3, float('inf'))
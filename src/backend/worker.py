@@ -1,15 +1,37 @@
 import os
+import io
 import json
 import time
-import tempfile
-import zipfile
+import signal
 import logging
-import requests
-import boto3
+import argparse
+import threading
+import dataclasses
+from concurrent.futures import ThreadPoolExecutor
 import gzip
 import base64
 from dotenv import load_dotenv
-from controller.v1_report_generation import report_generation
+from controller.v1_report_generation import report_generation, ZipLimits, extract_python_files_from_zip, archive_content_hash, pipeline_version
+from errors.exceptions import BadRequestException
+from controller.algorithms.job_artifacts import JobArtifacts
+from controller.algorithms.token_streams import iter_token_streams_json
+from controller.algorithms.v1_tok import TOKEN_K, TOKEN_W
+from controller.algorithms import model_loader
+from controller.algorithms.model_loader import EMBEDDING_MODEL
+from controller.algorithms.v1_NLP import ANALYSIS_PROFILES
+from controller.progress import ProgressTracker
+from status_client import StatusClient, LocalStatusSink
+from blob_store import S3BlobStore, LocalBlobStore, put_json_chunks
+from job_queue import SQSJobQueue, LocalJobQueue
+from result_cache import ResultCache, result_cache_key
+from controller.algorithms.file_cache import FileArtifactCache
+from reference_index import ReferenceIndex
+from embedding_index import EmbeddingIndex
+from scheduler import JobScheduler, ScheduledJob, estimate_archive_cost
+from controller.job_cost import tile_cost
+from sharding import run_sharded_job, run_tile_task, release_finished_artifacts
+from profiling import JobProfiler
+from metrics import JobMetrics, STAGE_SECONDS, JOBS_RUNNING, JOBS_WAITING, start_metrics_server
 
 # Load environment variables from .env file
 load_dotenv()
@@ -27,37 +49,266 @@ S3_BUCKET_NAME = os.getenv('S3_BUCKET_NAME')
 SQS_QUEUE_URL = os.getenv('SQS_QUEUE_URL')
 EXPRESS_API_URL = os.getenv('EXPRESS_API_URL')
 
-# Initialize AWS clients
-s3 = boto3.client('s3', region_name=AWS_REGION)
-sqs = boto3.client('sqs', region_name=AWS_REGION)
+# Upload limits, so a malicious or huge archive can't exhaust worker memory
+MAX_ARCHIVE_BYTES = int(os.getenv('MAX_ARCHIVE_BYTES', 50 * 1024 * 1024))
+ZIP_LIMITS = ZipLimits(
+    max_members=int(os.getenv('MAX_ARCHIVE_MEMBERS', ZipLimits.max_members)),
+    max_total_uncompressed=int(os.getenv('MAX_UNCOMPRESSED_BYTES', ZipLimits.max_total_uncompressed)),
+    max_compression_ratio=float(os.getenv('MAX_COMPRESSION_RATIO', ZipLimits.max_compression_ratio)),
+)
+
+# Minimum number of seconds between progress updates sent to the Express API
+PROGRESS_INTERVAL = float(os.getenv('PROGRESS_INTERVAL', 2.0))
+
+# Job pool: how many jobs run at once and how much memory they may use together
+WORKER_CONCURRENCY = int(os.getenv('WORKER_CONCURRENCY', 2))
+WORKER_MEMORY_MB = float(os.getenv('WORKER_MEMORY_MB', 4096))
+# Scheduling: slots kept free for small jobs, what counts as small, how many received jobs to choose from
+FAST_LANE_SLOTS = int(os.getenv('FAST_LANE_SLOTS', 1))
+FAST_LANE_MAX_PAIRS = int(os.getenv('FAST_LANE_MAX_PAIRS', 5000))
+SCHEDULER_BACKLOG = int(os.getenv('SCHEDULER_BACKLOG', WORKER_CONCURRENCY))
+# Seconds a job may wait before it holds back later jobs until it can start
+SCHEDULER_MAX_WAIT = float(os.getenv('SCHEDULER_MAX_WAIT', 600))
+# Rows scored at a time by jobs too large for WORKER_MEMORY_MB
+BLOCK_ROWS = int(os.getenv('BLOCK_ROWS', 64))
+# Pairs whose weighted score is below this are scored but left out of the per-pair results, 0 keeps every pair
+REPORT_MIN_SCORE = float(os.getenv('REPORT_MIN_SCORE', 0)) or None
+# Seconds a received message stays invisible, extended by a heartbeat while its job runs
+VISIBILITY_TIMEOUT = int(os.getenv('VISIBILITY_TIMEOUT', 300))
+
+# Jobs with at least SHARD_MIN_PAIRS pairs are split into tiles of SHARD_BLOCK_FILES x SHARD_BLOCK_FILES files
+# that any worker on the queue can score. Every worker on the queue must run a version that knows tile tasks.
+SHARDING = os.getenv('SHARDING', 'false').lower() == 'true'
+SHARD_MIN_PAIRS = int(os.getenv('SHARD_MIN_PAIRS', 200000))
+SHARD_BLOCK_FILES = int(os.getenv('SHARD_BLOCK_FILES', 256))
+# Seconds after which a tile claimed by an unresponsive worker is scored by the coordinator
+SHARD_CLAIM_TIMEOUT = float(os.getenv('SHARD_CLAIM_TIMEOUT', VISIBILITY_TIMEOUT))
+
+# Results with more pairs than this are uploaded to the blob store and only their key is sent to the API
+RESULT_INLINE_MAX_PAIRS = int(os.getenv('RESULT_INLINE_MAX_PAIRS', 5000))
+
+# Backends, each either the AWS service or 'local' (a directory) for running without AWS
+# Uploads, artifacts and offloaded results: 's3' or 'local'
+BLOB_STORE = os.getenv('BLOB_STORE', 's3')
+LOCAL_STORE_DIR = os.getenv('LOCAL_STORE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'local_store'))
+# Where jobs come from: 'sqs' or 'local'
+QUEUE_BACKEND = os.getenv('QUEUE_BACKEND', 'sqs')
+LOCAL_QUEUE_DIR = os.getenv('LOCAL_QUEUE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'local_queue'))
+# Where job updates go: 'http' (the Express API) or 'local'
+STATUS_BACKEND = os.getenv('STATUS_BACKEND', 'http')
+LOCAL_STATUS_DIR = os.getenv('LOCAL_STATUS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'local_status'))
+
+# Reports of finished jobs, reused when the same archive is analysed again with the same pipeline
+RESULT_CACHE = os.getenv('RESULT_CACHE', 'true').lower() == 'true'
+RESULT_CACHE_DIR = os.getenv('RESULT_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'result_cache'))
+RESULT_CACHE_MAX_MB = float(os.getenv('RESULT_CACHE_MAX_MB', 1024))
+RESULT_CACHE_TTL = int(os.getenv('RESULT_CACHE_TTL', 7 * 24 * 3600))
+
+# Per-file features (fingerprints, AST vectors, embeddings) shared by every job on this machine
+FILE_CACHE = os.getenv('FILE_CACHE', 'true').lower() == 'true'
+FILE_CACHE_PATH = os.getenv('FILE_CACHE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'file_cache.sqlite3'))
+FILE_CACHE_MAX_MB = float(os.getenv('FILE_CACHE_MAX_MB', 2048))
+
+# Fingerprints of every analysed file, so jobs are also matched against earlier jobs' files (e.g. past terms)
+REFERENCE_INDEX = os.getenv('REFERENCE_INDEX', 'false').lower() == 'true'
+REFERENCE_INDEX_DIR = os.getenv('REFERENCE_INDEX_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reference_index'))
+# Earlier files reported per file, and the share of fingerprints they must share with it
+REFERENCE_TOP_K = int(os.getenv('REFERENCE_TOP_K', 5))
+REFERENCE_MIN_SCORE = float(os.getenv('REFERENCE_MIN_SCORE', 0.5))
+
+# Embeddings of every analysed file, so jobs also find earlier files that read alike without sharing fingerprints
+EMBEDDING_INDEX = os.getenv('EMBEDDING_INDEX', 'false').lower() == 'true'
+EMBEDDING_INDEX_DIR = os.getenv('EMBEDDING_INDEX_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'embedding_index'))
+# Earlier files reported per file, and the cosine similarity they must have with it (0.995 is an embed_sim of 0.5)
+EMBEDDING_TOP_K = int(os.getenv('EMBEDDING_TOP_K', 5))
+EMBEDDING_MIN_COSINE = float(os.getenv('EMBEDDING_MIN_COSINE', 0.995))
+# Lists of the index searched per file, more finds more of the true neighbours but takes longer
+EMBEDDING_NPROBE = int(os.getenv('EMBEDDING_NPROBE', 8))
 
-def download_from_s3(s3_key):
+# Profile of jobs that don't pick one with "analysisProfile" in their message: full scores the embedding
+# channel with CodeBERT, fast with hashed TF-IDF over token n-grams (for triage or when the workers are overloaded)
+ANALYSIS_PROFILE = os.getenv('ANALYSIS_PROFILE', 'full')
+
+# Load the models in the background at start instead of when the first job needs them
+WARM_MODELS = os.getenv('WARM_MODELS', 'true').lower() == 'true'
+# Created once the models are loaded and removed on shutdown, for container readiness probes
+READY_FILE = os.getenv('READY_FILE')
+
+# Profile every job with cProfile and tracemalloc; a job can also ask for it with "profile": true in its message
+PROFILE_JOBS = os.getenv('PROFILE_JOBS', 'false').lower() == 'true'
+# Sample the stacks of every job and keep the profile of jobs that take longer than this many seconds, 0 to disable
+PROFILE_SLOW_SECONDS = float(os.getenv('PROFILE_SLOW_SECONDS', 0))
+
+# Port of the Prometheus metrics endpoint (GET /metrics), 0 to disable it
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9464))
+
+# Status updates that could not be delivered to the Express API are kept here and replayed on start
+UNDELIVERED_DIR = os.getenv('UNDELIVERED_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'undelivered'))
+
+# Initialize the backends, AWS clients are only created when an AWS backend is used
+if BLOB_STORE == 'local':
+    blob_store = LocalBlobStore(LOCAL_STORE_DIR)
+else:
+    import boto3
+    blob_store = S3BlobStore(boto3.client('s3', region_name=AWS_REGION), S3_BUCKET_NAME)
+
+if QUEUE_BACKEND == 'local':
+    job_queue = LocalJobQueue(LOCAL_QUEUE_DIR)
+else:
+    import boto3
+    job_queue = SQSJobQueue(boto3.client('sqs', region_name=AWS_REGION), SQS_QUEUE_URL)
+
+if STATUS_BACKEND == 'local':
+    status_client = LocalStatusSink(LOCAL_STATUS_DIR)
+else:
+    # Pooled, retrying client for the Express API
+    status_client = StatusClient(EXPRESS_API_URL, UNDELIVERED_DIR)
+
+result_cache = ResultCache(RESULT_CACHE_DIR, RESULT_CACHE_MAX_MB * 1024 * 1024, RESULT_CACHE_TTL) if RESULT_CACHE else None
+file_cache = FileArtifactCache(FILE_CACHE_PATH, FILE_CACHE_MAX_MB * 1024 * 1024) if FILE_CACHE else None
+reference_index = ReferenceIndex(REFERENCE_INDEX_DIR, f"k{TOKEN_K}-w{TOKEN_W}") if REFERENCE_INDEX else None
+embedding_index = EmbeddingIndex(EMBEDDING_INDEX_DIR, EMBEDDING_MODEL.replace('/', '_')) if EMBEDDING_INDEX else None
+
+def download_archive(s3_key):
     """
-    Download a file from S3 to a temporary file
+    Download an uploaded archive from the blob store into memory, refusing anything larger than MAX_ARCHIVE_BYTES
     """
-    logger.info(f"Downloading file from S3: {s3_key}")
-    with tempfile.NamedTemporaryFile(delete=False) as tmp:
-        try:
-            s3.download_fileobj(
-                Bucket=S3_BUCKET_NAME,
-                Key=s3_key,
-                Fileobj=tmp
-            )
-            return tmp.name
-        except Exception as e:
-            logger.error(f"Error downloading file from S3: {e}")
-            raise
+    logger.info(f"Downloading file: {s3_key}")
+    try:
+        size = blob_store.size(s3_key)
+    except Exception as e:
+        logger.error(f"Error downloading file: {e}")
+        raise
+
+    if size > MAX_ARCHIVE_BYTES:
+        raise BadRequestException(
+            f"Archive is {size} bytes, the limit is {MAX_ARCHIVE_BYTES}.",
+            "ARCHIVE_TOO_LARGE"
+        )
+
+    buffer = io.BytesIO()
+    for chunk in blob_store.iter_chunks(s3_key):
+        buffer.write(chunk)
+        if buffer.tell() > MAX_ARCHIVE_BYTES:
+            raise BadRequestException("Archive exceeds the size limit.", "ARCHIVE_TOO_LARGE")
+    buffer.seek(0)
+    return buffer
+
+def artifacts_key(job_id):
+    """
+    Blob store key under which a job's per-file artifacts are kept for incremental re-analysis
+    """
+    return f"artifacts/{job_id}.pkl.gz"
+
+def load_job_artifacts(job_id):
+    """
+    Load the per-file artifacts of a completed job from the blob store
+    """
+    logger.info(f"Loading artifacts of job: {job_id}")
+    return JobArtifacts.from_bytes(blob_store.get(artifacts_key(job_id)))
+
+def save_job_artifacts(job_id, artifacts):
+    """
+    Store the per-file artifacts of a job in the blob store so later uploads can be added to it
+    """
+    try:
+        blob_store.put(artifacts_key(job_id), io.BytesIO(artifacts.to_bytes()))
+        logger.info(f"Saved artifacts of job: {job_id}")
+    except Exception as e:
+        # The result is still valid without artifacts, the job just can't be extended later
+        logger.error(f"Error saving job artifacts: {e}")
+
+def tokens_key(job_id):
+    """
+    Blob store key of a job's token streams, read by the API to build match spans on demand
+    """
+    return f"tokens/{job_id}.json.gz"
 
-def update_job_status(job_id, status, result_data=None):
+def save_token_streams(job_id, artifacts):
     """
-    Update job status and results via Express API
+    Store the per-file token hashes and fingerprints of a job as gzip-compressed JSON
     """
-    logger.info(f"Updating job status: {job_id} to {status}")
-    url = f"{EXPRESS_API_URL}/results/update"
+    try:
+        size = put_json_chunks(blob_store, tokens_key(job_id), iter_token_streams_json(artifacts, TOKEN_K, TOKEN_W))
+        logger.info(f"Saved token streams of job: {job_id} ({size} bytes)")
+    except Exception as e:
+        # Scores are still valid, the line-by-line view just has to fall back to re-tokenizing
+        logger.error(f"Error saving token streams: {e}")
+
+def result_key(job_id):
+    """
+    Blob store key of an offloaded job result
+    """
+    return f"results/{job_id}.json.gz"
+
+def upload_result(job_id, report):
+    """
+    Stream a job result to the blob store as gzip-compressed JSON and return its key
+    """
+    key = result_key(job_id)
+    size = put_json_chunks(blob_store, key, report.iter_json())
+    logger.info(f"Uploaded result of job {job_id} to {key} ({size} bytes)")
+    return key
+
+def match_corpus(index, job_id, base_job_id, files, content_hashes, features, **options):
+    """
+    Each file's matches among earlier jobs' files in a corpus index (a ReferenceIndex or an EmbeddingIndex,
+    options are its query's), then add the job's files to the index. A failing index is logged and leaves
+    the job without these matches (None).
+    """
+    try:
+        matches = index.query(files, features, exclude_jobs={job_id, base_job_id}, **options)
+        added = index.add(job_id, files, content_hashes, features)
+        logger.info(f"Job {job_id}: {len(matches)} files match earlier jobs in the {index.NAME}, {added} files added to it")
+        return matches
+    except Exception as e:
+        logger.error(f"Error matching job {job_id} against the {index.NAME}: {e}")
+        return None
+
+
+def profile_key(job_id, name):
+    """
+    Blob store key of a file of a job's profile
+    """
+    return f"profiles/{job_id}/{name}"
+
+def save_profile(job_id, profiler, seconds):
+    """
+    Stop a job's profiler and store its files if the job asked to be fully profiled (it is sampled instead
+    while another job is) or ran for at least PROFILE_SLOW_SECONDS. Returns the key prefix of the files,
+    or None if nothing was stored.
+    """
+    if profiler is None or profiler.stopped:
+        return None
+    profiler.stop()
+    if profiler.requested_mode == 'sample' and seconds < PROFILE_SLOW_SECONDS:
+        return None
+    try:
+        for name, data in profiler.files().items():
+            blob_store.put(profile_key(job_id, name), io.BytesIO(data))
+    except Exception as e:
+        # Profiles are for offline analysis only, the job's result doesn't depend on them
+        logger.error(f"Error saving profile: {e}")
+        return None
+    logger.info(f"Saved {profiler.mode} profile of job {job_id} ({seconds:.1f}s) to {profile_key(job_id, '')}")
+    return profile_key(job_id, '')
+
+def update_job_status(job_id, status, result_data=None, progress=None, result_key=None, result_summary=None):
+    """
+    Update job status, progress and results via Express API.
+    Large results are passed by result_key (plus a summary) instead of inline.
+    """
+    if progress is None:
+        logger.info(f"Updating job status: {job_id} to {status}")
+    else:
+        logger.debug(f"Updating job progress: {job_id} {progress['percent']}%")
     payload = {
         'jobId': job_id,
         'status': status
     }
+
+    if progress is not None:
+        payload['progress'] = progress
     
     def compress_data(data):
         json_data = json.dumps(data)  # Convert to JSON string
@@ -66,22 +317,24 @@ def update_job_status(job_id, status, result_data=None):
 
     if result_data:
         payload['resultData'] = compress_data(result_data)
-        
-    try:
-        response = requests.post(url, json=payload)
-        if response.status_code != 200:
-            logger.error(f"Error updating job status: {response.text}")
-            return False
-        return True
-    except Exception as e:
-        logger.error(f"Error updating job status: {e}")
-        return False
 
-def process_message(message):
+    if result_key:
+        payload['resultKey'] = result_key
+        payload['resultSummary'] = result_summary
+
+    # Delivery (with retries) happens on the status client's sender threads
+    status_client.send(payload)
+    return True
+
+def process_message(message, block_rows=None, queue_wait=0.0):
     """
-    Process a message from the SQS queue
+    Process a message from the job queue, scoring pairs block_rows rows at a time if given.
+    queue_wait is how long the message waited for a job slot, for the job's metrics.
     """
     job_id = None  # Initialize job_id to None
+    metrics = JobMetrics(queue_wait)
+    profiler = None
+    status = 'failed'
     try:
         # Parse message body
         body = json.loads(message['Body'])
@@ -89,26 +342,127 @@ def process_message(message):
         s3_key = body.get('s3Key')
         auth0_id = body.get('auth0Id')
         analysis_name = body.get('analysisName')
+        # Optional: add the uploaded files to this earlier job instead of analysing them from scratch
+        base_job_id = body.get('baseJobId')
+        # Optional: 'full' or 'fast', incremental jobs default to the profile of the job they extend
+        requested_profile = body.get('analysisProfile')
+
+        if body.get('profile') or PROFILE_JOBS:
+            profiler = JobProfiler('full').start()
+            if profiler.mode != 'full':
+                logger.info(f"Job {job_id}: another job is being profiled, sampling this one's stacks instead")
+        elif PROFILE_SLOW_SECONDS > 0:
+            profiler = JobProfiler('sample').start()
+        metrics.profiler = profiler
         
         logger.info(f"Processing job: {job_id} for user: {auth0_id}")
         
         # Update job status to processing
         update_job_status(job_id, 'processing')
         
-        # Download file from S3
-        temp_file_path = download_from_s3(s3_key)
+        # Download the archive, it is only ever held in memory once
+        with metrics.timed('download'):
+            archive = download_archive(s3_key)
         
         try:
-            # Read the zip file
-            with open(temp_file_path, 'rb') as f:
-                zip_bytes = f.read()
-            
+            prior = None
+            if base_job_id:
+                prior = load_job_artifacts(base_job_id)
+                logger.info(f"Incremental job {job_id} extends job {base_job_id}")
+            analysis_profile = requested_profile or (prior.profile if prior is not None else ANALYSIS_PROFILE)
+            if analysis_profile not in ANALYSIS_PROFILES:
+                raise BadRequestException(
+                    f"Unknown analysis profile {analysis_profile!r}, expected one of {', '.join(ANALYSIS_PROFILES)}.",
+                    "UNKNOWN_ANALYSIS_PROFILE"
+                )
+            if analysis_profile != 'full':
+                logger.info(f"Job {job_id} uses the {analysis_profile} profile")
+
+            # Progress is posted from a background thread so it never blocks the computation
+            progress = ProgressTracker(
+                callback=lambda snapshot: update_job_status(job_id, 'processing', progress=snapshot),
+                interval=PROGRESS_INTERVAL,
+                profiler=profiler
+            )
+
             # Process the zip file
-            logger.info(f"Processing file: {temp_file_path}")
-            result_data = report_generation().generate(zip_bytes)
-            
+            logger.info(f"Processing file: {s3_key}")
+            try:
+                with metrics.timed('extract'):
+                    files = extract_python_files_from_zip(archive, ZIP_LIMITS, progress)
+
+                sharded = prior is None and SHARDING and len(files) * (len(files) - 1) // 2 >= SHARD_MIN_PAIRS
+
+                def compute_report():
+                    if sharded:
+                        logger.info(f"Sharding job {job_id} across workers")
+                        return run_sharded_job(
+                            job_id, files, blob_store, job_queue, SHARD_BLOCK_FILES, SHARD_CLAIM_TIMEOUT,
+                            progress=progress, file_cache=file_cache, user=auth0_id, profile=analysis_profile
+                        )
+                    return report_generation().generate_from_files(
+                        files, prior=prior, progress=progress, file_cache=file_cache, block_rows=block_rows,
+                        profile=analysis_profile
+                    )
+
+                hit = False
+                if prior is None and result_cache is not None:
+                    # Re-uploads and redelivered messages reuse the stored report of an identical archive
+                    key = result_cache_key(archive_content_hash(files), pipeline_version(analysis_profile))
+                    report, hit = result_cache.get_or_compute(key, compute_report)
+                    if hit:
+                        logger.info(f"Reusing cached result for job {job_id}")
+                else:
+                    report = compute_report()
+            finally:
+                progress.close()
+                metrics.add_timings(progress.timings())
+            with metrics.timed('save_artifacts'):
+                save_job_artifacts(job_id, report.artifacts)
+                save_token_streams(job_id, report.artifacts)
+            # The result cache hands one report to every job of the same archive, even concurrent ones,
+            # so each job's corpus matches and result filter go on its own copy
+            artifacts = report.artifacts
+            report = dataclasses.replace(report, min_score=REPORT_MIN_SCORE)
+            if reference_index is not None:
+                with metrics.timed('reference'):
+                    matches = match_corpus(
+                        reference_index, job_id, base_job_id, artifacts.files, artifacts.content_hashes,
+                        artifacts.token_fingerprints, top_k=REFERENCE_TOP_K, min_score=REFERENCE_MIN_SCORE
+                    )
+                    report = dataclasses.replace(report, reference_matches=matches)
+            # Fast jobs have no embeddings to match
+            if embedding_index is not None and artifacts.profile == 'full':
+                with metrics.timed('embedding_index'):
+                    matches = match_corpus(
+                        embedding_index, job_id, base_job_id, artifacts.files, artifacts.content_hashes,
+                        artifacts.embeddings, top_k=EMBEDDING_TOP_K, min_cosine=EMBEDDING_MIN_COSINE, nprobe=EMBEDDING_NPROBE
+                    )
+                    report = dataclasses.replace(report, embedding_matches=matches)
+
+            metrics.files = len(files)
+            metrics.cached = hit
+            # Cached reports scored nothing in this job
+            metrics.pairs = progress.snapshot()['pairsProcessed']
+            metrics.pairs_omitted = report.omitted_pair_count()
+            if not hit and report.artifacts is not None:
+                metrics.tokens = sum(len(hashes) for hashes in report.artifacts.token_hashes)
+
+            offload = report.pair_count() > RESULT_INLINE_MAX_PAIRS
+            if offload:
+                with metrics.timed('upload'):
+                    key = upload_result(job_id, report)
+            job_metrics = metrics.summary()
+            profile = save_profile(job_id, profiler, job_metrics['seconds'])
+            if profile is not None:
+                job_metrics['profile'] = profile
+
             # Update job status to completed with results
-            update_job_status(job_id, 'completed', result_data)
+            if offload:
+                update_job_status(job_id, 'completed', result_key=key, result_summary={**report.summary(), 'metrics': job_metrics})
+            else:
+                update_job_status(job_id, 'completed', {**report.to_dict(), 'metrics': job_metrics})
+            status = 'completed'
             logger.info(f"Job completed: {job_id}")
             
         except Exception as e:
@@ -116,11 +470,9 @@ def process_message(message):
             logger.error(f"Error processing file: {e}")
             update_job_status(job_id, 'failed')
         finally:
-            # Clean up temporary file
-            if os.path.exists(temp_file_path):
-                os.unlink(temp_file_path)
-            # Keep the S3 object for future use
-            logger.info(f"Keeping S3 object: {s3_key}")
+            archive.close()
+            # Keep the uploaded archive for future use
+            logger.info(f"Keeping uploaded archive: {s3_key}")
                 
     except Exception as e:
         logger.error(f"Error processing message: {e}")
@@ -129,51 +481,245 @@ def process_message(message):
             update_job_status(job_id, 'failed')
 
     finally:
+        # Failed jobs keep their profile too
+        save_profile(job_id, profiler, time.monotonic() - metrics.started)
+        metrics.finish(status)
         # Delete the message from the queue
         try:
-            sqs.delete_message(
-                QueueUrl=SQS_QUEUE_URL,
-                ReceiptHandle=message['ReceiptHandle']
-            )
+            job_queue.delete(message['ReceiptHandle'])
             logger.info(f"Deleted message with ReceiptHandle: {message['ReceiptHandle']}")
         except Exception as e:
             logger.error(f"Error deleting message: {e}")
             # Handle the failure to delete (e.g., log, potentially retry later)
 
-def poll_sqs_queue():
+def process_tile_message(message):
     """
-    Poll the SQS queue for messages
+    Score one tile of a sharded job for its coordinator
     """
-    logger.info(f"Starting to poll SQS queue: {SQS_QUEUE_URL}")
-    
-    while True:
+    try:
+        started = time.perf_counter()
+        if run_tile_task(json.loads(message['Body']), blob_store, SHARD_CLAIM_TIMEOUT):
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage='tile')
+    except Exception as e:
+        # The coordinator scores the tile itself once the claim times out
+        logger.error(f"Error scoring tile: {e}")
+    finally:
         try:
-            # Receive message from SQS queue
-            response = sqs.receive_message(
-                QueueUrl=SQS_QUEUE_URL,
-                MaxNumberOfMessages=1,
-                WaitTimeSeconds=20,  # Long polling
-                AttributeNames=['All'],
-                MessageAttributeNames=['All']
-            )
-            
-            # Process messages if any
-            if 'Messages' in response:
-                for message in response['Messages']:
-                    logger.info(f"Received message: {message['MessageId']}")
-                    
-                    # Process the message
-                    process_message(message)
-                    
-            else:
-                logger.debug("No messages received")
-                
+            job_queue.delete(message['ReceiptHandle'])
         except Exception as e:
-            logger.error(f"Error polling SQS queue: {e}")
-            
-        # Small delay to prevent tight loop
-        time.sleep(1)
+            logger.error(f"Error deleting message: {e}")
 
-if __name__ == "__main__":
-    poll_sqs_queue()
+def process_delete_message(message):
+    """
+    Take a deleted job's files out of the corpus indexes, so they stop matching other jobs. A failed removal
+    leaves the message to be delivered again.
+    """
+    try:
+        job_id = json.loads(message['Body'])['jobId']
+        for index in (reference_index, embedding_index):
+            if index is not None:
+                removed = index.remove_job(job_id)
+                logger.info(f"Removed {removed} files of deleted job {job_id} from the {index.NAME}")
+    except Exception as e:
+        logger.error(f"Error removing deleted job from the corpus indexes: {e}")
+        return
+    try:
+        job_queue.delete(message['ReceiptHandle'])
+    except Exception as e:
+        logger.error(f"Error deleting message: {e}")
+
+def change_visibility(receipt_handle, timeout):
+    """
+    Change how long a received message stays hidden from other consumers; 0 returns it to the queue
+    """
+    try:
+        job_queue.change_visibility(receipt_handle, timeout)
+    except Exception as e:
+        logger.error(f"Error changing message visibility: {e}")
+
+
+class VisibilityHeartbeat:
+    """
+    Keeps extending a message's visibility timeout while its job runs, so long jobs aren't redelivered
+    """
+
+    def __init__(self, receipt_handle, timeout=VISIBILITY_TIMEOUT):
+        self.receipt_handle = receipt_handle
+        self.timeout = timeout
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="visibility-heartbeat", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        # Extend well before the current timeout runs out
+        while not self._stop.wait(self.timeout / 3):
+            change_visibility(self.receipt_handle, self.timeout)
+
+    def stop(self):
+        if not self._stop.is_set():
+            self._stop.set()
+            self._thread.join()
+
+
+def message_type(message):
+    """
+    'job', 'tile' (of a sharded job) or 'delete' (of a deleted job)
+    """
+    try:
+        return json.loads(message['Body']).get('type', 'job')
+    except Exception:
+        # process_message reports the bad message
+        return 'job'
 
+
+def schedule_message(message):
+    """
+    Wrap a received message for the scheduler, with its cost read from the archive's central directory.
+    The message is kept invisible from here on, while it waits as well as while it runs.
+    """
+    heartbeat = VisibilityHeartbeat(message['ReceiptHandle'])
+    try:
+        body = json.loads(message['Body'])
+    except Exception:
+        # process_message reports the bad message
+        body = {}
+    kind = body.get('type', 'job')
+    if kind == 'tile':
+        cost = tile_cost(body['files'], body['sourceBytes'], body['pairs'], BLOCK_ROWS)
+    else:
+        cost = estimate_archive_cost(blob_store, body.get('s3Key'), BLOCK_ROWS)
+        logger.info(f"Queued job {body.get('jobId')}: {cost.files} files, {cost.pairs} pairs, ~{cost.memory_mb:.0f} MB")
+    return ScheduledJob(
+        message=message, job_id=body.get('jobId'), user=body.get('auth0Id') or '', cost=cost, kind=kind, context=heartbeat
+    )
+
+
+def run_job(job, scheduler):
+    """
+    Run one job in its slot, then give the slot back and let its message go
+    """
+    try:
+        if job.kind == 'tile':
+            process_tile_message(job.message)
+            return
+        blocks = f", scored in blocks of {BLOCK_ROWS} rows" if job.blocked else ""
+        logger.info(f"Starting job {job.job_id} (~{job.memory_mb:.0f} MB{blocks})")
+        process_message(
+            job.message, block_rows=BLOCK_ROWS if job.blocked else None, queue_wait=time.monotonic() - job.received
+        )
+    except Exception as e:
+        logger.error(f"Error running job: {e}")
+    finally:
+        scheduler.finish(job)
+        job.context.stop()
+
+
+def run_slot(scheduler, shutdown):
+    """
+    One job slot: run whatever the scheduler picks next until the worker shuts down
+    """
+    while (job := scheduler.next(shutdown)) is not None:
+        run_job(job, scheduler)
+
+
+def warm_models():
+    """
+    Load the models while the worker already polls. A job that starts before this finishes
+    waits for the same load instead of starting a second one.
+    """
+    try:
+        model_loader.warm_up()
+        logger.info("Models loaded, worker ready")
+        if READY_FILE:
+            with open(READY_FILE, 'w') as f:
+                f.write(str(os.getpid()))
+    except Exception as e:
+        # Jobs will retry the load, and report it if it keeps failing
+        logger.error(f"Error loading models: {e}")
+
+def poll_queue(exit_when_idle=False):
+    """
+    Poll the job queue for messages and run up to WORKER_CONCURRENCY jobs at once.
+    SIGTERM/SIGINT stop polling and wait for the running jobs to finish.
+    With exit_when_idle the worker also stops once the queue is empty and no job is running on any worker.
+    """
+    logger.info(f"Starting to poll {QUEUE_BACKEND} job queue with {WORKER_CONCURRENCY} job slots")
+    status_client.replay()
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+    if WARM_MODELS:
+        threading.Thread(target=warm_models, name="warm-models", daemon=True).start()
+
+    shutdown = threading.Event()
+
+    def request_shutdown(signum, frame):
+        logger.info(f"Received signal {signum}, draining running jobs")
+        shutdown.set()
+
+    signal.signal(signal.SIGTERM, request_shutdown)
+    signal.signal(signal.SIGINT, request_shutdown)
+
+    scheduler = JobScheduler(
+        WORKER_CONCURRENCY, WORKER_MEMORY_MB,
+        fast_lane_slots=FAST_LANE_SLOTS, small_pairs=FAST_LANE_MAX_PAIRS, max_wait_seconds=SCHEDULER_MAX_WAIT
+    )
+    JOBS_RUNNING.set_function(scheduler.running)
+    JOBS_WAITING.set_function(scheduler.waiting)
+    executor = ThreadPoolExecutor(max_workers=WORKER_CONCURRENCY, thread_name_prefix="job")
+    for _ in range(WORKER_CONCURRENCY):
+        executor.submit(run_slot, scheduler, shutdown)
+
+    while not shutdown.is_set():
+        # Hold up to SCHEDULER_BACKLOG jobs beyond the running ones, for the scheduler to choose from
+        wanted = WORKER_CONCURRENCY + SCHEDULER_BACKLOG - scheduler.waiting() - scheduler.running()
+        if wanted <= 0:
+            shutdown.wait(1)
+            continue
+
+        try:
+            # Long polling, kept short when we only wait to find the queue empty
+            messages = job_queue.receive(wanted, 1 if exit_when_idle else 20, VISIBILITY_TIMEOUT)
+        except Exception as e:
+            logger.error(f"Error polling job queue: {e}")
+            messages = []
+            # Small delay to prevent tight loop
+            shutdown.wait(1)
+
+        if not messages:
+            logger.debug("No messages received")
+            # Artifacts kept for the tiles of a sharded job are dropped once that job has finished
+            release_finished_artifacts(blob_store)
+            # Jobs running elsewhere may still queue work, e.g. the tiles of a sharded job
+            if exit_when_idle and scheduler.idle() and job_queue.in_flight() == 0:
+                logger.info("Queue is empty and no job is running")
+                shutdown.set()
+
+        for message in messages:
+            logger.info(f"Received message: {message['MessageId']}")
+            if shutdown.is_set():
+                # The signal arrived during the long poll, let another worker take it
+                change_visibility(message['ReceiptHandle'], 0)
+                continue
+            if message_type(message) == 'delete':
+                # A few catalog writes, not worth a job slot
+                process_delete_message(message)
+                continue
+            scheduler.add(schedule_message(message))
+
+    # Jobs that never started go back to the queue for another worker
+    for job in scheduler.drain():
+        job.context.stop()
+        change_visibility(job.message['ReceiptHandle'], 0)
+        logger.info(f"Returned message to queue: {job.message['MessageId']}")
+
+    executor.shutdown(wait=True)
+    status_client.close()
+    if READY_FILE and os.path.exists(READY_FILE):
+        os.unlink(READY_FILE)
+    logger.info("All jobs finished, worker stopped")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Similarity job worker.")
+    parser.add_argument('--exit-when-idle', action='store_true', help='Stop once the queue is empty instead of waiting for more jobs')
+    args = parser.parse_args()
+    poll_queue(exit_when_idle=args.exit_when_idle)
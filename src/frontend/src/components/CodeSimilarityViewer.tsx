@@ -2,7 +2,7 @@ import React, { useRef, useEffect, useState } from "react";
 import * as monaco from "monaco-editor";
 import { Spin, message } from "antd"; // For loading indicator and errors
 import { getFileContentsFromDB } from "@/lib/dbUtils"; // Adjust path
-import { compareFilesApi } from "@/services/ssApi"; // Adjust path
+import { compareFilesApi, getPairMatches } from "@/services/ssApi"; // Adjust path
 
 // --- Interfaces ---
 interface Span {
@@ -167,6 +167,7 @@ function mergeOverlappingSpans(
 
 // --- Define Props for the Component ---
 interface CodeSimilarityViewerProps {
+  jobId?: string | null,
   file1Name: string,
   file2Name: string,
   file1Content: string,
@@ -174,6 +175,7 @@ interface CodeSimilarityViewerProps {
 }
 
 export const CodeSimilarityViewer: React.FC<CodeSimilarityViewerProps> = ({
+  jobId,
   file1Name,
   file2Name,
   file1Content,
@@ -211,16 +213,27 @@ export const CodeSimilarityViewer: React.FC<CodeSimilarityViewerProps> = ({
       setSpanClusters([]);
 
       try {
-        // 2. Call comparison API
-        // Provide default k/w or make them optional in API definition (using Option 2 from previous fix here)
-        const detailedResult: DetailedComparisonResult = await compareFilesApi({
-          file1Content: file1Content,
-          file2Content: file2Content,
-          file1Name: file1Name,
-          file2Name: file1Name,
-          k: 7, // Example default
-          w: 4, // Example default
-        });
+        // 2. Get the matches the job's own fingerprints produce, falling back to
+        // re-tokenizing both files for jobs that have no stored token streams
+        let detailedResult: DetailedComparisonResult | null = null;
+        if (jobId) {
+          try {
+            detailedResult = await getPairMatches(jobId, file1Name, file2Name);
+          } catch (err) {
+            console.warn("Stored matches unavailable, comparing file contents instead:", err);
+          }
+        }
+        if (!detailedResult) {
+          // Provide default k/w or make them optional in API definition (using Option 2 from previous fix here)
+          detailedResult = await compareFilesApi({
+            file1Content: file1Content,
+            file2Content: file2Content,
+            file1Name: file1Name,
+            file2Name: file1Name,
+            k: 7, // Example default
+            w: 4, // Example default
+          });
+        }
         // 3. Map API response (ss/ts) to viewer format (ss/ts)
         const apiMatches = detailedResult.matches || [];
         let mappedMatchesForViewer: MatchCluster[] = apiMatches.map(
@@ -255,7 +268,7 @@ export const CodeSimilarityViewer: React.FC<CodeSimilarityViewerProps> = ({
     };
 
     fetchAndCompareData();
-  }, [file1Name, file2Name, file1Content, file2Content]);
+  }, [jobId, file1Name, file2Name, file1Content, file2Content]);
 
   useEffect(() => {
     if (!file1Content || !file2Content || !spanClusters) return;
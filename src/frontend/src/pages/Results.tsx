@@ -1,5 +1,5 @@
 import { useNavigate, useLocation } from "react-router-dom";
-import { pollResults, getFileContentsFromS3 } from "@/services/ssApi";
+import { pollResults, getFileContentsFromS3, getOffloadedResults } from "@/services/ssApi";
 import { ReloadOutlined } from "@ant-design/icons";
 import pako from 'pako';  // Import pako library
 import "./Results.css";
@@ -159,7 +159,7 @@ const Results = () => {
       setFileContent(fileContents);
       const response = await pollResults(jobId);
 
-      if (response.status === "completed" && response.resultData) {
+      if (response.status === "completed" && (response.resultData || response.resultOffloaded)) {
         async function decompressData(compressedData) {
           const base64Decoded = Uint8Array.from(atob(compressedData), c => c.charCodeAt(0)); // Base64 decode
           const decompressed = await new Response(base64Decoded).arrayBuffer(); // Convert to ArrayBuffer
@@ -167,7 +167,10 @@ const Results = () => {
           return JSON.parse(decompressedText); // Parse JSON
         }
 
-        const jsonData = await decompressData(response.resultData);
+        // Large results are downloaded separately, small ones come inline
+        const jsonData = response.resultOffloaded
+          ? await getOffloadedResults(jobId)
+          : await decompressData(response.resultData);
 
         // Process the results
         const results = jsonData.similarity_results;
@@ -447,6 +450,7 @@ const Results = () => {
           {similarityData && (
             <>
               <CodeSimilarityViewer
+                jobId={jobId}
                 file1Name={selectedFiles.file1}
                 file2Name={selectedFiles.file2}
                 file1Content={fileContent[selectedFiles.file1] || ""}
@@ -32,6 +32,8 @@ interface JobResponse {
   jobId: string;
   status: string;
   resultData?: SimilarityData;
+  // Set when the result is too large to inline, fetch it with getOffloadedResults
+  resultOffloaded?: boolean;
 }
 
 export const uploadFiles = async (files: FileList, analysisName: string) => {
@@ -74,6 +76,21 @@ export const pollResults = async (jobId: string) => {
   }
 };
 
+/**
+ * Download a large job result the API doesn't send inline
+ * @param {string} jobId - The job ID whose result to download
+ * @returns {Promise<SimilarityData>} - The parsed result (the browser undoes its gzip encoding)
+ */
+export const getOffloadedResults = async (jobId: string): Promise<SimilarityData> => {
+  try {
+    const response = await api.get(`/results/${jobId}/data`);
+    return response.data;
+  } catch (error) {
+    console.error("Error downloading results:", error);
+    throw error;
+  }
+};
+
 /**
  * Get all jobs for the current user
  * @returns {Promise<Array<JobInfo>>} - Array of job information objects
@@ -157,6 +174,20 @@ export const compareFilesApi = async ({
   }
 };
 
+/**
+ * Get the match spans of a file pair, computed by the API from the job's stored token streams
+ */
+export const getPairMatches = async (
+  jobId: string,
+  file1: string,
+  file2: string
+): Promise<DetailedComparisonResult> => {
+  const response = await api.get(`/results/${jobId}/matches`, {
+    params: { file1, file2 },
+  });
+  return response.data;
+};
+
 export const getFileContentsFromS3 = async (jobId: string): Promise<Record<string, string>> => {
   try {
     const response = await api.get(`/files/contents/${jobId}`);
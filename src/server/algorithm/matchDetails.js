@@ -0,0 +1,111 @@
+// algorithm/matchDetails.js
+import { Tokenizer } from "./tokenizer.js";
+
+// Must match TOKEN_STREAMS_VERSION in the backend's token_streams.py
+const TOKEN_STREAMS_VERSION = 1;
+
+/**
+ * Small least-recently-used cache on top of Map's insertion order.
+ */
+class LRUCache {
+  constructor(maxSize) {
+    this.maxSize = maxSize;
+    this.entries = new Map();
+  }
+
+  get(key) {
+    if (!this.entries.has(key)) return undefined;
+    const value = this.entries.get(key);
+    // Re-insert to mark as most recently used
+    this.entries.delete(key);
+    this.entries.set(key, value);
+    return value;
+  }
+
+  set(key, value) {
+    this.entries.delete(key);
+    this.entries.set(key, value);
+    if (this.entries.size > this.maxSize) {
+      this.entries.delete(this.entries.keys().next().value);
+    }
+  }
+
+  delete(key) {
+    this.entries.delete(key);
+  }
+}
+
+/**
+ * Decodes a delta-encoded flat span array [sl, sc, el, ec, ...] (see compact_report.py).
+ * @param {number[]} flat - The encoded spans.
+ * @returns {object[]} Spans as {sl, sc, el, ec}.
+ */
+function decodeSpans(flat) {
+  const spans = [];
+  let prevLine = 0;
+  for (let i = 0; i < flat.length; i += 4) {
+    const sl = flat[i] + prevLine;
+    spans.push({ sl, sc: flat[i + 1], el: flat[i + 2] + sl, ec: flat[i + 3] });
+    prevLine = sl;
+  }
+  return spans;
+}
+
+/**
+ * Parses the token streams document written by the worker into per-file hashes and fingerprints.
+ * @param {object} doc - The token streams JSON.
+ * @returns {{w: number, files: Map<string, object>}} Window size and per-file streams.
+ */
+function decodeTokenStreams(doc) {
+  if (doc.v !== TOKEN_STREAMS_VERSION) {
+    throw new Error(`Unsupported token stream version: ${doc.v}`);
+  }
+  const files = new Map();
+  for (const stream of doc.streams) {
+    const spans = decodeSpans(stream.spans);
+    const hashes = stream.hashes.map((hashVal, position) => ({
+      hashVal,
+      position,
+      span: spans[position],
+    }));
+    // Positions are kept in winnowing order, the common fingerprint lookup depends on it
+    const fingerprints = stream.fingerprints.map((position) => hashes[position]);
+    files.set(stream.file, { hashes, fingerprints });
+  }
+  return { w: doc.w, files };
+}
+
+/**
+ * Builds the match spans of one file pair from its token streams.
+ * Mirrors Tokenizer.score_pair and Tokenizer.match_spans in the backend, so the spans line up with the job's scores.
+ * @param {object} stream1 - Token stream of the first file.
+ * @param {object} stream2 - Token stream of the second file.
+ * @param {number} w - Window size used for winnowing.
+ * @returns {object[]} Matches as {ss, ts} span lists.
+ */
+function pairMatches(stream1, stream2, w) {
+  // Common fingerprints keyed by hash, keeping the last fingerprint seen for each hash value
+  const byHash2 = new Map();
+  for (const fp2 of stream2.fingerprints) byHash2.set(fp2.hashVal, fp2);
+  const common = new Map();
+  for (const fp1 of stream1.fingerprints) {
+    if (byHash2.has(fp1.hashVal)) common.set(fp1.hashVal, [fp1, byHash2.get(fp1.hashVal)]);
+  }
+
+  const tokenizer = new Tokenizer();
+  const { hashes: hashes1 } = stream1;
+  const { hashes: hashes2 } = stream2;
+  const matches = [];
+  for (const [fp1, fp2] of common.values()) {
+    const surrounding1 = hashes1.slice(Math.max(0, fp1.position - w), fp1.position + w + 1);
+    const surrounding2 = hashes2.slice(Math.max(0, fp2.position - w), fp2.position + w + 1);
+    const { lcs1, lcs2 } = tokenizer.hashLcs(surrounding1, surrounding2);
+    matches.push({
+      ss: lcs1.map((hsh1) => hsh1.span),
+      ts: lcs2.map((hsh2) => hsh2.span),
+    });
+  }
+  return matches;
+}
+
+export { LRUCache, decodeSpans, decodeTokenStreams, pairMatches, TOKEN_STREAMS_VERSION };
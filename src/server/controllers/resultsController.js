@@ -4,10 +4,39 @@ import { HttpRequestException } from "../types/exceptions.js";
 import firebaseUtils from "../utilities/firebaseUtils.js";
 import { getAuth0UserId } from "../middleware/authMiddleware.js";
 import awsUtils from "../utilities/awsUtils.js";
+import zlib from "zlib";
+import { pipeline } from "stream/promises";
+import {
+  LRUCache,
+  decodeTokenStreams,
+  pairMatches,
+} from "../algorithm/matchDetails.js";
 
 const router = express.Router();
 export default router;
 
+// Decoded token streams of recently viewed jobs, and the match spans of recently viewed pairs
+const tokenStreamsCache = new LRUCache(8);
+const matchCache = new LRUCache(1000);
+
+/**
+ * Load and decode the token streams the worker stored for a job, sharing one download between concurrent requests
+ */
+const getTokenStreams = (jobId) => {
+  let streams = tokenStreamsCache.get(jobId);
+  if (!streams) {
+    streams = awsUtils
+      .getFileFromS3(`tokens/${jobId}.json.gz`)
+      .then((compressed) =>
+        decodeTokenStreams(JSON.parse(zlib.gunzipSync(compressed).toString("utf-8")))
+      );
+    // Don't keep failed loads around
+    streams.catch(() => tokenStreamsCache.delete(jobId));
+    tokenStreamsCache.set(jobId, streams);
+  }
+  return streams;
+};
+
 /**
  * GET /results
  * Get all jobs for the current user
@@ -67,11 +96,14 @@ router.get("/:jobId", async (req, res, next) => {
       );
     }
 
-    // Return the results
+    // Large results live in S3, the client downloads them from GET /results/:jobId/data
     return res.json({
       jobId,
       status: results.status,
+      progress: results.progress,
+      resultSummary: results.resultSummary,
       resultData: results.resultData,
+      resultOffloaded: !results.resultData && Boolean(results.resultKey),
     });
   } catch (error) {
     logger.error("Error retrieving results:", error);
@@ -79,6 +111,138 @@ router.get("/:jobId", async (req, res, next) => {
   }
 });
 
+/**
+ * GET /results/:jobId/data
+ * Offloaded result of a job, streamed from S3 as stored: gzip-compressed JSON sent with
+ * Content-Encoding: gzip, so the browser decompresses it and the server never holds it in memory
+ */
+router.get("/:jobId/data", async (req, res, next) => {
+  try {
+    const { jobId } = req.params;
+    const auth0Id = await getAuth0UserId(req);
+
+    const results = await firebaseUtils.getResults(jobId);
+
+    if (!results || !results.resultKey) {
+      logger.warn(`No offloaded result found for job ID: ${jobId}`);
+      return next(
+        new HttpRequestException(404, "Results not found", "RESULTS_NOT_FOUND")
+      );
+    }
+
+    if (results.auth0Id !== auth0Id) {
+      logger.warn(
+        `Unauthorized access attempt for job ID: ${jobId} by user: ${auth0Id}`
+      );
+      return next(
+        new HttpRequestException(
+          403,
+          "Unauthorized access",
+          "UNAUTHORIZED_ACCESS"
+        )
+      );
+    }
+
+    const object = await awsUtils.streamFromS3(results.resultKey);
+    res.set({
+      "Content-Type": "application/json",
+      "Content-Encoding": "gzip",
+    });
+    if (object.ContentLength !== undefined) {
+      res.set("Content-Length", String(object.ContentLength));
+    }
+    await pipeline(object.Body, res);
+  } catch (error) {
+    logger.error("Error streaming results:", error);
+    // Once streaming started the response can only be cut off
+    if (res.headersSent) {
+      return res.destroy(error);
+    }
+    next(error);
+  }
+});
+
+/**
+ * GET /results/:jobId/matches?file1=...&file2=...
+ * Match spans of a single file pair, computed on demand from the job's token streams
+ */
+router.get("/:jobId/matches", async (req, res, next) => {
+  try {
+    const { jobId } = req.params;
+    const { file1, file2 } = req.query;
+    const auth0Id = await getAuth0UserId(req);
+
+    if (!file1 || !file2) {
+      logger.warn("Missing file names in match request");
+      return next(
+        new HttpRequestException(
+          400,
+          "Both file1 and file2 are required.",
+          "MISSING_FILE_NAMES"
+        )
+      );
+    }
+
+    const results = await firebaseUtils.getResults(jobId);
+
+    if (!results) {
+      logger.warn(`No results found for job ID: ${jobId}`);
+      return next(
+        new HttpRequestException(404, "Results not found", "RESULTS_NOT_FOUND")
+      );
+    }
+
+    if (results.auth0Id !== auth0Id) {
+      logger.warn(
+        `Unauthorized access attempt for job ID: ${jobId} by user: ${auth0Id}`
+      );
+      return next(
+        new HttpRequestException(
+          403,
+          "Unauthorized access",
+          "UNAUTHORIZED_ACCESS"
+        )
+      );
+    }
+
+    const cacheKey = JSON.stringify([jobId, file1, file2]);
+    let matches = matchCache.get(cacheKey);
+    if (!matches) {
+      let streams;
+      try {
+        streams = await getTokenStreams(jobId);
+      } catch (error) {
+        // Jobs from before token streams were stored have none, the client falls back to /similarity/compare
+        if (error.name === "NoSuchKey") {
+          return next(
+            new HttpRequestException(
+              404,
+              "No token streams stored for this job",
+              "TOKEN_STREAMS_NOT_FOUND"
+            )
+          );
+        }
+        throw error;
+      }
+
+      const stream1 = streams.files.get(file1);
+      const stream2 = streams.files.get(file2);
+      if (!stream1 || !stream2) {
+        return next(
+          new HttpRequestException(404, "File not found in job", "FILE_NOT_FOUND")
+        );
+      }
+      matches = pairMatches(stream1, stream2, streams.w);
+      matchCache.set(cacheKey, matches);
+    }
+
+    return res.json({ file1, file2, matches });
+  } catch (error) {
+    logger.error("Error retrieving matches:", error);
+    next(error);
+  }
+});
+
 /**
  * DELETE /results/:jobId
  * Delete a specific job and its associated data
@@ -102,6 +266,14 @@ router.delete("/:jobId", async (req, res, next) => {
     const s3Key = `uploads/${auth0Id}/${jobId}.zip`;
     await awsUtils.deleteFromS3(s3Key);
 
+    // Offloaded results and per-file artifacts written by the worker (deleting a missing key is a no-op)
+    await awsUtils.deleteFromS3(`results/${jobId}.json.gz`);
+    await awsUtils.deleteFromS3(`artifacts/${jobId}.pkl.gz`);
+    await awsUtils.deleteFromS3(`tokens/${jobId}.json.gz`);
+
+    // The job's files also leave the workers' corpus indexes
+    await awsUtils.sendDeletionToSQS(jobId, auth0Id);
+
     return res.json({
       message: "Job deleted successfully",
       jobId,
@@ -38,6 +38,8 @@ const transporter = nodemailer.createTransport({
 });
 
 const MAX_FILES = 500;
+// Analysis profiles the worker accepts, see ANALYSIS_PROFILES in the backend
+const ANALYSIS_PROFILES = ["full", "fast"];
 
 /**
  * Helper function that converts a stream into a Buffer.
@@ -141,6 +143,23 @@ router.post("/", multer().any(), async (req, res, next) => {
       );
     }
 
+    const analysisProfile = req.body.analysisProfile || undefined;
+    if (analysisProfile !== undefined && !ANALYSIS_PROFILES.includes(analysisProfile)) {
+      throw new BadRequestException(
+        `Analysis profile must be one of ${ANALYSIS_PROFILES.join(", ")}.`,
+        "UNKNOWN_ANALYSIS_PROFILE"
+      );
+    }
+
+    // An incremental job may only extend one of the user's own jobs
+    const baseJobId = req.body.baseJobId || undefined;
+    if (baseJobId !== undefined) {
+      const baseJob = typeof baseJobId === 'string' ? await firebaseUtils.getResults(baseJobId) : null;
+      if (!baseJob || baseJob.auth0Id !== auth0Id) {
+        throw new BadRequestException("Base job not found.", "UNKNOWN_BASE_JOB");
+      }
+    }
+
     // Validate files before any database operations
     await validateUploadedFiles(req.files);
 
@@ -170,7 +189,7 @@ router.post("/", multer().any(), async (req, res, next) => {
     logger.info(`Uploaded zip file to S3: ${s3Key}`);
 
     // Send a message to SQS
-    await awsUtils.sendToSQS(jobId, s3Key, auth0Id, analysisName);
+    await awsUtils.sendToSQS(jobId, s3Key, auth0Id, analysisName, { analysisProfile, baseJobId });
     logger.info(`Sent job to SQS queue: ${jobId}`);
 
     // Return the job ID to the frontend
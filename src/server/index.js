@@ -51,7 +51,8 @@ const updateRouter = express.Router();
 updateRouter.post("/update", async (req, res, next) => {
   try {
     const { jobId, status } = req.body;
-    let { resultData } = req.body; // resultData is optional
+    // resultData, resultKey/resultSummary (large results stored in S3) and progress are optional
+    let { resultData, resultKey, resultSummary, progress } = req.body;
 
     if (!jobId) {
       logger.warn("No job ID provided");
@@ -81,6 +82,11 @@ updateRouter.post("/update", async (req, res, next) => {
     await firebaseUtils.updateJobStatus(jobId, status);
     logger.info(`Updated job status for job ID: ${jobId} to ${status}`);
 
+    // Progress updates are sent periodically while the job is processing
+    if (progress && status === "processing") {
+      await firebaseUtils.updateJobProgress(jobId, progress);
+    }
+
     // If result data is provided, update the existing job with the result data
     if (resultData && status === "completed") {
       // Get the document reference
@@ -89,6 +95,13 @@ updateRouter.post("/update", async (req, res, next) => {
       logger.info(`Updated results for job ID: ${jobId}`);
     }
 
+    // Large results are uploaded to S3 by the worker, only the key is stored
+    if (resultKey && status === "completed") {
+      await firebaseUtils.addResultKey(jobId, resultKey, resultSummary);
+
+      logger.info(`Stored result key for job ID: ${jobId}`);
+    }
+
     return res.json({
       message: "Job updated successfully",
       jobId,
@@ -46,9 +46,12 @@ export const uploadToS3 = async (fileBuffer, key) => {
  * @param {string} s3Key - The S3 key where the file is stored
  * @param {string} auth0Id - The user's Auth0 ID
  * @param {string} analysisName - The name of the analysis
+ * @param {Object} [options] - Optional job settings, left out of the message when not set
+ * @param {string} [options.analysisProfile] - 'full' or 'fast', the worker's default when not set
+ * @param {string} [options.baseJobId] - Earlier job of the same user this job extends
  * @returns {Promise<Object>} - The SQS send message result
  */
-export const sendToSQS = async (jobId, s3Key, auth0Id, analysisName) => {
+export const sendToSQS = async (jobId, s3Key, auth0Id, analysisName, { analysisProfile, baseJobId } = {}) => {
   try {
     const params = {
       QueueUrl: process.env.SQS_QUEUE_URL,
@@ -57,6 +60,8 @@ export const sendToSQS = async (jobId, s3Key, auth0Id, analysisName) => {
         s3Key,
         auth0Id,
         analysisName,
+        analysisProfile,
+        baseJobId,
         timestamp: new Date().toISOString()
       }),
       MessageGroupId: auth0Id, // Use auth0Id as group ID to ensure user's jobs are processed in order
@@ -73,6 +78,37 @@ export const sendToSQS = async (jobId, s3Key, auth0Id, analysisName) => {
   }
 };
 
+/**
+ * Tell the workers a job was deleted, so its files are taken out of their corpus indexes.
+ * It shares the user's message group, so a job still queued is processed before its deletion.
+ * @param {string} jobId - The deleted job's ID
+ * @param {string} auth0Id - The user's Auth0 ID
+ * @returns {Promise<Object>} - The SQS send message result
+ */
+export const sendDeletionToSQS = async (jobId, auth0Id) => {
+  try {
+    const params = {
+      QueueUrl: process.env.SQS_QUEUE_URL,
+      MessageBody: JSON.stringify({
+        type: "delete",
+        jobId,
+        auth0Id,
+        timestamp: new Date().toISOString()
+      }),
+      MessageGroupId: auth0Id,
+      MessageDeduplicationId: `delete-${jobId}`
+    };
+
+    const command = new SendMessageCommand(params);
+    const result = await sqsClient.send(command);
+    logger.info(`Deletion sent to SQS: ${jobId}`);
+    return result;
+  } catch (error) {
+    logger.error(`Error sending deletion to SQS: ${error.message}`);
+    throw error;
+  }
+};
+
 /**
  * Get file contents from S3
  * @param {string} key - The S3 key (path) of the file
@@ -103,6 +139,28 @@ export const getFileFromS3 = async (key) => {
   }
 };
 
+/**
+ * Open a file in S3 for streaming, without reading it into memory
+ * @param {string} key - The S3 key (path) of the file
+ * @returns {Promise<Object>} - The object's readable Body stream and its ContentType, ContentEncoding and ContentLength
+ */
+export const streamFromS3 = async (key) => {
+  try {
+    const params = {
+      Bucket: process.env.S3_BUCKET_NAME,
+      Key: key
+    };
+
+    const command = new GetObjectCommand(params);
+    const response = await s3Client.send(command);
+    logger.info(`Streaming file from S3: ${key}`);
+    return response;
+  } catch (error) {
+    logger.error(`Error streaming file from S3: ${error.message}`);
+    throw error;
+  }
+};
+
 /**
  * Delete a file from S3
  * @param {string} key - The S3 key (path) of the file to delete
@@ -128,6 +186,8 @@ export const deleteFromS3 = async (key) => {
 export default {
   uploadToS3,
   sendToSQS,
+  sendDeletionToSQS,
   getFileFromS3,
+  streamFromS3,
   deleteFromS3,
 };
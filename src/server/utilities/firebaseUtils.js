@@ -158,6 +158,28 @@ export const updateJobStatus = async (jobId, status) => {
   }
 };
 
+/**
+ * Update the progress of a running job in Firestore
+ * @param {string} jobId - The unique job ID
+ * @param {Object} progress - Per-stage progress reported by the worker
+ * @returns {Promise<void>}
+ */
+export const updateJobProgress = async (jobId, progress) => {
+  try {
+    // Get the document reference
+    const docRef = db.collection("results").doc(jobId);
+
+    // Update the progress
+    await docRef.update({
+      progress,
+      updatedAt: admin.firestore.FieldValue.serverTimestamp(),
+    });
+  } catch (error) {
+    logger.error(`Error updating progress for job ID: ${jobId}:`, error);
+    throw error;
+  }
+};
+
 /**
  * Add analysis results to an existing job in Firestore
  * @param {string} jobId - The unique job ID
@@ -182,6 +204,32 @@ export const addResults = async (jobId, resultData) => {
   }
 };
 
+/**
+ * Point an existing job at a result stored in S3
+ * @param {string} jobId - The unique job ID
+ * @param {string} resultKey - The S3 key of the gzip-compressed result JSON
+ * @param {Object} resultSummary - Small overview of the result
+ * @returns {Promise<void>}
+ */
+export const addResultKey = async (jobId, resultKey, resultSummary) => {
+  try {
+    // Get the document reference
+    const docRef = db.collection("results").doc(jobId);
+
+    // Update the document with the result location
+    await docRef.update({
+      resultKey,
+      resultSummary: resultSummary || null,
+      updatedAt: admin.firestore.FieldValue.serverTimestamp(),
+    });
+
+    logger.info(`Updated result key for job ID: ${jobId}`);
+  } catch (error) {
+    logger.error(`Error updating result key for job ID: ${jobId}:`, error);
+    throw error;
+  }
+};
+
 /**
  * Get all jobs for a specific user
  * @param {string} auth0Id - The user's Auth0 ID
@@ -328,7 +376,9 @@ export default {
   storeResults,
   getResults,
   updateJobStatus,
+  updateJobProgress,
   getUserJobs,
   addResults,
+  addResultKey,
   deleteJob,
 };